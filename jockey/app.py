@@ -5,8 +5,11 @@ from jockey.jockey_graph import build_jockey_graph
 from jockey.util import check_environment_variables
 
 from jockey.model_config import AZURE_DEPLOYMENTS, OPENAI_MODELS
+from langchain_core.messages import AIMessage
 from langgraph.graph.state import CompiledStateGraph
 from jockey.jockey_graph import PlannerResponse
+from jockey.render_jobs import RenderJob, RenderJobStatus
+from jockey.stirrups.video_editing import get_render_job_poster
 
 check_environment_variables()
 
@@ -76,3 +79,24 @@ jockey = build_jockey_graph(
     reflect_llm=reflect_llm,
     reflect_prompt=reflect_prompt,
 )
+
+
+async def post_render_to_thread(render_job: RenderJob) -> None:
+    """Post the outcome of a background render job back to the chat history of the thread that queued it."""
+    if render_job.thread_id is None:
+        return
+
+    if render_job.status == RenderJobStatus.SUCCEEDED:
+        content = f"Render job {render_job.job_id} finished: {render_job.output_filepath}"
+    else:
+        content = f"Render job {render_job.job_id} failed: {render_job.error}"
+
+    await jockey.aupdate_state(
+        {"configurable": {"thread_id": render_job.thread_id}},
+        {"chat_history": [AIMessage(content=content, name="video-editing")]},
+        as_node="reflect",
+    )
+
+
+# finished jobs are picked up from the job store, so renders of standalone workers on other hosts are posted as well
+get_render_job_poster().add_callback(post_render_to_thread)
@@ -12,11 +12,17 @@ import sys
 from typing import List
 from langchain_core.runnables.schema import StreamEvent
 from jockey.thread import session_id, thread
+from jockey.video_utils import download_m3u8_videos
+from jockey.media_config import PREMATERIALIZE_SEARCH_RESULTS
+
+SEARCH_TOOL_NAMES = ("simple-video-search", "batch-video-search")
 
 
 async def run_jockey_terminal():
     """Quickstart function to create a Jockey instance in the terminal for easy dev work."""
     console = Console()
+    # keep references to the background downloads so they aren't garbage collected before they finish
+    prematerialize_tasks = set()
 
     try:
         # Outer loop for new chat messages
@@ -45,6 +51,8 @@ async def run_jockey_terminal():
                 "clips_from_search": {},
                 "relevant_clip_keys": [],
                 "index_id": None,
+                "index_ids": None,
+                "encoding_profile": None,
             }
 
             # Process until we need human input
@@ -54,8 +62,11 @@ async def run_jockey_terminal():
                 async for event in jockey.astream_events(input=jockey_input, config=thread, version="v2"):
                     # event["chat_history"][-1].pretty_print()
                     events.append(event)
-                    # if event["event"] == "on_tool_end":
-                    # download_m3u8_videos(event)
+                    if PREMATERIALIZE_SEARCH_RESULTS and event["event"] == "on_tool_end" and event["name"] in SEARCH_TOOL_NAMES:
+                        # download search results in the background so they're ready when the user asks for an edit
+                        prematerialize_task = asyncio.create_task(download_m3u8_videos(event))
+                        prematerialize_tasks.add(prematerialize_task)
+                        prematerialize_task.add_done_callback(prematerialize_tasks.discard)
                     await parse_langchain_events_terminal(event)
 
             except asyncio.CancelledError:
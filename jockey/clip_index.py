@@ -0,0 +1,323 @@
+import os
+import re
+import json
+import asyncio
+import functools
+import importlib
+import requests
+import numpy as np
+from typing import Dict, List, Protocol, Sequence, Set, Tuple, Union
+from jockey.media_config import CLIP_EMBEDDER, CLIP_INDEX_ANN_THRESHOLD
+from jockey.video_utils import INDEX_URL, TL_BASE_URL
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+EMBED_URL = f"{TL_BASE_URL}embed"
+EMBEDDING_MODEL_NAME = "Marengo-retrieval-2.7"
+# once a clip index is saved in more chunk files than this, they are merged into one
+MAX_CHUNK_FILES = 64
+
+# (index_id, video_id, start, end)
+ClipKey = Tuple[str, str, float, float]
+
+
+def clip_key(index_id: str, clip) -> ClipKey:
+    """Key of a search result clip, given as a Clip or a dict. Clips with their own `index_id` are keyed by it."""
+    clip = clip if isinstance(clip, dict) else clip.model_dump()
+    return (clip.get("index_id") or index_id, clip["video_id"], float(clip["start"]), float(clip["end"]))
+
+
+class Embedder(Protocol):
+    """Turns text queries and clips into vectors of one embedding space.
+
+    `name` identifies the space, a stored clip index is discarded when it was built by an embedder with another name.
+    """
+
+    name: str
+
+    async def embed_texts(self, texts: Sequence[str]) -> np.ndarray:
+        """One row per text."""
+        ...
+
+    async def embed_clips(self, keys: Sequence[ClipKey]) -> List[Union[np.ndarray, None]]:
+        """One vector per clip, or None for clips that can't be embedded."""
+        ...
+
+
+def _segment_vector(segment: Dict) -> List[float]:
+    # the embedding field is named differently across API versions
+    return segment.get("float") or segment.get("embeddings_float")
+
+
+class TwelveLabsEmbedder:
+    """Embeds queries with the Twelve Labs embed API and clips with the segment embeddings Marengo stored for their video.
+
+    A clip's vector is the mean of the video segments it overlaps, so embedding a clip never needs the video itself.
+    Videos must be indexed with the `visual-text` embedding option.
+    """
+
+    name = EMBEDDING_MODEL_NAME
+
+    def __init__(self) -> None:
+        self._video_segments: Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _headers(self) -> Dict:
+        return {"accept": "application/json", "x-api-key": os.environ["TWELVE_LABS_API_KEY"]}
+
+    def _embed_text(self, text: str) -> np.ndarray:
+        response = requests.post(EMBED_URL, data={"model_name": self.name, "text": text}, headers=self._headers())
+        response.raise_for_status()
+        text_embedding = response.json()["text_embedding"]
+        return np.asarray(_segment_vector(text_embedding.get("segments", [text_embedding])[0]), dtype=np.float32)
+
+    async def embed_texts(self, texts: Sequence[str]) -> np.ndarray:
+        return np.stack(await asyncio.gather(*[asyncio.to_thread(self._embed_text, text) for text in texts]))
+
+    def _fetch_video_segments(self, index_id: str, video_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the (start, end) offsets and the vectors of the visual-text segments of a video."""
+        response = requests.get(f"{INDEX_URL}{index_id}/videos/{video_id}", params={"embedding_option": "visual-text"}, headers=self._headers())
+        response.raise_for_status()
+        segments = [
+            segment
+            for segment in response.json()["embedding"]["video_embedding"]["segments"]
+            if segment.get("embedding_option", "visual-text") == "visual-text"
+        ]
+        offsets = np.asarray([(segment["start_offset_sec"], segment["end_offset_sec"]) for segment in segments], dtype=np.float32)
+        vectors = np.asarray([_segment_vector(segment) for segment in segments], dtype=np.float32)
+        return offsets, vectors
+
+    async def embed_clips(self, keys: Sequence[ClipKey]) -> List[Union[np.ndarray, None]]:
+        videos = list(dict.fromkeys((index_id, video_id) for index_id, video_id, _, _ in keys if (index_id, video_id) not in self._video_segments))
+        fetched = await asyncio.gather(*[asyncio.to_thread(self._fetch_video_segments, *video) for video in videos], return_exceptions=True)
+        for video, video_segments in zip(videos, fetched):
+            if isinstance(video_segments, Exception):
+                print(f"[WARNING] Failed to get the embeddings of Video ID {video[1]}: {video_segments}")
+                continue
+            self._video_segments[video] = video_segments
+
+        vectors = []
+        for index_id, video_id, start, end in keys:
+            if (index_id, video_id) not in self._video_segments or len(self._video_segments[(index_id, video_id)][1]) == 0:
+                vectors.append(None)
+                continue
+            offsets, segment_vectors = self._video_segments[(index_id, video_id)]
+            overlapping = (offsets[:, 0] < end) & (offsets[:, 1] > start)
+            if not overlapping.any():
+                # the clip falls between segments, use the closest one
+                distances = np.abs(offsets.mean(axis=1) - (start + end) / 2)
+                overlapping = distances == distances.min()
+            vectors.append(segment_vectors[overlapping].mean(axis=0))
+        return vectors
+
+
+def load_embedder(spec: str = CLIP_EMBEDDER) -> Embedder:
+    """Build the embedder named by `JOCKEY_CLIP_EMBEDDER`: `twelvelabs`, or `package.module:factory` for a local embedder
+    whose factory takes no arguments."""
+    if spec == "twelvelabs":
+        return TwelveLabsEmbedder()
+    module_name, _, factory_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), factory_name)()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class ClipIndex:
+    """Embeddings of the clips seen in search results, kept as one L2-normalized NumPy matrix so a follow-up like
+    "now only the ones outdoors" is a matrix-vector product instead of another search.
+
+    Every `add` saves its rows, with the key and search result of each, as a new chunk file, so saving costs O(new clips)
+    however large the index is. Each chunk is written in one step, so a crash never pairs a matrix with the wrong clips,
+    and once there are `MAX_CHUNK_FILES` of them they are merged into one.
+    Top-k over a subset of clips is exact. Over all clips it switches to an hnswlib ANN index once there are
+    `ann_threshold` clips, if hnswlib is installed; rows added after the ANN index was built are searched exactly.
+
+    Args:
+        directory (str): Directory the index is saved in.
+        embedder (Embedder): Embedder for queries and clips.
+        ann_threshold (int): Number of clips from which searches over all clips use the ANN index.
+    """
+
+    def __init__(self, directory: str, embedder: Embedder, ann_threshold: int = CLIP_INDEX_ANN_THRESHOLD) -> None:
+        self.directory = directory
+        self.embedder = embedder
+        self.ann_threshold = ann_threshold
+        self._lock = asyncio.Lock()
+        self._ann_lock = asyncio.Lock()
+        self._warm_tasks: Set[asyncio.Task] = set()
+        self._ann_index = None
+        self._ann_rows = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.clips: List[Dict] = []
+        self._rows: Dict[ClipKey, int] = {}
+        self._chunk_numbers: List[int] = []
+        self._load()
+
+    def _chunk_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"chunk-{number:08d}.npz")
+
+    def _load(self) -> None:
+        self._chunk_numbers = sorted(int(name[6:-4]) for name in os.listdir(self.directory) if re.fullmatch(r"chunk-\d+\.npz", name))
+        chunk_embeddings = []
+        for number in self._chunk_numbers:
+            with np.load(self._chunk_path(number), allow_pickle=False) as stored:
+                embeddings = stored["embeddings"]
+                metadata = json.loads(str(stored["metadata"]))
+            # vectors of another embedder live in another space, leave them out
+            if metadata["embedder"] != self.embedder.name:
+                continue
+            if not len(metadata["keys"]) == len(metadata["clips"]) == embeddings.shape[0]:
+                print(f"[WARNING] Discarding chunk {number} of the clip index in {self.directory}, its rows don't match its clips.")
+                continue
+
+            # a merge of the chunks that was interrupted leaves rows in two chunks
+            new_rows = []
+            for row, (key, clip) in enumerate(zip(metadata["keys"], metadata["clips"])):
+                if tuple(key) not in self._rows:
+                    self._rows[tuple(key)] = len(self.clips)
+                    self.clips.append(clip)
+                    new_rows.append(row)
+            chunk_embeddings.append(embeddings[new_rows])
+        if self._rows:
+            self.embeddings = np.concatenate(chunk_embeddings)
+
+    def _write_chunk(self, number: int, embeddings: np.ndarray, keys: Sequence[ClipKey], clips: Sequence[Dict]) -> None:
+        metadata = json.dumps({"embedder": self.embedder.name, "keys": keys, "clips": clips})
+        temporary_chunk_path = f"{self._chunk_path(number)}.part"
+        with open(temporary_chunk_path, "wb") as chunk_file:
+            np.savez(chunk_file, embeddings=embeddings, metadata=np.asarray(metadata))
+        os.replace(temporary_chunk_path, self._chunk_path(number))
+
+    def _save(self, new_keys: Sequence[ClipKey]) -> None:
+        """Save the rows of `new_keys`, the last rows of the index, as a new chunk, and merge the chunks once there are too many."""
+        number = (self._chunk_numbers[-1] if self._chunk_numbers else 0) + 1
+        if len(self._chunk_numbers) < MAX_CHUNK_FILES:
+            first_row = len(self.clips) - len(new_keys)
+            self._write_chunk(number, self.embeddings[first_row:], new_keys, self.clips[first_row:])
+            self._chunk_numbers.append(number)
+            return
+
+        # the merged chunk is written before the others are removed, loading skips the rows it repeats.
+        # rows are added to `_rows` in order, so its keys are in row order
+        self._write_chunk(number, self.embeddings, list(self._rows), self.clips)
+        for merged_number in self._chunk_numbers:
+            os.remove(self._chunk_path(merged_number))
+        self._chunk_numbers = [number]
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: ClipKey) -> bool:
+        return key in self._rows
+
+    async def add(self, index_id: str, clips: Sequence) -> int:
+        """Embed the clips that aren't in the index yet and save the index. Returns the number of clips that were added."""
+        async with self._lock:
+            new_clips = {}
+            for clip in clips:
+                key = clip_key(index_id, clip)
+                if key not in self._rows:
+                    new_clips[key] = clip if isinstance(clip, dict) else clip.model_dump()
+            if not new_clips:
+                return 0
+
+            vectors = await self.embedder.embed_clips(list(new_clips))
+            embedded = [(key, vector) for key, vector in zip(new_clips, vectors) if vector is not None]
+            if not embedded:
+                return 0
+
+            new_embeddings = _normalize(np.stack([vector for _, vector in embedded]).astype(np.float32))
+            self.embeddings = np.concatenate([self.embeddings, new_embeddings]) if len(self._rows) else new_embeddings
+            for key, _ in embedded:
+                self._rows[key] = len(self.clips)
+                self.clips.append({**new_clips[key], "index_id": key[0]})
+
+            await asyncio.to_thread(self._save, [key for key, _ in embedded])
+            return len(embedded)
+
+    def warm(self, index_id: str, clips: Sequence) -> asyncio.Task:
+        """Embed clips in the background, e.g. right after a search, so a later rerank doesn't wait for them."""
+        task = asyncio.create_task(self.add(index_id, clips))
+        self._warm_tasks.add(task)
+        task.add_done_callback(self._warm_tasks.discard)
+        return task
+
+    def _ann_index_is_stale(self) -> bool:
+        # rebuild once the index grew by a quarter, rows added since are searched exactly
+        return self._ann_index is None or len(self._rows) > self._ann_rows * 1.25
+
+    def _build_ann_index(self) -> None:
+        embeddings = self.embeddings
+        ann_index = hnswlib.Index(space="ip", dim=embeddings.shape[1])
+        ann_index.init_index(max_elements=len(embeddings), ef_construction=200, M=16)
+        ann_index.add_items(embeddings, np.arange(len(embeddings)))
+        self._ann_index, self._ann_rows = ann_index, len(embeddings)
+
+    def _uses_ann_index(self, keys: Union[Sequence[ClipKey], None]) -> bool:
+        return keys is None and hnswlib is not None and len(self._rows) >= self.ann_threshold
+
+    def _ann_top_k(self, query_vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self._ann_index_is_stale():
+            self._build_ann_index()
+        self._ann_index.set_ef(max(50, 2 * k))
+        labels, distances = self._ann_index.knn_query(query_vector, k=min(k, self._ann_rows))
+        rows, scores = labels[0].astype(np.int64), 1 - distances[0]
+        if len(self._rows) > self._ann_rows:
+            tail_rows = np.arange(self._ann_rows, len(self._rows))
+            rows = np.concatenate([rows, tail_rows])
+            scores = np.concatenate([scores, self.embeddings[tail_rows] @ query_vector])
+        return rows, scores
+
+    def top_k(self, query_vector: np.ndarray, k: int, keys: Union[Sequence[ClipKey], None] = None) -> List[Tuple[Dict, float]]:
+        """Get the k clips most similar to a query vector by cosine similarity, best first.
+
+        Args:
+            keys (Sequence[ClipKey], optional): Only rank these clips. Keys that aren't in the index are skipped.
+
+        Returns:
+            List[Tuple[Dict, float]]: The stored search result of each clip and its similarity to the query.
+        """
+        if not self._rows:
+            return []
+        query_vector = _normalize(np.asarray(query_vector, dtype=np.float32))
+
+        if self._uses_ann_index(keys):
+            rows, scores = self._ann_top_k(query_vector, k)
+        else:
+            rows = np.arange(len(self._rows)) if keys is None else np.asarray([self._rows[key] for key in keys if key in self._rows], dtype=np.int64)
+            if len(rows) == 0:
+                return []
+            scores = self.embeddings[rows] @ query_vector
+
+        # argpartition finds the top k in linear time, only those are sorted
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.clips[rows[position]], float(scores[position])) for position in top]
+
+    async def query(self, query: str, k: int, keys: Union[Sequence[ClipKey], None] = None) -> List[Tuple[Dict, float]]:
+        """Embed a text query and get the k most similar clips, see `top_k`."""
+        query_vector = (await self.embedder.embed_texts([query]))[0]
+        if self._uses_ann_index(keys) and self._ann_index_is_stale():
+            # building the ANN index of a large index takes seconds, keep it off the event loop
+            async with self._ann_lock:
+                if self._ann_index_is_stale():
+                    await asyncio.to_thread(self._build_ann_index)
+        return self.top_k(query_vector, k, keys)
+
+
+@functools.lru_cache(maxsize=None)
+def _clip_index(root: str) -> ClipIndex:
+    return ClipIndex(os.path.join(root, ".jockey", "clip_index"), load_embedder())
+
+
+def get_clip_index() -> ClipIndex:
+    """Get the shared clip index, stored next to the media cache under `HOST_PUBLIC_DIR`."""
+    return _clip_index(os.environ["HOST_PUBLIC_DIR"])
@@ -0,0 +1,270 @@
+import bisect
+import numpy as np
+from typing import Dict, List, Sequence, Tuple, Union
+from pydantic import BaseModel, Field
+
+
+class SourceSpan(BaseModel):
+    """A contiguous span of a source video that is downloaded and cut exactly once."""
+
+    video_id: str = Field(description="A UUID for the video the span belongs to.")
+    start: float = Field(description="The start time of the span in seconds.")
+    end: float = Field(description="The end time of the span in seconds.")
+
+
+class PlannedSegment(BaseModel):
+    """A piece of the output video, taken from one of the spans of a RenderPlan."""
+
+    span_index: int = Field(description="Index of the SourceSpan this segment is taken from.")
+    start: float = Field(description="The start time of the segment in seconds, relative to the source video.")
+    end: float = Field(description="The end time of the segment in seconds, relative to the source video.")
+
+
+class RenderPlan(BaseModel):
+    """Which source spans to cut and in what order their segments are played back."""
+
+    spans: List[SourceSpan]
+    segments: List[PlannedSegment]
+
+
+def merge_intervals(intervals: Sequence[Sequence[float]], gap: float = 0.0) -> List[List[float]]:
+    """Merge overlapping intervals and intervals that are at most `gap` seconds apart.
+
+    Examples:
+        >>> merge_intervals([(9, 12), (0, 5), (5.5, 7)], gap=1)
+        [[0, 7], [9, 12]]
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def plan_clip_renders(clips: Sequence, merge_gap: Union[float, None] = None) -> RenderPlan:
+    """Plan which source spans to cut for a list of clips while preserving their playback order.
+
+    When `merge_gap` is None every clip is cut and played back as-is. Otherwise:
+        1. consecutive clips from the same video that overlap or are at most `merge_gap` seconds apart are played back as one segment.
+        2. segments are grouped by video_id and overlapping or near-adjacent segments share a single source span,
+           so each span is downloaded and cut once no matter how often it is used in the output.
+
+    Args:
+        clips (Sequence): Clips in playback order. Anything with `video_id`, `start` and `end` attributes works.
+        merge_gap (float, optional): Maximum distance in seconds between two intervals that are still merged.
+
+    Returns:
+        RenderPlan: The spans to cut and the ordered segments of the output video.
+    """
+    if merge_gap is None:
+        spans = [SourceSpan(video_id=clip.video_id, start=clip.start, end=clip.end) for clip in clips]
+        segments = [PlannedSegment(span_index=index, start=clip.start, end=clip.end) for index, clip in enumerate(clips)]
+        return RenderPlan(spans=spans, segments=segments)
+
+    # coalesce consecutive clips in playback order, never moving backwards in the source video
+    playback = []
+    for clip in clips:
+        previous = playback[-1] if playback else None
+        if previous and previous[0] == clip.video_id and previous[1] <= clip.start <= previous[2] + merge_gap:
+            previous[2] = max(previous[2], clip.end)
+        else:
+            playback.append([clip.video_id, clip.start, clip.end])
+
+    # merge the intervals of each video into the spans that are actually cut
+    intervals_by_video: Dict[str, List[List[float]]] = {}
+    for video_id, start, end in playback:
+        intervals_by_video.setdefault(video_id, []).append([start, end])
+
+    spans = []
+    span_indices_by_video: Dict[str, List[int]] = {}
+    for video_id, intervals in intervals_by_video.items():
+        for start, end in merge_intervals(intervals, gap=merge_gap):
+            span_indices_by_video.setdefault(video_id, []).append(len(spans))
+            spans.append(SourceSpan(video_id=video_id, start=start, end=end))
+
+    segments = []
+    for video_id, start, end in playback:
+        span_index = next(index for index in span_indices_by_video[video_id] if spans[index].start <= start and end <= spans[index].end)
+        segments.append(PlannedSegment(span_index=span_index, start=start, end=end))
+
+    return RenderPlan(spans=spans, segments=segments)
+
+
+class CutPiece(BaseModel):
+    """A piece of a smart cut, either stream-copied from the source or re-encoded."""
+
+    start: float = Field(description="The start time of the piece in seconds, relative to the source video.")
+    end: float = Field(description="The end time of the piece in seconds, relative to the source video.")
+    copy_stream: bool = Field(description="Stream-copy the piece. Otherwise only this piece is re-encoded.")
+
+
+def plan_smart_cut(keep_ranges: Sequence[Sequence[float]], keyframes: Sequence[float], duration: Union[float, None] = None) -> List[CutPiece]:
+    """Plan how to cut ranges out of a video while re-encoding as little as possible.
+
+    Stream copy can only start on a keyframe, so each range is split into a re-encoded head up to its first keyframe,
+    a stream-copied middle between keyframes, and a re-encoded tail after its last keyframe.
+    Ranges without a keyframe inside them are re-encoded whole.
+
+    Args:
+        keep_ranges (Sequence): (start, end) ranges in seconds to keep, in output order.
+        keyframes (Sequence[float]): Sorted keyframe timestamps of the source video in seconds.
+        duration (float, optional): Duration of the source video. A range that runs to the end of the video is copied to the end.
+
+    Examples:
+        >>> [(piece.start, piece.end, piece.copy_stream) for piece in plan_smart_cut([(1, 7)], keyframes=[0, 2, 4, 6, 8])]
+        [(1.0, 2.0, False), (2.0, 6.0, True), (6.0, 7.0, False)]
+    """
+    pieces = []
+    for start, end in keep_ranges:
+        if end <= start:
+            continue
+
+        first_keyframe_index = bisect.bisect_left(keyframes, start)
+        copy_start = keyframes[first_keyframe_index] if first_keyframe_index < len(keyframes) else None
+        if duration is not None and end >= duration:
+            copy_end = end
+        else:
+            last_keyframe_index = bisect.bisect_right(keyframes, end) - 1
+            copy_end = keyframes[last_keyframe_index] if last_keyframe_index >= 0 else None
+
+        if copy_start is None or copy_end is None or copy_end <= copy_start:
+            pieces.append(CutPiece(start=start, end=end, copy_stream=False))
+            continue
+
+        if start < copy_start:
+            pieces.append(CutPiece(start=start, end=copy_start, copy_stream=False))
+        pieces.append(CutPiece(start=copy_start, end=copy_end, copy_stream=True))
+        if copy_end < end:
+            pieces.append(CutPiece(start=copy_end, end=end, copy_stream=False))
+
+    return pieces
+
+
+def temporal_iou(starts: np.ndarray, ends: np.ndarray, other_starts: np.ndarray, other_ends: np.ndarray) -> np.ndarray:
+    """Intersection over union of every interval with every other interval, as a (len(starts), len(other_starts)) matrix.
+
+    Examples:
+        >>> temporal_iou(np.array([0.0]), np.array([10.0]), np.array([5.0, 20.0]), np.array([15.0, 30.0]))
+        array([[0.33333333, 0.        ]])
+    """
+    intersection = np.clip(np.minimum(ends[:, None], other_ends[None, :]) - np.maximum(starts[:, None], other_starts[None, :]), 0, None)
+    union = (ends - starts)[:, None] + (other_ends - other_starts)[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def suppress_overlaps(
+    video_ids: Sequence[str],
+    starts: Sequence[float],
+    ends: Sequence[float],
+    iou_threshold: float,
+    kept: Sequence[Tuple[str, float, float]] = (),
+) -> np.ndarray:
+    """Temporal non-maximum suppression: drop every clip that overlaps a better clip of the same video by more than
+    `iou_threshold` intersection over union.
+
+    Args:
+        video_ids, starts, ends: The clips, best first.
+        iou_threshold (float): Largest overlap two kept clips of the same video may have.
+        kept (Sequence[Tuple[str, float, float]]): (video_id, start, end) of clips that were kept earlier and rank above
+            all of these, e.g. the previous pages of a search.
+
+    Returns:
+        np.ndarray: A boolean mask of the clips to keep.
+
+    Examples:
+        >>> suppress_overlaps(["a", "a", "b", "a"], [0, 1, 1, 10], [10, 10, 10, 20], iou_threshold=0.5).tolist()
+        [True, False, True, True]
+    """
+    starts, ends = np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64)
+    kept_video_ids = [video_id for video_id, _, _ in kept]
+    all_video_ids = np.asarray([*kept_video_ids, *video_ids])
+    all_starts = np.concatenate([np.asarray([start for _, start, _ in kept], dtype=np.float64), starts])
+    all_ends = np.concatenate([np.asarray([end for _, _, end in kept], dtype=np.float64), ends])
+
+    # clips of different videos never overlap
+    overlaps = (temporal_iou(starts, ends, all_starts, all_ends) > iou_threshold) & (np.asarray(video_ids)[:, None] == all_video_ids[None, :])
+    suppressed = overlaps[:, : len(kept)].any(axis=1)
+    overlaps = overlaps[:, len(kept) :]
+
+    keep = np.zeros(len(starts), dtype=bool)
+    for index in range(len(starts)):
+        if not suppressed[index]:
+            keep[index] = True
+            suppressed |= overlaps[index]
+    return keep
+
+
+def knee_cutoff(scores: Sequence[float], sensitivity: float) -> int:
+    """Find where scores sorted best first drop off, and return how many scores come before the drop.
+
+    The scores are scaled to the unit square, the knee is the score that lies furthest below the straight line from the
+    best to the worst score. Without a knee deeper than `sensitivity` every score is kept.
+
+    Examples:
+        >>> knee_cutoff([90, 88, 86, 40, 38, 37, 36], sensitivity=0.2)
+        3
+        >>> knee_cutoff([90, 80, 70, 60, 50], sensitivity=0.2)
+        5
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) < 3 or scores[0] == scores[-1]:
+        return len(scores)
+    positions = np.linspace(0, 1, len(scores))
+    scaled_scores = (scores - scores[-1]) / (scores[0] - scores[-1])
+    depths = (1 - positions) - scaled_scores
+    knee = int(np.argmax(depths))
+    return knee if depths[knee] > sensitivity else len(scores)
+
+
+def filter_clip_results(
+    results: List[Dict],
+    iou_threshold: Union[float, None] = None,
+    min_score: Union[float, None] = None,
+    knee_sensitivity: Union[float, None] = None,
+    kept: Sequence[Dict] = (),
+) -> Tuple[List[Dict], bool]:
+    """Drop clip search results that won't be used: clips scored below `min_score`, clips that overlap a better clip of
+    the same video (see `suppress_overlaps`) and the clips after the knee of the scores (see `knee_cutoff`).
+    Search results are filtered before their video metadata is fetched, so dropped results cost nothing.
+
+    Args:
+        results (List[Dict]): Clip results with `video_id`, `start`, `end` and `score`, best first.
+        iou_threshold, min_score, knee_sensitivity (float, optional): None turns the step off.
+        kept (Sequence[Dict]): Results that were kept earlier and rank above all of these, e.g. the previous pages of a search.
+            They are taken into account for overlaps and the knee, but not returned.
+
+    Returns:
+        Tuple[List[Dict], bool]: The results to keep, and whether every result ranked below these would be dropped too,
+            in which case the search doesn't need to fetch more of them.
+    """
+    if not results:
+        return results, False
+    scores = np.asarray([result.get("score", 0) for result in results], dtype=np.float64)
+    keep = np.ones(len(results), dtype=bool)
+    exhausted = False
+
+    if min_score is not None:
+        keep &= scores >= min_score
+        exhausted = bool(scores[-1] < min_score)
+
+    if iou_threshold is not None:
+        candidates = np.flatnonzero(keep)
+        keep[candidates] = suppress_overlaps(
+            [results[index]["video_id"] for index in candidates],
+            [results[index]["start"] for index in candidates],
+            [results[index]["end"] for index in candidates],
+            iou_threshold,
+            [(result["video_id"], result["start"], result["end"]) for result in kept],
+        )
+
+    if knee_sensitivity is not None:
+        candidates = np.flatnonzero(keep)
+        kept_scores = [result.get("score", 0) for result in kept]
+        cutoff = knee_cutoff([*kept_scores, *scores[candidates]], knee_sensitivity) - len(kept_scores)
+        if cutoff < len(candidates):
+            keep[candidates[max(cutoff, 0) :]] = False
+            exhausted = True
+
+    return [result for result, keep_result in zip(results, keep) if keep_result], exhausted
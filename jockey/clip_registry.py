@@ -0,0 +1,166 @@
+import bisect
+import numpy as np
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+from jockey.clip_table import ClipTable
+
+
+class _ClipLog:
+    """Append-only storage of the clips of a session, shared by every version of a ClipRegistry.
+
+    Clips are appended as chunks, one per merged tool call, and numbered by their position in the log. The indexes only
+    ever grow, so a version that has seen the first n rows reads them by ignoring every row from n on.
+    """
+
+    def __init__(self) -> None:
+        self.chunks: List[ClipTable] = []
+        self.chunk_tool_call_ids: List[str] = []
+        self.chunk_offsets: List[int] = []
+        self.row_count = 0
+        # (tool_call_id, video_id, start, end) of every row, clips are unique per tool call
+        self.keys: Dict[Tuple[str, str, float, float], int] = {}
+        self.tool_call_chunks: Dict[str, List[int]] = {}
+        # rows, starts and ends of the clips of each video, in log order
+        self.video_rows: Dict[str, Tuple[List[int], List[float], List[float]]] = {}
+
+    def append(self, tool_call_id: str, clips: ClipTable) -> None:
+        """Append the clips of a tool call that aren't in the log yet."""
+        new_rows = []
+        for row, key in enumerate(zip(clips.column("video_id"), clips.starts.tolist(), clips.ends.tolist())):
+            if (tool_call_id, *key) not in self.keys:
+                self.keys[(tool_call_id, *key)] = self.row_count + len(new_rows)
+                new_rows.append(row)
+        if not new_rows:
+            return
+
+        chunk = clips if len(new_rows) == len(clips) else clips.take(new_rows)
+        self.tool_call_chunks.setdefault(tool_call_id, []).append(len(self.chunks))
+        for row, (video_id, start, end) in enumerate(zip(chunk.column("video_id"), chunk.starts.tolist(), chunk.ends.tolist())):
+            rows, starts, ends = self.video_rows.setdefault(video_id, ([], [], []))
+            rows.append(self.row_count + row)
+            starts.append(start)
+            ends.append(end)
+        self.chunks.append(chunk)
+        self.chunk_tool_call_ids.append(tool_call_id)
+        self.chunk_offsets.append(self.row_count)
+        self.row_count += len(chunk)
+
+    def rows(self, rows: Sequence[int]) -> ClipTable:
+        """Get the clips at the given log positions, in order."""
+        tables = []
+        for row in rows:
+            chunk_index = bisect.bisect_right(self.chunk_offsets, row) - 1
+            if tables and tables[-1][0] == chunk_index:
+                tables[-1][1].append(row - self.chunk_offsets[chunk_index])
+            else:
+                tables.append((chunk_index, [row - self.chunk_offsets[chunk_index]]))
+        return ClipTable.concat([self.chunks[chunk_index].take(chunk_rows) for chunk_index, chunk_rows in tables])
+
+
+class ClipRegistry(Mapping):
+    """The clips found in a session by tool call ID, as an immutable mapping of tool call IDs to ClipTables.
+
+    Every version of the registry shares one append-only `_ClipLog` and only remembers how many chunks of it are its own,
+    so merging new clips costs O(new clips) however long the session is, and earlier versions, like the ones kept in
+    checkpoints, never change. Merging into an earlier version, e.g. after going back to a checkpoint, starts a new log
+    from the chunks of that version.
+
+    Besides the mapping, the registry is indexed by video for `clips_for_video` and `overlapping` lookups.
+
+    Args:
+        tool_call_ids (Sequence[str]): The tool call ID of every chunk, as returned by `model_dump`.
+        chunks (Sequence[ClipTable]): The clips of every chunk.
+    """
+
+    def __init__(self, tool_call_ids: Sequence[str] = (), chunks: Sequence[ClipTable] = ()) -> None:
+        self._log = _ClipLog()
+        for tool_call_id, chunk in zip(tool_call_ids, chunks):
+            self._log.append(tool_call_id, ClipTable.from_clips(chunk))
+        self._chunk_count = len(self._log.chunks)
+        self._row_count = self._log.row_count
+        self._tables: Dict[str, ClipTable] = {}
+
+    @classmethod
+    def _version(cls, log: _ClipLog) -> "ClipRegistry":
+        registry = cls.__new__(cls)
+        registry._log = log
+        registry._chunk_count = len(log.chunks)
+        registry._row_count = log.row_count
+        registry._tables = {}
+        return registry
+
+    def merge(self, updates: Mapping) -> "ClipRegistry":
+        """Get a new version of the registry with the clips of `updates`, tool call IDs mapped to clips or ClipTables.
+        Clips a tool call already has, by video ID, start and end, are skipped."""
+        if updates is self or not updates:
+            return self
+
+        log = self._log
+        if self._chunk_count != len(log.chunks):
+            # a later version was merged into the shared log already, fork it
+            log = _ClipLog()
+            for chunk_index in range(self._chunk_count):
+                log.append(self._log.chunk_tool_call_ids[chunk_index], self._log.chunks[chunk_index])
+
+        for tool_call_id, clips in updates.items():
+            log.append(tool_call_id, ClipTable.from_clips(clips if isinstance(clips, (list, ClipTable)) else [clips]))
+        return ClipRegistry._version(log)
+
+    def __getitem__(self, tool_call_id: str) -> ClipTable:
+        if tool_call_id not in self._tables:
+            chunk_indices = [chunk_index for chunk_index in self._log.tool_call_chunks.get(tool_call_id, []) if chunk_index < self._chunk_count]
+            if not chunk_indices:
+                raise KeyError(tool_call_id)
+            self._tables[tool_call_id] = ClipTable.concat([self._log.chunks[chunk_index] for chunk_index in chunk_indices])
+        return self._tables[tool_call_id]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(dict.fromkeys(self._log.chunk_tool_call_ids[: self._chunk_count]))
+
+    def __len__(self) -> int:
+        return len(set(self._log.chunk_tool_call_ids[: self._chunk_count]))
+
+    def __copy__(self) -> "ClipRegistry":
+        return self
+
+    def __deepcopy__(self, memo: Dict) -> "ClipRegistry":
+        # nothing ever changes a version in place
+        return self
+
+    def __repr__(self) -> str:
+        return f"ClipRegistry({ {tool_call_id: len(self[tool_call_id]) for tool_call_id in self} })"
+
+    def _video_rows(self, video_id: str) -> Tuple[List[int], np.ndarray, np.ndarray]:
+        rows, starts, ends = self._log.video_rows.get(video_id, ([], [], []))
+        # rows are appended in order, the ones past this version belong to later versions
+        count = bisect.bisect_left(rows, self._row_count)
+        return rows[:count], np.asarray(starts[:count], dtype=np.float64), np.asarray(ends[:count], dtype=np.float64)
+
+    def clips_for_video(self, video_id: str) -> ClipTable:
+        """Get every clip of a video, across tool calls, in the order they were found."""
+        rows, _, _ = self._video_rows(video_id)
+        return self._log.rows(rows)
+
+    def overlapping(self, video_id: str, start: float, end: float) -> ClipTable:
+        """Get the clips of a video that overlap the range from `start` to `end` seconds, across tool calls."""
+        rows, starts, ends = self._video_rows(video_id)
+        overlaps = (starts < end) & (ends > start)
+        return self._log.rows([row for row, overlap in zip(rows, overlaps.tolist()) if overlap])
+
+    def select(self, tool_call_ids: Iterable[str]) -> ClipTable:
+        """Get the clips of several tool calls as one table, in the order of `tool_call_ids`. Unknown IDs are skipped."""
+        return ClipTable.concat([self[tool_call_id] for tool_call_id in tool_call_ids if tool_call_id in self])
+
+    def model_dump(self) -> Dict:
+        """The chunks of this version, which rebuild it as `ClipRegistry(**chunks)`."""
+        return {
+            "tool_call_ids": self._log.chunk_tool_call_ids[: self._chunk_count],
+            "chunks": self._log.chunks[: self._chunk_count],
+        }
+
+
+def as_clip_registry(clips: Union[ClipRegistry, Mapping, None]) -> ClipRegistry:
+    """Get a registry for a mapping of tool call IDs to clips, e.g. the plain dict a graph run is started with."""
+    if isinstance(clips, ClipRegistry):
+        return clips
+    return ClipRegistry().merge(clips or {})
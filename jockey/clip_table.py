@@ -0,0 +1,152 @@
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Sequence, Union
+from jockey.stirrups.video_editing import Clip
+
+# the string fields of a clip, stored as codes into the string pool of a table
+STRING_FIELDS = ("video_id", "index_id", "confidence", "video_title", "video_url", "thumbnail_url")
+
+
+class ClipTable:
+    """An immutable list of clips stored column by column.
+
+    Times and scores are NumPy arrays and the string fields are int32 codes into a pool in which every video ID, title and
+    URL is stored once, however many clips share it. `metadata` is kept as the objects the search returned. Tables
+    derived from a table share its columns, so copying one is free and `Clip` objects only exist for the clips that are
+    read, built without validation.
+
+    A table supports `len`, iteration and indexing like a list of clips, slicing returns a table. `model_dump` returns
+    the columns, so the LangGraph checkpointer serializes a table as a few arrays instead of one model per clip.
+    """
+
+    __slots__ = ("starts", "ends", "scores", "codes", "strings", "metadata")
+
+    def __init__(
+        self,
+        starts: Sequence[float] = (),
+        ends: Sequence[float] = (),
+        scores: Sequence[float] = (),
+        codes: Union[np.ndarray, Sequence[Sequence[int]]] = (),
+        strings: Sequence[str] = (),
+        metadata: Sequence[list] = (),
+    ) -> None:
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.scores = np.asarray(scores, dtype=np.float64)
+        self.codes = np.asarray(codes, dtype=np.int32).reshape(-1, len(STRING_FIELDS))
+        self.strings = strings if isinstance(strings, tuple) else tuple(strings)
+        self.metadata = metadata if isinstance(metadata, tuple) else tuple(metadata)
+
+    @classmethod
+    def from_clips(cls, clips: Iterable[Union[Clip, Dict]]) -> "ClipTable":
+        """Build a table from clips or search result dicts. A ClipTable is returned as is."""
+        if isinstance(clips, ClipTable):
+            return clips
+
+        pool: Dict[str, int] = {}
+        starts, ends, scores, codes, metadata = [], [], [], [], []
+        for clip in clips:
+            get = clip.get if isinstance(clip, dict) else lambda field, default=None, clip=clip: getattr(clip, field, default)
+            starts.append(get("start"))
+            ends.append(get("end"))
+            scores.append(get("score", 0.0))
+            codes.append([pool.setdefault(get(field), len(pool)) if get(field) is not None else -1 for field in STRING_FIELDS])
+            metadata.append(get("metadata", []))
+        return cls(starts, ends, scores, codes, tuple(pool), tuple(metadata))
+
+    @classmethod
+    def concat(cls, tables: Sequence["ClipTable"]) -> "ClipTable":
+        """Join tables into one, in order. Their string pools are merged so every string is still stored once."""
+        tables = [table for table in tables if len(table)]
+        if not tables:
+            return cls()
+        if len(tables) == 1:
+            return tables[0]
+
+        pool: Dict[str, int] = {}
+        codes = []
+        for table in tables:
+            # the trailing -1 maps the code of a missing string to itself
+            remap = np.asarray([pool.setdefault(string, len(pool)) for string in table.strings] + [-1], dtype=np.int32)
+            codes.append(remap[table.codes])
+        return cls(
+            np.concatenate([table.starts for table in tables]),
+            np.concatenate([table.ends for table in tables]),
+            np.concatenate([table.scores for table in tables]),
+            np.concatenate(codes),
+            tuple(pool),
+            tuple(metadata for table in tables for metadata in table.metadata),
+        )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self) -> Iterator[Clip]:
+        return (self._clip(index) for index in range(len(self)))
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[Clip, "ClipTable"]:
+        if isinstance(item, (int, np.integer)):
+            return self._clip(range(len(self))[item])
+        return self.take(np.arange(len(self))[item])
+
+    def __copy__(self) -> "ClipTable":
+        return self
+
+    def __deepcopy__(self, memo: Dict) -> "ClipTable":
+        # nothing ever changes a table in place
+        return self
+
+    def __repr__(self) -> str:
+        return f"ClipTable({len(self)} clips)"
+
+    def _clip(self, index: int) -> Clip:
+        strings = {field: self.strings[code] if code >= 0 else None for field, code in zip(STRING_FIELDS, self.codes[index].tolist())}
+        return Clip.model_construct(
+            score=float(self.scores[index]), start=float(self.starts[index]), end=float(self.ends[index]), metadata=self.metadata[index], **strings
+        )
+
+    def take(self, indices: Sequence[int]) -> "ClipTable":
+        """Get the clips at the given positions as a table that shares this table's string pool."""
+        indices = np.asarray(indices, dtype=np.int64)
+        return ClipTable(
+            self.starts[indices],
+            self.ends[indices],
+            self.scores[indices],
+            self.codes[indices],
+            self.strings,
+            tuple(self.metadata[index] for index in indices.tolist()),
+        )
+
+    def column(self, field: str) -> List[Union[str, float, None]]:
+        """Get one field of every clip, e.g. `column("video_id")`."""
+        if field in ("start", "end", "score"):
+            return {"start": self.starts, "end": self.ends, "score": self.scores}[field].tolist()
+        if field == "metadata":
+            return list(self.metadata)
+        pool = np.asarray((*self.strings, None), dtype=object)
+        return pool[self.codes[:, STRING_FIELDS.index(field)]].tolist()
+
+    def dedupe(self) -> "ClipTable":
+        """Keep the first clip of every (video_id, start, end)."""
+        if len(self) < 2:
+            return self
+        keys = np.column_stack([self.codes[:, 0].astype(np.float64), self.starts, self.ends])
+        _, first_indices = np.unique(keys, axis=0, return_index=True)
+        if len(first_indices) == len(self):
+            return self
+        return self.take(np.sort(first_indices))
+
+    def to_records(self, exclude: Sequence[str] = ()) -> List[Dict]:
+        """Get the clips as dicts, e.g. for a prompt or the arguments of a tool, leaving out the fields in `exclude`."""
+        columns = {field: self.column(field) for field in ("score", "start", "end", "metadata", *STRING_FIELDS) if field not in exclude}
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    def model_dump(self) -> Dict:
+        """The columns of the table, which rebuild it as `ClipTable(**columns)`."""
+        return {
+            "starts": self.starts,
+            "ends": self.ends,
+            "scores": self.scores,
+            "codes": self.codes,
+            "strings": list(self.strings),
+            "metadata": list(self.metadata),
+        }
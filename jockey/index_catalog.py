@@ -0,0 +1,301 @@
+import os
+import time
+import asyncio
+import sqlite3
+import functools
+import requests
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
+from pydantic import BaseModel
+from jockey.media_config import INDEX_CATALOG_ENABLED, INDEX_CATALOG_REFRESH_SECONDS, INDEX_CATALOG_FULL_REFRESH_SECONDS, INDEX_CATALOG_CONCURRENCY
+from jockey.media_config import INDEX_CATALOG_MISS_REFRESH_SECONDS
+from jockey.video_utils import INDEX_URL, get_video_metadata
+
+# the list videos API returns at most this many videos per page
+CATALOG_PAGE_LIMIT = 50
+
+
+class CatalogVideo(BaseModel):
+    """The fields of an indexed video that Jockey reads when hydrating search results and tool outputs."""
+
+    index_id: str
+    video_id: str
+    filename: Union[str, None] = None
+    duration: Union[float, None] = None
+    video_url: Union[str, None] = None
+    thumbnail_url: Union[str, None] = None
+    updated_at: str = ""
+
+
+class CatalogState(BaseModel):
+    """When an index was last refreshed and the newest `updated_at` seen in it."""
+
+    index_id: str
+    refreshed_at: float
+    full_refreshed_at: float
+    high_water: str
+    video_count: int
+
+
+def catalog_video_from_api(index_id: str, video: Dict) -> CatalogVideo:
+    """Build a catalog entry from a video of the list videos or get video API, whichever API version returned it."""
+    metadata = video.get("system_metadata") or video.get("metadata") or {}
+    hls = video.get("hls") or {}
+    return CatalogVideo(
+        index_id=index_id,
+        video_id=video.get("_id") or video["id"],
+        filename=metadata.get("filename"),
+        duration=metadata.get("duration"),
+        video_url=hls.get("video_url"),
+        thumbnail_url=(hls.get("thumbnail_urls") or [None])[0],
+        updated_at=video.get("updated_at") or "",
+    )
+
+
+def list_videos_page(index_id: str, page: int) -> Dict:
+    """Get a page of the videos of an index, most recently updated first.
+
+    Raises:
+        requests.HTTPError: If the API request fails.
+    """
+    headers = {"accept": "application/json", "x-api-key": os.environ["TWELVE_LABS_API_KEY"]}
+    params = {"page": page, "page_limit": CATALOG_PAGE_LIMIT, "sort_by": "updated_at", "sort_option": "desc"}
+    response = requests.get(f"{INDEX_URL}{index_id}/videos", params=params, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+
+class IndexCatalog:
+    """Snapshot of the video lists of Twelve Labs indexes persisted in a SQLite file, so video titles and HLS URLs can be
+    looked up without a request per video.
+
+    An index is bulk-loaded the first time it is used and then refreshed incrementally: pages sorted by `updated_at` are
+    read only until they reach videos that are already in the snapshot. Deleted videos are dropped by a full reload every
+    `full_refresh_seconds`.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        refresh_seconds (float): Age after which an index is refreshed incrementally before it is read.
+        full_refresh_seconds (float): Age after which an index is reloaded completely.
+        miss_refresh_seconds (float): Age after which a lookup of videos that aren't in the snapshot refreshes the index.
+        concurrency (int): Number of pages requested at the same time by a full reload.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        refresh_seconds: float = INDEX_CATALOG_REFRESH_SECONDS,
+        full_refresh_seconds: float = INDEX_CATALOG_FULL_REFRESH_SECONDS,
+        miss_refresh_seconds: float = INDEX_CATALOG_MISS_REFRESH_SECONDS,
+        concurrency: int = INDEX_CATALOG_CONCURRENCY,
+    ) -> None:
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+        self.miss_refresh_seconds = miss_refresh_seconds
+        self.concurrency = concurrency
+        self._locks: Dict[str, asyncio.Lock] = {}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS videos (index_id TEXT NOT NULL, video_id TEXT NOT NULL, filename TEXT, duration REAL, "
+                "video_url TEXT, thumbnail_url TEXT, updated_at TEXT NOT NULL, PRIMARY KEY (index_id, video_id)) WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS indexes (index_id TEXT PRIMARY KEY, refreshed_at REAL NOT NULL, "
+                "full_refreshed_at REAL NOT NULL, high_water TEXT NOT NULL, video_count INTEGER NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def state(self, index_id: str) -> Union[CatalogState, None]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT index_id, refreshed_at, full_refreshed_at, high_water, video_count FROM indexes WHERE index_id = ?", (index_id,)
+            ).fetchone()
+        return CatalogState(**dict(zip(CatalogState.model_fields, row))) if row is not None else None
+
+    def get_many(self, index_id: str, video_ids: Sequence[str]) -> Dict[str, CatalogVideo]:
+        """Get the snapshot of the given videos of an index by video ID. Videos that aren't in the snapshot are left out."""
+        video_ids = list(dict.fromkeys(video_ids))
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT index_id, video_id, filename, duration, video_url, thumbnail_url, updated_at FROM videos "
+                f"WHERE index_id = ? AND video_id IN ({', '.join('?' for _ in video_ids)})",
+                (index_id, *video_ids),
+            ).fetchall()
+        return {row[1]: CatalogVideo(**dict(zip(CatalogVideo.model_fields, row))) for row in rows}
+
+    def list_videos(self, index_id: str) -> List[CatalogVideo]:
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT index_id, video_id, filename, duration, video_url, thumbnail_url, updated_at FROM videos "
+                "WHERE index_id = ? ORDER BY updated_at DESC",
+                (index_id,),
+            ).fetchall()
+        return [CatalogVideo(**dict(zip(CatalogVideo.model_fields, row))) for row in rows]
+
+    def put(self, catalog_videos: Sequence[CatalogVideo]) -> None:
+        """Add or update videos in the snapshot, e.g. with metadata that was fetched for a single video."""
+        with self._connect() as connection:
+            self._upsert(connection, catalog_videos)
+
+    @staticmethod
+    def _upsert(connection: sqlite3.Connection, catalog_videos: Sequence[CatalogVideo]) -> None:
+        # the list videos API may not return HLS URLs, so don't overwrite the ones a get video request filled in
+        connection.executemany(
+            "INSERT INTO videos (index_id, video_id, filename, duration, video_url, thumbnail_url, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (index_id, video_id) DO UPDATE SET "
+            "filename = COALESCE(excluded.filename, filename), duration = COALESCE(excluded.duration, duration), "
+            "video_url = COALESCE(excluded.video_url, video_url), thumbnail_url = COALESCE(excluded.thumbnail_url, thumbnail_url), "
+            "updated_at = MAX(excluded.updated_at, updated_at)",
+            [tuple(catalog_video.model_dump().values()) for catalog_video in catalog_videos],
+        )
+
+    def _store_state(self, connection: sqlite3.Connection, index_id: str, full: bool) -> None:
+        now = time.time()
+        high_water, video_count = connection.execute(
+            "SELECT COALESCE(MAX(updated_at), ''), COUNT(*) FROM videos WHERE index_id = ?", (index_id,)
+        ).fetchone()
+        connection.execute(
+            "INSERT INTO indexes (index_id, refreshed_at, full_refreshed_at, high_water, video_count) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (index_id) DO UPDATE SET refreshed_at = excluded.refreshed_at, high_water = excluded.high_water, "
+            f"video_count = excluded.video_count{', full_refreshed_at = excluded.full_refreshed_at' if full else ''}",
+            (index_id, now, now, high_water, video_count),
+        )
+
+    async def refresh(self, index_id: str, full: bool = False) -> int:
+        """Update the snapshot of an index from the API. Returns the number of videos that were read.
+
+        An incremental refresh reads pages until it reaches videos that weren't updated since the last refresh.
+        A full refresh reads every page, `concurrency` at a time, and drops the videos that are gone.
+
+        Raises:
+            requests.HTTPError: If a page can't be read. The snapshot is left as it was.
+        """
+        state = self.state(index_id)
+        if state is None:
+            full = True
+
+        first_page = await asyncio.to_thread(list_videos_page, index_id, 1)
+        pages = [first_page]
+        total_pages = first_page.get("page_info", {}).get("total_page", 1)
+
+        if full:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def read_page(page: int) -> Dict:
+                async with semaphore:
+                    return await asyncio.to_thread(list_videos_page, index_id, page)
+
+            pages.extend(await asyncio.gather(*[read_page(page) for page in range(2, total_pages + 1)]))
+        else:
+            # pages are sorted by updated_at, so once a page reaches known videos the rest are known too
+            page = 1
+            while page < total_pages and all(video.get("updated_at", "") > state.high_water for video in pages[-1].get("data", [])):
+                page += 1
+                pages.append(await asyncio.to_thread(list_videos_page, index_id, page))
+
+        catalog_videos = [catalog_video_from_api(index_id, video) for page in pages for video in page.get("data", [])]
+        if not full:
+            catalog_videos = [catalog_video for catalog_video in catalog_videos if catalog_video.updated_at >= state.high_water]
+
+        with self._connect() as connection:
+            if full:
+                # a temporary table keeps large indexes under the limit on query parameters
+                connection.execute("CREATE TEMP TABLE listed_videos (video_id TEXT PRIMARY KEY)")
+                connection.executemany("INSERT OR IGNORE INTO listed_videos VALUES (?)", [(video.video_id,) for video in catalog_videos])
+                connection.execute(
+                    "DELETE FROM videos WHERE index_id = ? AND video_id NOT IN (SELECT video_id FROM listed_videos)", (index_id,)
+                )
+                connection.execute("DROP TABLE listed_videos")
+            self._upsert(connection, catalog_videos)
+            self._store_state(connection, index_id, full)
+
+        return len(catalog_videos)
+
+    async def ensure_fresh(self, index_id: str) -> bool:
+        """Refresh an index if its snapshot is missing or older than the refresh intervals. Concurrent callers share one refresh.
+        Returns whether the index was refreshed."""
+        lock = self._locks.setdefault(index_id, asyncio.Lock())
+        async with lock:
+            state = self.state(index_id)
+            now = time.time()
+            if state is None or now - state.full_refreshed_at > self.full_refresh_seconds:
+                await self.refresh(index_id, full=True)
+            elif now - state.refreshed_at > self.refresh_seconds:
+                await self.refresh(index_id)
+            else:
+                return False
+            return True
+
+    async def lookup(self, index_id: str, video_ids: Sequence[str]) -> Dict[str, CatalogVideo]:
+        """Get videos of an index from a fresh snapshot. If some of them are missing they may have been added since the
+        last refresh, so the index is refreshed once more before they are left out, unless it was refreshed less than
+        `miss_refresh_seconds` ago. Unknown video IDs therefore cost at most one refresh per interval, not one per lookup."""
+        refreshed = await self.ensure_fresh(index_id)
+        catalog_videos = self.get_many(index_id, video_ids)
+        if len(catalog_videos) < len(set(video_ids)) and not refreshed:
+            async with self._locks[index_id]:
+                # a concurrent lookup may have refreshed the index while this one waited for the lock
+                state = self.state(index_id)
+                if state is None or time.time() - state.refreshed_at > self.miss_refresh_seconds:
+                    await self.refresh(index_id)
+            catalog_videos = self.get_many(index_id, video_ids)
+        return catalog_videos
+
+
+@functools.lru_cache(maxsize=None)
+def _index_catalog(root: str) -> IndexCatalog:
+    return IndexCatalog(os.path.join(root, ".jockey", "index_catalog.sqlite"))
+
+
+def get_index_catalog() -> IndexCatalog:
+    """Get the shared index catalog, stored next to the media cache under `HOST_PUBLIC_DIR`."""
+    return _index_catalog(os.environ["HOST_PUBLIC_DIR"])
+
+
+async def lookup_videos(index_id: str, video_ids: Sequence[str]) -> Tuple[Dict[str, CatalogVideo], Dict[str, str]]:
+    """Get the catalog entries of videos of an index.
+
+    With the index catalog enabled they are read from the snapshot. Videos that aren't in it, or that the video list
+    returned no HLS URL for, are fetched with a request per video and added to the snapshot.
+
+    Returns:
+        Tuple[Dict[str, CatalogVideo], Dict[str, str]]: The videos by video ID, and the error of every video that couldn't be retrieved.
+    """
+    video_ids = list(dict.fromkeys(video_ids))
+    index_catalog = get_index_catalog() if INDEX_CATALOG_ENABLED else None
+    catalog_videos: Dict[str, CatalogVideo] = {}
+    if index_catalog is not None:
+        try:
+            catalog_videos = await index_catalog.lookup(index_id, video_ids)
+        except Exception as error:
+            print(f"[WARNING] The catalog of Index ID {index_id} is unavailable, fetching video metadata one video at a time: {error}")
+
+    missing_video_ids = [video_id for video_id in video_ids if video_id not in catalog_videos or not catalog_videos[video_id].video_url]
+    video_metadata = await asyncio.gather(
+        *[asyncio.to_thread(get_video_metadata, index_id=index_id, video_id=video_id) for video_id in missing_video_ids]
+    )
+
+    fetched_videos = []
+    errors = {}
+    for video_id, metadata in zip(missing_video_ids, video_metadata):
+        if isinstance(metadata, dict) and "error" in metadata:
+            errors[video_id] = metadata["error"]
+            continue
+        fetched_videos.append(catalog_video_from_api(index_id, {"_id": video_id, **metadata.json()}))
+
+    if index_catalog is not None and fetched_videos:
+        index_catalog.put(fetched_videos)
+    catalog_videos.update({catalog_video.video_id: catalog_video for catalog_video in fetched_videos})
+    return catalog_videos, errors
@@ -6,13 +6,13 @@ from typing_extensions import TypedDict
 from langchain_openai.chat_models.base import ChatOpenAI
 from langchain_openai.chat_models.azure import AzureChatOpenAI
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
-from langchain_core.runnables import Runnable
+from langchain_core.runnables import Runnable, RunnableConfig
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.agents import AgentExecutor
 from langgraph.graph import StateGraph, END, add_messages
 from langgraph.checkpoint.memory import MemorySaver
 from jockey.stirrups.video_search import VideoSearchWorker
-from jockey.stirrups.video_text_generation import VideoTextGenerationWorker, VideoTextGenerationInput
+from jockey.stirrups.video_text_generation import VideoTextGenerationWorker, VideoTextGenerationInput, BatchTextGenerationInput
 from jockey.stirrups.video_editing import VideoEditingWorker
 from langgraph.prebuilt import ToolNode
 from jockey.stirrups import collect_all_tools
@@ -21,55 +21,38 @@ from textwrap import dedent
 from openai import OpenAI
 from .model_config import OPENAI_MODELS
 from pydantic import BaseModel, Field
-from jockey.stirrups.video_search import MarengoSearchInput
-from jockey.stirrups.video_editing import SimplifiedCombineClipsInput, Clip
-import copy
+from jockey.stirrups.video_search import MarengoSearchInput, BatchSearchInput, SimplifiedRerankClipsInput
+from jockey.stirrups.video_editing import SimplifiedCombineClipsInput, RenderJobStatusInput, RemoveSegmentInput, Clip
+from jockey.media_config import PREFETCH_ENABLED, CLIP_THUMBNAILS_ENABLED, CLIP_INDEX_ENABLED, TRANSCRIPT_SEARCH, CLIP_MERGE_GAP
+from jockey.clip_index import get_clip_index
+from jockey.transcript_index import get_transcript_index
+from jockey.prefetch import PREFETCH_STATS_EVENT, get_prefetcher
+from jockey.video_utils import dispatch_jockey_event
+from jockey.thumbnails import attach_thumbnails
+from jockey.clip_table import ClipTable
+from jockey.clip_registry import ClipRegistry, as_clip_registry
 
 
-def add_clips(left: Dict[str, List[Clip]], right: Dict[str, List[Clip]]) -> Dict[str, List[Clip]]:
-    """Merges two dictionaries of clips, maintaining unique tool_call_ids and preventing duplicates.
+def add_clips(left: Union[ClipRegistry, Dict[str, ClipTable]], right: Dict[str, Union[ClipTable, List[Clip]]]) -> ClipRegistry:
+    """Merges new clips into the clip registry, maintaining unique tool_call_ids and preventing duplicates.
 
     Args:
-        left: The base dictionary of clips.
-        right: The dictionary of clips to merge into the base dictionary.
+        left: The registry of clips found so far, or a plain dictionary of clips, e.g. the one a run starts with.
+        right: The new clips by tool_call_id, as tables or lists of clips.
 
     Returns:
-        A new dictionary with unique clips from `right` merged into `left`.
+        A new version of the registry with unique clips from `right` merged into `left`.
         If a tool_call_id in `right` exists in `left`, only new unique clips
-        will be appended to the existing list.
+        will be appended to it. Clips are unique by video_id, start and end.
+        Merging only looks at the clips in `right`, `left` is never changed.
 
     Examples:
-        >>> clips1 = {"call_1": [Clip(video_id="1", start=0, end=10)]}
+        >>> clips1 = {"call_1": ClipTable.from_clips([Clip(video_id="1", start=0, end=10)])}
         >>> clips2 = {"call_2": [Clip(video_id="2", start=5, end=15)]}
         >>> add_clips(clips1, clips2)
-        {'call_1': [Clip(video_id="1", start=0, end=10)],
-         'call_2': [Clip(video_id="2", start=5, end=15)]}
+        ClipRegistry({'call_1': 1, 'call_2': 1})
     """
-    # Create a new dictionary to store merged results
-    merged = left.copy()
-
-    # Merge clips from right into the merged dictionary
-    for tool_call_id, clips in right.items():
-        if tool_call_id in merged:
-            # Ensure we're working with lists before extending
-            if not isinstance(merged[tool_call_id], list):
-                merged[tool_call_id] = [merged[tool_call_id]]
-            if not isinstance(clips, list):
-                clips = [clips]
-
-            # Create a set of existing clips for efficient comparison
-            existing_clips = {(clip.start, clip.end) for clip in merged[tool_call_id]}
-
-            # Only add clips that don't already exist
-            new_clips = [clip for clip in clips if (clip.start, clip.end) not in existing_clips]
-
-            # Extend with only the new unique clips
-            merged[tool_call_id].extend(new_clips)
-        else:
-            # If tool_call_id is new, ensure clips is a list
-            merged[tool_call_id] = clips if isinstance(clips, list) else [clips]
-
-    return merged
+    return as_clip_registry(left).merge(right or {})
 
 
 class SupervisorResponse(BaseModel):
@@ -80,24 +63,35 @@ class PlannerResponse(BaseModel):
     route_to_node: Literal["planner", "video-search", "video-text-generation", "video-editing", "reflect"] = Field(
         description="""
         Available workers:
-        <worker name="video-search", tools="simple-video-search">
-            Purpose: Search for N clips/videos matching a natural language query
-            Input: Index ID, search query, number of clips needed
+        <worker name="video-search", tools="simple-video-search, batch-video-search, rerank-clips">
+            Purpose: Search for N clips/videos matching a natural language query, or for clips matching several queries at once,
+            or re-rank and filter the clips already in <clips_from_search> by a follow-up query
+            Input: Index ID, search query or queries, number of clips needed
             Output: List of clips with video IDs and timestamps (start/end in seconds)
         </worker>
-        <worker name="video-text-generation", tools="summarize-text-generation">
-            Purpose: Generate text summaries, highlights, or chapters from videos
-            Input: Index ID, video ID, endpoint option (summary, highlight, chapter)
-            Output: Text content generated from the video
+        <worker name="video-text-generation", tools="summarize-text-generation, batch-text-generation">
+            Purpose: Generate text summaries, highlights, or chapters from a video, or the same output for many videos at once
+            Input: Index ID, video ID(s) or search results, endpoint option (summary, highlight, chapter), whether to combine the outputs
+            Output: Text content generated from the video(s), optionally combined into one answer
         </worker>
-        <worker name="video-editing", tools="combine-clips">
-            Purpose: Edit and combine video clips
-            Input: List of video IDs with start/end times
-            Output: Filepath of edited video
+        <worker name="video-editing", tools="combine-clips, render-job-status, remove-segment">
+            Purpose: Edit and combine video clips, check on a render that is running in the background, or cut a segment out of an edited video
+            Input: List of video IDs with start/end times, the Job ID of a queued render, or an edited video's filepath and the start/end times to cut
+            Output: Filepath of edited video, or the Job ID, status and progress of a render job
         </worker>
         """
     )
-    tool_call: Literal["simple-video-search", "combine-clips", "summarize-text-generation", "none"] = Field(
+    tool_call: Literal[
+        "simple-video-search",
+        "batch-video-search",
+        "rerank-clips",
+        "combine-clips",
+        "render-job-status",
+        "remove-segment",
+        "summarize-text-generation",
+        "batch-text-generation",
+        "none",
+    ] = Field(
         description="""
         Define the tool required by the route_to_node. If no tool is required, use 'none'.
         """
@@ -107,7 +101,8 @@ class PlannerResponse(BaseModel):
         <instructions>
             1. Format steps ONLY as: "**worker-name**: Description"
             2. Do not include explanatory text - only output the planner steps
-            3. You must always video-search before video-text-generation or video-editing
+            3. You must always video-search before video-text-generation or video-editing, unless the clips to edit are already in
+               <clips_from_search>. Highlights and chapters from video-text-generation are added there as clips
         </instructions>
         <rules>
             1. ALWAYS include Index ID in worker tasks
@@ -121,13 +116,27 @@ class PlannerResponse(BaseModel):
         parse the index_id from the <latest_user_message>
         """
     )
+    index_ids: List[str] = Field(
+        description="""
+        parse every index ID to search from the <latest_user_message>, e.g. when the content is split into an index per season or league.
+        if only one index is named, return a list with just the index_id
+        """
+    )
     clip_keys: List[str] = Field(
         description="""
         clips are currently stored in <clips_from_search> 
-        You are to return only the key(s) relevant to clips necessary for the video-editing step outlined in <latest_user_message>
+        You are to return only the key(s) relevant to clips necessary for the video-editing or batch-text-generation step
+        outlined in <latest_user_message>
         if ambiguous, only return the latest clip_keys
         """
     )
+    encoding_profile: Literal["draft", "standard", "archival"] = Field(
+        description="""
+        only used by the video-editing step.
+        use "draft" when the user asks for a quick preview or is still iterating on an edit,
+        "archival" when the user asks for the highest quality, and "standard" otherwise
+        """
+    )
 
 
 class JockeyState(TypedDict):
@@ -138,9 +147,11 @@ class JockeyState(TypedDict):
     made_plan: bool = False
     active_plan: Union[str, HumanMessage, None]
     tool_call: Union[str, None]
-    clips_from_search: Annotated[Dict[str, List[Clip]], add_clips]
-    index_id: Union[Annotated[str, lambda left, right: right or left], None]  # for now let's assume per chat we only have 1 index_id
+    clips_from_search: Annotated[ClipRegistry, add_clips]
+    index_id: Union[Annotated[str, lambda left, right: right or left], None]  # the index renders are stored under
+    index_ids: Union[Annotated[List[str], lambda left, right: right or left], None]  # every index searches fan out to
     relevant_clip_keys: List[str]
+    encoding_profile: Union[str, None]
 
 
 class Jockey(StateGraph):
@@ -275,11 +286,12 @@ class Jockey(StateGraph):
         supervisor_response: SupervisorResponse = completion.choices[0].message.parsed
         return {"next_worker": supervisor_response.route_to_node}
 
-    async def _planner_node(self, state: JockeyState) -> Dict:
+    async def _planner_node(self, state: JockeyState, config: RunnableConfig) -> Dict:
         """The planner_node in the StateGraph instance. The planner is responsible to generating a plan for a given user request.
 
         Args:
             state (JockeyState): Current state of the graph.
+            config (RunnableConfig): Config of the graph run, used to find the thread.
 
         Raises:
             TypeError: If the planner_llm instance type isn't currently supported.
@@ -290,12 +302,11 @@ class Jockey(StateGraph):
         latest_user_message = state["chat_history"][-1].content
 
         # Remove `thumbnail_url` and `video_url` from each Clip
-        clips_from_search_copy = copy.deepcopy(state["clips_from_search"]) if state["clips_from_search"] else {}
-        if clips_from_search_copy:
-            [setattr(clip, "thumbnail_url", None) or setattr(clip, "video_url", None) for clips in clips_from_search_copy.values() for clip in clips]
+        clips_from_search = state["clips_from_search"] or {}
+        clip_records = {key: clips.to_records(exclude=("thumbnail_url", "video_url")) for key, clips in clips_from_search.items()}
 
         # retrieve available tool_call_ids
-        available_tool_call_ids: List[str] = list(clips_from_search_copy.keys())
+        available_tool_call_ids: List[str] = list(clip_records.keys())
         if available_tool_call_ids:
             PlannerResponse.model_fields["clip_keys"].annotation = List[Literal.__getitem__(tuple(available_tool_call_ids))]
 
@@ -306,7 +317,7 @@ class Jockey(StateGraph):
                 {"role": "user", "content": dedent(f"<chat_history>{state['chat_history']}</chat_history>")},
                 {"role": "user", "content": dedent(f"<active_plan>{state['active_plan']}</active_plan>")},
                 {"role": "user", "content": dedent(f"<latest_user_message>{latest_user_message}</latest_user_message>")},
-                {"role": "user", "content": dedent(f"<clips_from_search>{clips_from_search_copy}</clips_from_search>")},
+                {"role": "user", "content": dedent(f"<clips_from_search>{clip_records}</clips_from_search>")},
             ],
             temperature=0.7,
             response_format=PlannerResponse,
@@ -317,11 +328,12 @@ class Jockey(StateGraph):
         # this is a temporary solution until openai allows us to make some fields optional, however everything is required for now
         # https://platform.openai.com/docs/guides/structured-outputs#all-fields-must-be-required
         if planner_response.route_to_node == "video-editing":
-            call_tool_ids: List[str] = [key for key in state["clips_from_search"].keys() if key.startswith("call_")]
-            clips_from_search = [clip for tool_id in planner_response.clip_keys for clip in state["clips_from_search"][tool_id]]
             # remove unneeded fields like thumbnail_url and video_url in chat_history
-            [setattr(clip, "thumbnail_url", None) or setattr(clip, "video_url", None) for clip in clips_from_search]
-            planner_response.plan = str(clips_from_search)
+            planner_response.plan = str([record for tool_id in planner_response.clip_keys for record in clip_records.get(tool_id, [])])
+
+        # the prefetched clips are only useful if the user goes on to edit them
+        if PREFETCH_ENABLED and planner_response.route_to_node not in ("video-editing", "video-search"):
+            get_prefetcher().cancel(str(config["configurable"].get("thread_id")))
 
         # We return the response from the planner as a special human with the name of "planner".
         # This helps with understanding historical context as the chat history grows.
@@ -334,19 +346,22 @@ class Jockey(StateGraph):
             "chat_history": [lc_planner_response],
             "active_plan": planner_response.plan,
             "index_id": planner_response.index_id if not state["index_id"] else state["index_id"],
+            "index_ids": planner_response.index_ids if len(planner_response.index_ids) > 1 else state.get("index_ids"),
             "next_worker": planner_response.route_to_node,
             "tool_call": planner_response.tool_call if planner_response.tool_call != "none" else None,
             "made_plan": True,
             "relevant_clip_keys": planner_response.clip_keys,
+            "encoding_profile": planner_response.encoding_profile,
         }
 
-    async def _worker_node(self, state: JockeyState, worker: Runnable) -> Dict:
+    async def _worker_node(self, state: JockeyState, worker: Runnable, config: RunnableConfig) -> Dict:
         """A worker_node in the StateGraph instance. Workers are responsible for directly calling tools in their domains.
         This node isn't used directly but is wrapped with a functools.partial call.
 
         Args:
             state (JockeyState): Current state of the graph.
             worker (Runnable): The actual worker Runnable.
+            config (RunnableConfig): Config of the graph run, used to find the thread.
 
         Returns:
             Dict: Updated state of the graph.
@@ -357,6 +372,15 @@ class Jockey(StateGraph):
             "video-text-generation": VideoTextGenerationInput
         }
 
+        # tools that need different inputs than the rest of their worker
+        tool_schemas = {
+            "render-job-status": RenderJobStatusInput,
+            "remove-segment": RemoveSegmentInput,
+            "batch-text-generation": BatchTextGenerationInput,
+            "batch-video-search": BatchSearchInput,
+            "rerank-clips": SimplifiedRerankClipsInput,
+        }
+
         worker_to_stirrup = {
             "video-search": VideoSearchWorker,
             "video-text-generation": VideoTextGenerationWorker,
@@ -371,11 +395,20 @@ class Jockey(StateGraph):
                     {"role": "user", "content": dedent(f"<active_plan>{state['active_plan']}</active_plan>")},
                     {"role": "user", "content": dedent(f"<tool_call>{state['tool_call']}</tool_call>")},
                 ],
-                response_format=worker_schemas[state["next_worker"]],
+                response_format=tool_schemas.get(state["tool_call"], worker_schemas[state["next_worker"]]),
                 temperature=0.7,
             )
 
-            worker_inputs: Union[MarengoSearchInput, SimplifiedCombineClipsInput, VideoTextGenerationInput] = completion.choices[0].message.parsed
+            worker_inputs: Union[
+                MarengoSearchInput,
+                BatchSearchInput,
+                SimplifiedRerankClipsInput,
+                SimplifiedCombineClipsInput,
+                RenderJobStatusInput,
+                RemoveSegmentInput,
+                VideoTextGenerationInput,
+                BatchTextGenerationInput,
+            ] = completion.choices[0].message.parsed
             # print(f"[DEBUG] Worker inputs: {worker_inputs}")
             
             # Convert VideoTextGenerationInput to PegasusSummarizeInput if needed
@@ -395,15 +428,39 @@ class Jockey(StateGraph):
 
         # get the id of the chat_history
         tool_call_id = state["chat_history"][-1].id
+        thread_id = str(config["configurable"].get("thread_id"))
 
         # craft the args for the tool call
         args = {}
-        if state["next_worker"] == "video-search":
+        if state["next_worker"] == "video-search" and state["tool_call"] == "rerank-clips":
             args = worker_inputs.model_dump()
+            # re-rank the selected search results, or every clip found so far
+            clip_keys = state.get("relevant_clip_keys") or list(state["clips_from_search"])
+            args["clips"] = state["clips_from_search"].select(clip_keys).to_records()
+        elif state["next_worker"] == "video-search":
+            args = worker_inputs.model_dump()
+            if not args["index_ids"] and len(state.get("index_ids") or []) > 1:
+                # keep searching every index the user named earlier in the chat
+                args["index_ids"] = state["index_ids"]
         elif state["next_worker"] == "video-editing" and state["tool_call"] == "combine-clips":
             args = worker_inputs.model_dump()
-            args["clips"] = [clip for key in state["relevant_clip_keys"] for clip in state["clips_from_search"][key]]
+            args["clips"] = state["clips_from_search"].select(state["relevant_clip_keys"])
             args["index_id"] = state["index_id"]
+            if state.get("encoding_profile"):
+                args["encoding_profile"] = state["encoding_profile"]
+            if PREFETCH_ENABLED:
+                prefetcher = get_prefetcher()
+                prefetcher.record_use(thread_id, args["index_id"], args["clips"], args.get("merge_gap", CLIP_MERGE_GAP))
+                await dispatch_jockey_event(PREFETCH_STATS_EVENT, prefetcher.stats.model_dump())
+        elif state["next_worker"] == "video-editing" and state["tool_call"] in ("render-job-status", "remove-segment"):
+            args = worker_inputs.model_dump()
+        elif state["next_worker"] == "video-text-generation" and state["tool_call"] == "batch-text-generation":
+            args = worker_inputs.model_dump(mode="json")
+            args["index_id"] = state["index_id"] or args["index_id"]
+            if not args["video_ids"]:
+                # generate text for every video of the selected search results
+                clips = state["clips_from_search"].select(state.get("relevant_clip_keys") or [])
+                args["video_ids"] = list(dict.fromkeys(clips.column("video_id")))
         elif state["next_worker"] == "video-text-generation":
             # For video-text-generation, we need to use the summarize-text-generation tool
             args = worker_inputs.model_dump()
@@ -441,10 +498,39 @@ class Jockey(StateGraph):
 
         worker_response_str = fix_escaped_unicode(worker_response)
 
-        # add clips to state['clips_from_search']
-        clips_from_search = state.get("clips_from_search", {})
+        # new clips for state['clips_from_search'], add_clips merges them into the registry
+        clips_from_search = {}
         if state["next_worker"] == "video-search":
-            clips_from_search[tool_call_id] = [Clip(**clip) for clip in json.loads(worker_response[0]["output"])]
+            search_results = json.loads(worker_response[0]["output"])
+            if isinstance(search_results, dict):
+                # batch searches return the merged results next to the ranks of each query
+                search_results = search_results["results"]
+            search_clips = [Clip(**clip) for clip in search_results]
+            if CLIP_THUMBNAILS_ENABLED:
+                # clip level results come without a thumbnail, link one and cut it from the source video in the background
+                attach_thumbnails(search_clips)
+            clips_from_search[tool_call_id] = ClipTable.from_clips(search_clips)
+            if PREFETCH_ENABLED:
+                # an edit usually follows a search, so start cutting the best clips before the user asks for it
+                get_prefetcher().schedule(thread_id, worker_inputs.index_id, clips_from_search[tool_call_id])
+            if CLIP_INDEX_ENABLED:
+                # embed the clips now, so re-ranking them later doesn't wait on the embed API
+                get_clip_index().warm(worker_inputs.index_id, clips_from_search[tool_call_id])
+            if TRANSCRIPT_SEARCH != "off":
+                # index the transcripts of new videos, so later conversation searches over them are answered locally
+                video_ids_by_index = {}
+                for clip in clips_from_search[tool_call_id]:
+                    video_ids_by_index.setdefault(clip.index_id or worker_inputs.index_id, []).append(clip.video_id)
+                for index_id, video_ids in video_ids_by_index.items():
+                    get_transcript_index().schedule(index_id, video_ids)
+        elif state["next_worker"] == "video-text-generation" and state["tool_call"] in ("summarize-text-generation", "batch-text-generation"):
+            # highlights and chapters come with their clips, so they can be edited without searching for them first
+            text_generation_output = json.loads(worker_response[0]["output"]) if isinstance(worker_response[0].get("output"), str) else {}
+            timeline_clips = text_generation_output.get("clips") or [
+                clip for result in text_generation_output.get("results", []) for clip in result.get("clips") or []
+            ]
+            if timeline_clips:
+                clips_from_search[tool_call_id] = ClipTable.from_clips([Clip(**clip) for clip in timeline_clips])
 
         # convert worker_response_str to a BaseMessage
         worker_response_str = ToolMessage(content=worker_response_str, tool_call_id=tool_call_id, name=state["next_worker"], additional_kwargs={})
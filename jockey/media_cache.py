@@ -0,0 +1,387 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import sqlite3
+import hashlib
+import functools
+import urllib.parse
+import ffmpeg
+from contextlib import asynccontextmanager, contextmanager, suppress
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Union
+from pydantic import BaseModel
+from jockey.media_config import MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_EVICTION_GRACE_SECONDS, MEDIA_CACHE_LOCK_LEASE_SECONDS, PUBLIC_URL_PREFIX
+
+PARTIAL_FILE_MARKER = ".part-"
+LOCK_POLL_INTERVAL = 0.1
+# journal mode of the SQLite files render workers on other hosts share through HOST_PUBLIC_DIR. WAL keeps its index in
+# shared memory, which only works on one host, the rollback journal only needs the POSIX locks NFS and SMB provide.
+SHARED_JOURNAL_MODE = "DELETE"
+
+
+def is_fragmented_mp4(path: str) -> bool:
+    """Check whether a file is a fragmented MP4, i.e. has a top-level `moof` box, by walking its box headers."""
+    with open(path, "rb") as media_file:
+        file_size = os.fstat(media_file.fileno()).st_size
+        offset = 0
+        while offset + 8 <= file_size:
+            media_file.seek(offset)
+            header = media_file.read(16)
+            box_size, box_type = int.from_bytes(header[:4], "big"), header[4:8]
+            if box_type == b"moof":
+                return True
+            if box_size == 1 and len(header) == 16:
+                box_size = int.from_bytes(header[8:16], "big")
+            if box_size < 8:
+                # a box that runs to the end of the file, or a corrupt header
+                return False
+            offset += box_size
+    return False
+
+
+class MediaCacheEntry(BaseModel):
+    """A file tracked by the media cache. The key is the path of the file relative to the cache root."""
+
+    key: str
+    size: int
+    created_at: float
+    last_access: float
+
+
+class MediaCache:
+    """Bounded, lock-safe cache for the media files Jockey writes under `HOST_PUBLIC_DIR`.
+
+    - Files are written to a temporary `.part-` file next to their final path and only renamed into place once they
+      pass validation, so a crashed or cancelled ffmpeg run never leaves a file that looks like a cache hit.
+    - Writers of the same key are serialized with a per-key lock file, created with O_EXCL so it holds across every host
+      that mounts the cache root. A lock file that its holder stopped renewing for `lock_lease_seconds` is taken over.
+    - Every entry is recorded in a SQLite index with its size and last access time and the least recently used entries are
+      evicted once the cache grows past `max_bytes`.
+
+    Args:
+        root (str): Directory the cache manages, usually `HOST_PUBLIC_DIR`.
+        max_bytes (int): Size the cache is trimmed back to after every write.
+        lock_lease_seconds (float): Age after which a lock file that wasn't renewed is taken over.
+    """
+
+    def __init__(self, root: str, max_bytes: int = MEDIA_CACHE_MAX_BYTES, lock_lease_seconds: float = MEDIA_CACHE_LOCK_LEASE_SECONDS) -> None:
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.lock_lease_seconds = lock_lease_seconds
+        self.state_dir = os.path.join(self.root, ".jockey")
+        self.lock_dir = os.path.join(self.state_dir, "locks")
+        self.index_path = os.path.join(self.state_dir, "media_cache.sqlite")
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute(f"PRAGMA journal_mode={SHARED_JOURNAL_MODE}")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, size INTEGER NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            # temporary names kept next to a finished file by `write(keep_partial=True)`
+            connection.execute("CREATE TABLE IF NOT EXISTS kept_partials (path TEXT PRIMARY KEY, key TEXT NOT NULL, created_at REAL NOT NULL)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.index_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def path_for(self, key: str) -> str:
+        """Get the absolute path for a key, creating its parent directory if needed."""
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def key_for(self, path: str) -> str:
+        """Get the key of an absolute path inside the cache root."""
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def url_for(self, key: str) -> str:
+        """Get the URL the web server in front of the cache root serves a key at, see `PUBLIC_URL_PREFIX`."""
+        return f"{PUBLIC_URL_PREFIX.rstrip('/')}/{urllib.parse.quote(key.replace(os.sep, '/'))}"
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.lock_dir, f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.lock")
+
+    def _lock_is_stale(self, lock_path: str) -> bool:
+        try:
+            return time.time() - os.stat(lock_path).st_mtime > self.lock_lease_seconds
+        except FileNotFoundError:
+            return False
+
+    def _try_lock(self, lock_path: str, token: str) -> bool:
+        """Create the lock file, or take it over if its holder stopped renewing it. Returns whether the lock was acquired."""
+        try:
+            # an exclusive create is atomic across hosts, NFS supports it since v3
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if self._lock_is_stale(lock_path):
+                self._break_lock(lock_path)
+            return False
+        with os.fdopen(lock_fd, "w") as lock_file:
+            lock_file.write(token)
+        return True
+
+    def _break_lock(self, lock_path: str) -> None:
+        stale_path = f"{lock_path}.stale-{uuid.uuid4().hex}"
+        try:
+            os.rename(lock_path, stale_path)
+        except FileNotFoundError:
+            # another process broke the lock first
+            return
+        # that process may also have taken the lock again between the staleness check and the rename, give it back
+        if not self._lock_is_stale(stale_path):
+            with suppress(FileExistsError):
+                os.link(stale_path, lock_path)
+        os.remove(stale_path)
+
+    def _unlock(self, lock_path: str, token: str) -> None:
+        # a lock that was taken over while it wasn't renewed belongs to its new holder
+        with suppress(FileNotFoundError), open(lock_path) as lock_file:
+            if lock_file.read() != token:
+                return
+        with suppress(FileNotFoundError):
+            os.remove(lock_path)
+
+    async def _renew_lock(self, lock_path: str) -> None:
+        while True:
+            await asyncio.sleep(self.lock_lease_seconds / 3)
+            with suppress(FileNotFoundError):
+                os.utime(lock_path)
+
+    @asynccontextmanager
+    async def lock(self, key: str) -> AsyncIterator[None]:
+        """Hold an exclusive per-key lock, shared by every host that mounts the cache root. The lock file is renewed while
+        it is held. Polls instead of blocking a thread so the wait can be cancelled."""
+        lock_path = self._lock_path(key)
+        token = uuid.uuid4().hex
+        while not self._try_lock(lock_path, token):
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        renew_task = asyncio.create_task(self._renew_lock(lock_path))
+        try:
+            yield
+        finally:
+            renew_task.cancel()
+            self._unlock(lock_path, token)
+
+    def _is_locked(self, key: str) -> bool:
+        lock_path = self._lock_path(key)
+        return os.path.exists(lock_path) and not self._lock_is_stale(lock_path)
+
+    async def validate(self, path: str) -> bool:
+        """Check that a media file is complete: non-empty, readable by ffprobe, with at least one stream and a non-zero duration."""
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return False
+        try:
+            probe = await asyncio.to_thread(ffmpeg.probe, path)
+        except ffmpeg.Error:
+            return False
+        duration = probe.get("format", {}).get("duration")
+        if duration is None:
+            # only fragmented MP4 may leave out the container duration, any other file without one is incomplete
+            return len(probe.get("streams", [])) > 0 and await asyncio.to_thread(is_fragmented_mp4, path)
+        return len(probe.get("streams", [])) > 0 and float(duration) > 0
+
+    def _record(self, key: str, size: int) -> None:
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO entries (key, size, created_at, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET size = excluded.size, last_access = excluded.last_access",
+                (key, size, now, now),
+            )
+
+    def _forget(self, key: str) -> None:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def touch(self, key: str) -> None:
+        """Mark an entry as recently used."""
+        with self._connect() as connection:
+            connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+
+    def entries(self) -> List[MediaCacheEntry]:
+        """All entries in the index, least recently used first."""
+        with self._connect() as connection:
+            rows = connection.execute("SELECT key, size, created_at, last_access FROM entries ORDER BY last_access").fetchall()
+        return [MediaCacheEntry(key=key, size=size, created_at=created_at, last_access=last_access) for key, size, created_at, last_access in rows]
+
+    async def lookup(self, key: str) -> Union[str, None]:
+        """Get the path for a cached key, or None on a miss.
+
+        Files that exist on disk but aren't in the index (written before the cache existed, or by a process that crashed
+        before recording them) are validated once and either adopted or removed.
+        """
+        path = os.path.join(self.root, key)
+        if not os.path.isfile(path):
+            self._forget(key)
+            return None
+
+        with self._connect() as connection:
+            row = connection.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+
+        if row is not None and row[0] == os.path.getsize(path):
+            self.touch(key)
+            return path
+
+        if await self.validate(path):
+            self._record(key, os.path.getsize(path))
+            return path
+
+        os.remove(path)
+        self._forget(key)
+        return None
+
+    def _temporary_path(self, path: str) -> str:
+        stem, extension = os.path.splitext(path)
+        # keep the extension so ffmpeg can still infer the container format from the temporary filename
+        return f"{stem}{PARTIAL_FILE_MARKER}{uuid.uuid4().hex}{extension}"
+
+    def _link_file(self, source_path: str, path: str) -> None:
+        """Atomically place a hardlink to `source_path` at `path`, falling back to a symlink and finally to a copy."""
+        temporary_path = self._temporary_path(path)
+        try:
+            try:
+                os.link(source_path, temporary_path)
+            except OSError:
+                try:
+                    os.symlink(os.path.relpath(source_path, os.path.dirname(path)), temporary_path)
+                except OSError:
+                    shutil.copyfile(source_path, temporary_path)
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.lexists(temporary_path):
+                os.remove(temporary_path)
+
+    @asynccontextmanager
+    async def write(self, key: str, keep_partial: bool = False) -> AsyncIterator[str]:
+        """Yield a temporary path to write `key` to. It is validated and atomically renamed into place on exit.
+
+        Args:
+            key (str): Key of the file being written.
+            keep_partial (bool): Link the finished file into place instead of renaming it, so the temporary path stays valid for
+                anyone already reading the file while it was being written (e.g. a progressive render). The temporary name is
+                removed by `evict` once it is older than the eviction grace period, or together with the entry.
+
+        Raises:
+            ValueError: If the file written to the temporary path isn't valid media.
+        """
+        path = self.path_for(key)
+        temporary_path = self._temporary_path(path)
+        try:
+            yield temporary_path
+            if not await self.validate(temporary_path):
+                raise ValueError(f"Refusing to cache incomplete or corrupt media file for {key}.")
+            if keep_partial:
+                self._link_file(temporary_path, path)
+                with self._connect() as connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO kept_partials (path, key, created_at) VALUES (?, ?, ?)",
+                        (self.key_for(temporary_path), key, time.time()),
+                    )
+            else:
+                os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        self._record(key, os.path.getsize(path))
+        self.evict()
+
+    async def get_or_create(self, key: str, create: Callable[[str], Awaitable[None]], keep_partial: bool = False) -> str:
+        """Get the path for `key`, calling `create(temporary_path)` to produce it on a miss.
+        Concurrent callers for the same key wait for the first one instead of producing the file twice."""
+        path = await self.lookup(key)
+        if path is not None:
+            return path
+
+        async with self.lock(key):
+            path = await self.lookup(key)
+            if path is not None:
+                return path
+
+            async with self.write(key, keep_partial=keep_partial) as temporary_path:
+                await create(temporary_path)
+
+        return os.path.join(self.root, key)
+
+    def link(self, source_key: str, key: str) -> str:
+        """Give a cached file a second name without copying it, e.g. a unique per-request filename for a shared render.
+
+        A hardlink is used where possible, falling back to a symlink and finally to a copy. The new name is recorded as its own
+        entry with the full file size, so the byte cap stays conservative even though hardlinks share their data.
+        """
+        path = self.path_for(key)
+        self._link_file(os.path.join(self.root, source_key), path)
+        self.touch(source_key)
+        self._record(key, os.path.getsize(path))
+        return path
+
+    def _remove_kept_partials(self, where: str, parameters: tuple) -> None:
+        with self._connect() as connection:
+            rows = connection.execute(f"SELECT path FROM kept_partials WHERE {where}", parameters).fetchall()
+            for (partial_key,) in rows:
+                partial_path = os.path.join(self.root, partial_key)
+                if os.path.lexists(partial_path):
+                    os.remove(partial_path)
+            connection.executemany("DELETE FROM kept_partials WHERE path = ?", rows)
+
+    def evict(self) -> List[str]:
+        """Remove least recently used entries until the cache fits in `max_bytes`.
+        Entries that are locked or were used within the grace period are never evicted. Returns the evicted keys.
+
+        Temporary names kept by `write(keep_partial=True)` are removed once they are older than the grace period, readers
+        have the final path by then, and with their entry, so a hardlink never keeps an evicted file's data on disk."""
+        grace_cutoff = time.time() - MEDIA_CACHE_EVICTION_GRACE_SECONDS
+        self._remove_kept_partials("created_at <= ?", (grace_cutoff,))
+
+        entries = self.entries()
+        total_size = sum(entry.size for entry in entries)
+        evicted = []
+
+        for entry in entries:
+            if total_size <= self.max_bytes:
+                break
+            if entry.last_access > grace_cutoff or self._is_locked(entry.key):
+                continue
+
+            path = os.path.join(self.root, entry.key)
+            if os.path.exists(path):
+                os.remove(path)
+            self._remove_kept_partials("key = ?", (entry.key,))
+            self._forget(entry.key)
+            total_size -= entry.size
+            evicted.append(entry.key)
+
+        return evicted
+
+    def clean_partial_files(self, max_age_seconds: float = 3600) -> List[str]:
+        """Remove temporary files left behind by writers that crashed. Returns the removed paths."""
+        removed = []
+        cutoff = time.time() - max_age_seconds
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if PARTIAL_FILE_MARKER in filename and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed.append(path)
+        return removed
+
+
+@functools.lru_cache(maxsize=None)
+def _media_cache(root: str) -> MediaCache:
+    media_cache = MediaCache(root)
+    media_cache.clean_partial_files()
+    return media_cache
+
+
+def get_media_cache() -> MediaCache:
+    """Get the shared media cache for `HOST_PUBLIC_DIR`."""
+    return _media_cache(os.environ["HOST_PUBLIC_DIR"])
@@ -0,0 +1,160 @@
+import os
+
+
+def _optional_float(name: str):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else None
+
+
+# Clips from the same video that overlap or are at most this many seconds apart are merged before rendering.
+# Leave JOCKEY_CLIP_MERGE_GAP unset to render every clip separately.
+CLIP_MERGE_GAP = _optional_float("JOCKEY_CLIP_MERGE_GAP")
+
+# Clip search results are filtered before their video metadata is fetched. Clips scored below CLIP_MIN_SCORE are dropped,
+# and so are clips that overlap a better clip of the same video by more than CLIP_NMS_IOU_THRESHOLD intersection over union.
+# With CLIP_KNEE_SENSITIVITY set, results are cut where their scores drop off, the knee has to lie at least this fraction
+# of the score range below a straight decline. Leave them unset to keep every result.
+CLIP_MIN_SCORE = _optional_float("JOCKEY_CLIP_MIN_SCORE")
+CLIP_NMS_IOU_THRESHOLD = _optional_float("JOCKEY_CLIP_NMS_IOU_THRESHOLD")
+CLIP_KNEE_SENSITIVITY = _optional_float("JOCKEY_CLIP_KNEE_SENSITIVITY")
+
+# The media cache under HOST_PUBLIC_DIR is trimmed back to this many bytes, evicting the least recently used files first.
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get("JOCKEY_MEDIA_CACHE_MAX_BYTES", 20 * 1024**3))
+# Files used within this many seconds are never evicted, so renders that are still reading them aren't affected.
+MEDIA_CACHE_EVICTION_GRACE_SECONDS = float(os.environ.get("JOCKEY_MEDIA_CACHE_EVICTION_GRACE_SECONDS", 600))
+# Per-key media cache locks are lock files, so they hold across every host that mounts HOST_PUBLIC_DIR. A holder renews
+# its lock file while it writes, and one that wasn't renewed for this many seconds, e.g. because its host crashed, is taken over.
+MEDIA_CACHE_LOCK_LEASE_SECONDS = float(os.environ.get("JOCKEY_MEDIA_CACHE_LOCK_LEASE_SECONDS", 60))
+# URL prefix HOST_PUBLIC_DIR is served under by the web server in front of it. Files Jockey links to, like clip thumbnails,
+# are served at this prefix followed by their path inside HOST_PUBLIC_DIR.
+PUBLIC_URL_PREFIX = os.environ.get("JOCKEY_PUBLIC_URL_PREFIX", "/public")
+
+# Search results are pre-materialized as mp4 clips in the media cache when JOCKEY_PREMATERIALIZE_SEARCH_RESULTS=1,
+# downloading at most SOURCE_DOWNLOAD_CONCURRENCY source videos and trimming at most CLIP_TRIM_CONCURRENCY clips at a time.
+PREMATERIALIZE_SEARCH_RESULTS = os.environ.get("JOCKEY_PREMATERIALIZE_SEARCH_RESULTS", "0") == "1"
+SOURCE_DOWNLOAD_CONCURRENCY = int(os.environ.get("JOCKEY_SOURCE_DOWNLOAD_CONCURRENCY", 3))
+CLIP_TRIM_CONCURRENCY = int(os.environ.get("JOCKEY_CLIP_TRIM_CONCURRENCY", os.cpu_count() or 4))
+
+# With JOCKEY_PREFETCH=1 the top PREFETCH_TOP_N clips of every search are cut into the media cache in the background,
+# so they are already on disk when the user asks to combine them. Prefetch ffmpeg processes run with PREFETCH_NICENESS.
+PREFETCH_ENABLED = os.environ.get("JOCKEY_PREFETCH", "0") == "1"
+PREFETCH_TOP_N = int(os.environ.get("JOCKEY_PREFETCH_TOP_N", 5))
+PREFETCH_CONCURRENCY = int(os.environ.get("JOCKEY_PREFETCH_CONCURRENCY", 2))
+PREFETCH_NICENESS = int(os.environ.get("JOCKEY_PREFETCH_NICENESS", 10))
+
+# With JOCKEY_CLIP_THUMBNAILS=1 search results without a thumbnail get one cut from their source video, either as a
+# still per clip or as one sprite sheet per source video with THUMBNAIL_SPRITE_COLUMNS thumbnails per row.
+CLIP_THUMBNAILS_ENABLED = os.environ.get("JOCKEY_CLIP_THUMBNAILS", "0") == "1"
+CLIP_THUMBNAIL_MODE = os.environ.get("JOCKEY_CLIP_THUMBNAIL_MODE", "sprite")
+THUMBNAIL_WIDTH = int(os.environ.get("JOCKEY_THUMBNAIL_WIDTH", 320))
+THUMBNAIL_HEIGHT = int(os.environ.get("JOCKEY_THUMBNAIL_HEIGHT", 180))
+THUMBNAIL_SPRITE_COLUMNS = int(os.environ.get("JOCKEY_THUMBNAIL_SPRITE_COLUMNS", 5))
+# Maximum number of source videos thumbnails are cut from at the same time.
+THUMBNAIL_CONCURRENCY = int(os.environ.get("JOCKEY_THUMBNAIL_CONCURRENCY", 3))
+
+# Maximum number of ffprobe processes a batch probe runs at the same time.
+PROBE_CONCURRENCY = int(os.environ.get("JOCKEY_PROBE_CONCURRENCY", 8))
+
+# Text generation responses are cached under HOST_PUBLIC_DIR for this many seconds, leave it unset to keep them until the
+# cache file is removed. A batch text generation runs at most TEXT_GENERATION_CONCURRENCY requests at the same time.
+TEXT_GENERATION_CACHE_TTL_SECONDS = _optional_float("JOCKEY_TEXT_GENERATION_CACHE_TTL_SECONDS")
+TEXT_GENERATION_CONCURRENCY = int(os.environ.get("JOCKEY_TEXT_GENERATION_CONCURRENCY", 4))
+
+# With JOCKEY_INDEX_CATALOG=1 the video lists of the searched indexes are kept in a local snapshot under HOST_PUBLIC_DIR,
+# so search results and text generation outputs get their titles and HLS URLs without a request per video.
+# The snapshot is refreshed incrementally after INDEX_CATALOG_REFRESH_SECONDS and reloaded after INDEX_CATALOG_FULL_REFRESH_SECONDS.
+INDEX_CATALOG_ENABLED = os.environ.get("JOCKEY_INDEX_CATALOG", "0") == "1"
+INDEX_CATALOG_REFRESH_SECONDS = float(os.environ.get("JOCKEY_INDEX_CATALOG_REFRESH_SECONDS", 300))
+INDEX_CATALOG_FULL_REFRESH_SECONDS = float(os.environ.get("JOCKEY_INDEX_CATALOG_FULL_REFRESH_SECONDS", 24 * 3600))
+# A lookup of videos that aren't in the snapshot refreshes it, at most once per INDEX_CATALOG_MISS_REFRESH_SECONDS.
+INDEX_CATALOG_MISS_REFRESH_SECONDS = float(os.environ.get("JOCKEY_INDEX_CATALOG_MISS_REFRESH_SECONDS", 30))
+# Number of pages of a video list requested at the same time by a full reload.
+INDEX_CATALOG_CONCURRENCY = int(os.environ.get("JOCKEY_INDEX_CATALOG_CONCURRENCY", 4))
+
+# With JOCKEY_CLIP_INDEX=1 the clips of every search are embedded in the background, so rerank-clips can re-rank them
+# without waiting. rerank-clips embeds the clips it hasn't seen on demand either way.
+CLIP_INDEX_ENABLED = os.environ.get("JOCKEY_CLIP_INDEX", "0") == "1"
+# Embedder of the clip index: "twelvelabs" for Marengo embeddings, or "package.module:factory" for a local embedder.
+CLIP_EMBEDDER = os.environ.get("JOCKEY_CLIP_EMBEDDER", "twelvelabs")
+# Number of clips from which searches over the whole clip index use an hnswlib ANN index, if hnswlib is installed.
+CLIP_INDEX_ANN_THRESHOLD = int(os.environ.get("JOCKEY_CLIP_INDEX_ANN_THRESHOLD", 50000))
+
+# Transcripts of the videos in search results are kept in a local full-text index under HOST_PUBLIC_DIR, which answers
+# conversation-only searches. With JOCKEY_TRANSCRIPT_SEARCH=local a search is answered locally when the local index finds
+# top_n matches or covers every video of its video filter, with "merge" local matches are always merged with the API's.
+# "off" leaves every search to the API.
+TRANSCRIPT_SEARCH = os.environ.get("JOCKEY_TRANSCRIPT_SEARCH", "off")
+# Lowest BM25 score of a local match that counts towards answering a search without the API. BM25 scores depend on how
+# rare the query's words are among the indexed segments, so words found in most segments score close to 0.
+TRANSCRIPT_MIN_SCORE = float(os.environ.get("JOCKEY_TRANSCRIPT_MIN_SCORE", 1.0))
+# Maximum number of transcripts fetched at the same time.
+TRANSCRIPT_INDEX_CONCURRENCY = int(os.environ.get("JOCKEY_TRANSCRIPT_INDEX_CONCURRENCY", 4))
+
+# Named encoding profiles for combine_clips.
+#   draft: fast low resolution preview for users who are still iterating on an edit.
+#   standard: the default output, matching what combine_clips has always produced.
+#   archival: slow, high quality output at the source resolution.
+# Each profile sets either a constant rate factor (crf) or a video bitrate, and scale_height=None keeps the source resolution.
+# Background render jobs with a higher priority are rendered first, so quick drafts don't wait behind archival renders.
+ENCODING_PROFILES = {
+    "draft": {
+        "vcodec": "libx264",
+        "preset": "ultrafast",
+        "crf": 32,
+        "video_bitrate": None,
+        "scale_height": 480,
+        "acodec": "aac",
+        "audio_bitrate": "96k",
+        "threads": 0,
+        "priority": 10,
+    },
+    "standard": {
+        "vcodec": "libx264",
+        "preset": "medium",
+        "crf": None,
+        "video_bitrate": "1M",
+        "scale_height": None,
+        "acodec": "libmp3lame",
+        "audio_bitrate": "192k",
+        "threads": 0,
+        "priority": 0,
+    },
+    "archival": {
+        "vcodec": "libx264",
+        "preset": "slow",
+        "crf": 18,
+        "video_bitrate": None,
+        "scale_height": None,
+        "acodec": "aac",
+        "audio_bitrate": "256k",
+        "threads": 0,
+        "priority": -10,
+    },
+}
+DEFAULT_ENCODING_PROFILE = os.environ.get("JOCKEY_DEFAULT_ENCODING_PROFILE", "standard")
+if DEFAULT_ENCODING_PROFILE not in ENCODING_PROFILES:
+    print(
+        f"[WARNING] JOCKEY_DEFAULT_ENCODING_PROFILE={DEFAULT_ENCODING_PROFILE!r} isn't one of {', '.join(ENCODING_PROFILES)}, "
+        "using the standard profile."
+    )
+    DEFAULT_ENCODING_PROFILE = "standard"
+
+# combine_clips writes fragmented MP4 in "auto" output mode for compilations with at least this many clips,
+# so the render can be watched while it is still being written.
+PROGRESSIVE_OUTPUT_MIN_CLIPS = int(os.environ.get("JOCKEY_PROGRESSIVE_OUTPUT_MIN_CLIPS", 20))
+# Duration of each fragment of a progressive render in seconds.
+PROGRESSIVE_FRAGMENT_SECONDS = float(os.environ.get("JOCKEY_PROGRESSIVE_FRAGMENT_SECONDS", 2))
+
+# With JOCKEY_RENDER_JOBS=1 combine_clips queues a background render job and returns its job ID right away.
+RENDER_JOBS_ENABLED = os.environ.get("JOCKEY_RENDER_JOBS", "0") == "1"
+# Number of render jobs an in-process worker pool renders at the same time.
+# Set it to 0 on the graph server to leave all rendering to `python -m jockey.render_worker` nodes.
+RENDER_WORKER_CONCURRENCY = int(os.environ.get("JOCKEY_RENDER_WORKER_CONCURRENCY", 2))
+# Seconds an idle render worker waits before checking the queue again.
+RENDER_JOB_POLL_INTERVAL = float(os.environ.get("JOCKEY_RENDER_JOB_POLL_INTERVAL", 2))
+# A worker holds a lease on the job it renders and renews it with a heartbeat. Jobs whose lease expired because their
+# worker crashed or lost the shared volume are re-queued, up to RENDER_JOB_MAX_ATTEMPTS claims in total.
+RENDER_JOB_LEASE_SECONDS = float(os.environ.get("JOCKEY_RENDER_JOB_LEASE_SECONDS", 60))
+RENDER_JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOCKEY_RENDER_JOB_HEARTBEAT_INTERVAL", 15))
+RENDER_JOB_MAX_ATTEMPTS = int(os.environ.get("JOCKEY_RENDER_JOB_MAX_ATTEMPTS", 3))
+
@@ -0,0 +1,168 @@
+import os
+import asyncio
+import functools
+import contextvars
+from typing import Awaitable, Callable, Dict, List, Sequence, Set, Tuple, Union
+from pydantic import BaseModel, computed_field
+from jockey.media_cache import get_media_cache
+from jockey.media_config import PREFETCH_TOP_N, PREFETCH_CONCURRENCY, PREFETCH_NICENESS, CLIP_MERGE_GAP
+from jockey.clip_ops import plan_clip_renders
+from jockey.video_utils import clip_cache_key, download_video, ffmpeg_niceness
+
+PREFETCH_STATS_EVENT = "prefetch_stats"
+
+# (index_id, video_id, start, end)
+PrefetchKey = Tuple[str, str, float, float]
+
+
+def _prefetch_keys(index_id: str, clips: Sequence, merge_gap: Union[float, None]) -> List[PrefetchKey]:
+    """Keys of the source spans `render_compilation` cuts for clips, so prefetches and hits match what an edit downloads."""
+    clip_index_ids = {clip.video_id: getattr(clip, "index_id", None) or index_id for clip in clips}
+    return [(clip_index_ids[span.video_id], span.video_id, span.start, span.end) for span in plan_clip_renders(clips, merge_gap=merge_gap).spans]
+
+
+class PrefetchStats(BaseModel):
+    """Counters that show whether prefetching pays off, dispatched as a `prefetch_stats` event with every edit."""
+
+    scheduled: int = 0
+    completed: int = 0
+    cancelled: int = 0
+    failed: int = 0
+    # source spans of an edit that were already prefetched, still being prefetched, or not prefetched at all
+    hits: int = 0
+    late_hits: int = 0
+    misses: int = 0
+    bytes_fetched: int = 0
+    bytes_used: int = 0
+
+    @computed_field
+    @property
+    def hit_rate(self) -> Union[float, None]:
+        requested = self.hits + self.late_hits + self.misses
+        return (self.hits + self.late_hits) / requested if requested else None
+
+    @computed_field
+    @property
+    def bytes_wasted(self) -> int:
+        """Bytes prefetched for clips that no edit has used so far."""
+        return self.bytes_fetched - self.bytes_used
+
+
+class Prefetcher:
+    """Speculatively cuts the top clips of a search into the media cache, since an edit usually follows a search.
+
+    Prefetches run with a small concurrency limit and a lower CPU priority so they don't slow down the foreground,
+    and they are cancelled when the conversation of the thread moves on to something other than editing.
+    An edit that asks for a clip which is still being prefetched waits on the media cache lock instead of cutting it twice.
+
+    Args:
+        fetch (Callable): Coroutine that cuts a clip into the media cache, with the signature of `download_video`.
+        top_n (int): Number of clips prefetched per search, highest score first.
+        concurrency (int): Number of clips prefetched at the same time.
+        niceness (int): Niceness of the ffmpeg processes started by prefetches.
+        merge_gap (float, optional): Merge gap edits are expected to use, clips are prefetched as the source spans it plans.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[..., Awaitable[Union[str, Dict]]] = download_video,
+        top_n: int = PREFETCH_TOP_N,
+        concurrency: int = PREFETCH_CONCURRENCY,
+        niceness: int = PREFETCH_NICENESS,
+        merge_gap: Union[float, None] = CLIP_MERGE_GAP,
+    ) -> None:
+        self.fetch = fetch
+        self.merge_gap = merge_gap
+        self.top_n = top_n
+        self.niceness = niceness
+        self.stats = PrefetchStats()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Dict[str, Dict[PrefetchKey, asyncio.Task]] = {}
+        # sizes of finished prefetches that no edit has used yet
+        self._prefetched: Dict[PrefetchKey, int] = {}
+        # prefetches an edit is already waiting for
+        self._claimed: Set[PrefetchKey] = set()
+
+    def schedule(self, thread_id: str, index_id: str, clips: Sequence) -> List[PrefetchKey]:
+        """Start prefetching the top clips by score of a search in a thread. Returns the keys that were scheduled.
+        Clips with their own `index_id` are fetched from that index instead of `index_id`."""
+        tasks = {key: task for key, task in self._tasks.get(thread_id, {}).items() if not task.done()}
+        scheduled = []
+        top_clips = sorted(clips, key=lambda clip: clip.score, reverse=True)[: self.top_n]
+        for key in _prefetch_keys(index_id, top_clips, self.merge_gap):
+            if key in tasks or key in self._prefetched:
+                continue
+            # run in an empty context so prefetches don't emit progress events into the graph run that scheduled them
+            tasks[key] = asyncio.create_task(self._prefetch(key), context=contextvars.Context())
+            scheduled.append(key)
+
+        self._tasks[thread_id] = tasks
+        self.stats.scheduled += len(scheduled)
+        return scheduled
+
+    async def _prefetch(self, key: PrefetchKey) -> None:
+        index_id, video_id, start, end = key
+        try:
+            async with self._semaphore:
+                if await get_media_cache().lookup(clip_cache_key(*key)) is not None:
+                    # already cached by an earlier edit, there is nothing to prefetch
+                    return
+                ffmpeg_niceness.set(self.niceness)
+                video_path = await self.fetch(video_id=video_id, index_id=index_id, start=start, end=end)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            print(f"[ERROR] Failed to prefetch clip {start}-{end} of Video ID {video_id}: {error}")
+            self.stats.failed += 1
+            return
+
+        if isinstance(video_path, dict):
+            # download_video returns an error dict instead of raising
+            self.stats.failed += 1
+            return
+
+        size = os.path.getsize(video_path)
+        self.stats.completed += 1
+        self.stats.bytes_fetched += size
+        if key in self._claimed:
+            self._claimed.discard(key)
+            self.stats.bytes_used += size
+        else:
+            self._prefetched[key] = size
+
+    def record_use(self, thread_id: str, index_id: str, clips: Sequence, merge_gap: Union[float, None]) -> None:
+        """Count the source spans of an edit as prefetch hits or misses. Call it right before the edit starts cutting clips.
+        `merge_gap` is the merge gap of the edit, its spans only match the prefetched ones if it is the prefetcher's."""
+        tasks = self._tasks.get(thread_id, {})
+        for key in dict.fromkeys(_prefetch_keys(index_id, clips, merge_gap)):
+            if key in self._prefetched:
+                self.stats.hits += 1
+                self.stats.bytes_used += self._prefetched.pop(key)
+            elif key in tasks and not tasks[key].done():
+                self.stats.late_hits += 1
+                self._claimed.add(key)
+            else:
+                self.stats.misses += 1
+
+    def cancel(self, thread_id: str) -> int:
+        """Cancel the pending prefetches of a thread, e.g. when it moves on from editing. Returns how many were cancelled."""
+        cancelled = 0
+        for task in self._tasks.pop(thread_id, {}).values():
+            if not task.done():
+                task.cancel()
+                cancelled += 1
+        self.stats.cancelled += cancelled
+        return cancelled
+
+    def report(self) -> str:
+        hit_rate = f"{self.stats.hit_rate:.0%}" if self.stats.hit_rate is not None else "n/a"
+        return (
+            f"Prefetch hit rate: {hit_rate} ({self.stats.hits} ready, {self.stats.late_hits} in flight, {self.stats.misses} missed), "
+            f"{self.stats.bytes_wasted / 1024**2:.1f} MB wasted"
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def get_prefetcher() -> Prefetcher:
+    """Get the shared prefetcher."""
+    return Prefetcher()
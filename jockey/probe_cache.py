@@ -0,0 +1,162 @@
+import os
+import json
+import asyncio
+import sqlite3
+import functools
+import ffmpeg
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Union
+from pydantic import BaseModel
+from jockey.media_config import PROBE_CONCURRENCY
+from jockey.media_cache import SHARED_JOURNAL_MODE
+
+
+class MediaProbe(BaseModel):
+    """Stream parameters and keyframes of a media file, as reported by ffprobe."""
+
+    path: str
+    size: int
+    mtime: float
+    format_name: Union[str, None] = None
+    duration: Union[float, None] = None
+    video_codec: Union[str, None] = None
+    audio_codec: Union[str, None] = None
+    width: Union[int, None] = None
+    height: Union[int, None] = None
+    time_base: Union[str, None] = None
+    frame_rate: Union[str, None] = None
+    # presentation timestamps of the keyframes of the first video stream in seconds, sorted
+    keyframes: List[float] = []
+
+
+async def run_ffprobe(*args: str) -> str:
+    """Run ffprobe with the given arguments and return its stdout. The child process is killed if the awaiting task is cancelled."""
+    process = await asyncio.create_subprocess_exec(
+        "ffprobe", "-v", "error", *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+
+    if process.returncode != 0:
+        raise ffmpeg.Error("ffprobe", stdout, stderr)
+
+    return stdout.decode("utf-8", errors="replace")
+
+
+def parse_keyframes(packets_csv: str) -> List[float]:
+    """Get the keyframe timestamps from ffprobe `packet=pts_time,flags` csv output, e.g. `2.002000,K__`."""
+    keyframes = []
+    for line in packets_csv.splitlines():
+        pts_time, _, flags = line.strip().partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+    return sorted(keyframes)
+
+
+class ProbeCache:
+    """ffprobe results persisted in a SQLite file, keyed by file path and invalidated when the size or mtime of the file changes.
+
+    Args:
+        path (str): Path of the SQLite database file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._connect() as connection:
+            # render workers on other hosts share the file
+            connection.execute(f"PRAGMA journal_mode={SHARED_JOURNAL_MODE}")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS probes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, data TEXT NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, path: str) -> Union[MediaProbe, None]:
+        """Get the cached probe of a file, or None if it was never probed or changed since."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT data FROM probes WHERE path = ? AND size = ? AND mtime = ?", (path, stat.st_size, stat.st_mtime)
+            ).fetchone()
+        return MediaProbe.model_validate_json(row[0]) if row is not None else None
+
+    def _store(self, media_probe: MediaProbe) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO probes (path, size, mtime, data) VALUES (?, ?, ?, ?)",
+                (media_probe.path, media_probe.size, media_probe.mtime, media_probe.model_dump_json()),
+            )
+
+    def forget(self, path: str) -> None:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM probes WHERE path = ?", (os.path.abspath(path),))
+
+    async def probe(self, path: str) -> MediaProbe:
+        """Get the probe of a file, running ffprobe only if it isn't cached yet.
+
+        Raises:
+            ffmpeg.Error: If ffprobe can't read the file.
+        """
+        media_probe = self.get(path)
+        if media_probe is not None:
+            return media_probe
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        probe: Dict = json.loads(await run_ffprobe("-show_format", "-show_streams", "-of", "json", path))
+        # reading the packet flags finds the keyframes without decoding anything
+        packets_csv = await run_ffprobe("-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path)
+
+        video_stream = next((stream for stream in probe.get("streams", []) if stream.get("codec_type") == "video"), {})
+        audio_stream = next((stream for stream in probe.get("streams", []) if stream.get("codec_type") == "audio"), {})
+        duration = probe.get("format", {}).get("duration")
+        media_probe = MediaProbe(
+            path=path,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            format_name=probe.get("format", {}).get("format_name"),
+            duration=float(duration) if duration is not None else None,
+            video_codec=video_stream.get("codec_name"),
+            audio_codec=audio_stream.get("codec_name"),
+            width=video_stream.get("width"),
+            height=video_stream.get("height"),
+            time_base=video_stream.get("time_base"),
+            frame_rate=video_stream.get("avg_frame_rate"),
+            keyframes=parse_keyframes(packets_csv),
+        )
+        self._store(media_probe)
+        return media_probe
+
+    async def probe_many(self, paths: Sequence[str], concurrency: int = PROBE_CONCURRENCY) -> List[MediaProbe]:
+        """Probe many files, running at most `concurrency` ffprobe processes at a time. Results are in the order of `paths`."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def probe(path: str) -> MediaProbe:
+            async with semaphore:
+                return await self.probe(path)
+
+        return await asyncio.gather(*[probe(path) for path in paths])
+
+
+@functools.lru_cache(maxsize=None)
+def _probe_cache(root: str) -> ProbeCache:
+    return ProbeCache(os.path.join(root, ".jockey", "probe_cache.sqlite"))
+
+
+def get_probe_cache() -> ProbeCache:
+    """Get the shared probe cache, stored next to the media cache under `HOST_PUBLIC_DIR`."""
+    return _probe_cache(os.environ["HOST_PUBLIC_DIR"])
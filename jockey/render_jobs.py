@@ -0,0 +1,420 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import functools
+from enum import Enum
+from contextlib import contextmanager, suppress
+from typing import Awaitable, Callable, Dict, Iterator, List, Union
+from pydantic import BaseModel
+from jockey.media_cache import SHARED_JOURNAL_MODE
+from jockey.media_config import RENDER_JOB_POLL_INTERVAL, RENDER_JOB_LEASE_SECONDS, RENDER_JOB_HEARTBEAT_INTERVAL, RENDER_JOB_MAX_ATTEMPTS
+
+
+class RenderJobStatus(str, Enum):
+    """Lifecycle of a background render job."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class RenderJob(BaseModel):
+    """A combine_clips request that is rendered in the background."""
+
+    job_id: str
+    thread_id: Union[str, None] = None
+    priority: int = 0
+    status: RenderJobStatus = RenderJobStatus.QUEUED
+    request: Dict
+    progress: Union[float, None] = None
+    output_filepath: Union[str, None] = None
+    error: Union[str, None] = None
+    created_at: float
+    started_at: Union[float, None] = None
+    finished_at: Union[float, None] = None
+    worker_id: Union[str, None] = None
+    lease_expires_at: Union[float, None] = None
+    attempts: int = 0
+    posted_at: Union[float, None] = None
+
+
+RENDER_JOB_COLUMNS = [
+    "job_id",
+    "thread_id",
+    "priority",
+    "status",
+    "request",
+    "progress",
+    "output_filepath",
+    "error",
+    "created_at",
+    "started_at",
+    "finished_at",
+    "worker_id",
+    "lease_expires_at",
+    "attempts",
+    "posted_at",
+]
+
+# columns added after the first release of the table, so existing job stores are migrated in place
+RENDER_JOB_MIGRATIONS = {
+    "worker_id": "TEXT",
+    "lease_expires_at": "REAL",
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "posted_at": "REAL",
+}
+
+
+class RenderJobStore:
+    """Render job queue persisted in a SQLite file, so it runs without any outside services.
+
+    The graph server and any number of `jockey.render_worker` processes on the hosts that mount `HOST_PUBLIC_DIR` share
+    the file, which is how the workers pick up jobs queued by the graph server and the graph server picks up their results.
+    The file uses a rollback journal instead of WAL, so SQLite only relies on the POSIX locks of the shared volume, and
+    every state change is a single statement. A claimed job is leased to one worker, which has to renew the lease with
+    `heartbeat`. Jobs whose lease expired are re-queued by the next `claim` until they used up `max_attempts`.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        max_attempts (int): Number of times a job is claimed before an abandoned job is failed instead of re-queued.
+    """
+
+    def __init__(self, path: str, max_attempts: int = RENDER_JOB_MAX_ATTEMPTS) -> None:
+        self.path = path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute(f"PRAGMA journal_mode={SHARED_JOURNAL_MODE}")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS render_jobs ("
+                "job_id TEXT PRIMARY KEY, thread_id TEXT, priority INTEGER NOT NULL, status TEXT NOT NULL, request TEXT NOT NULL, "
+                "progress REAL, output_filepath TEXT, error TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            existing_columns = {row[1] for row in connection.execute("PRAGMA table_info(render_jobs)")}
+            for column, column_type in RENDER_JOB_MIGRATIONS.items():
+                if column not in existing_columns:
+                    connection.execute(f"ALTER TABLE render_jobs ADD COLUMN {column} {column_type}")
+            connection.execute("CREATE INDEX IF NOT EXISTS render_jobs_queue ON render_jobs (status, priority DESC, created_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _to_job(row: tuple) -> RenderJob:
+        job_data = dict(zip(RENDER_JOB_COLUMNS, row))
+        job_data["request"] = json.loads(job_data["request"])
+        return RenderJob(**job_data)
+
+    def submit(self, request: Dict, thread_id: Union[str, None] = None, priority: int = 0) -> RenderJob:
+        """Queue a render. Jobs with a higher priority are claimed first, ties are claimed in submission order."""
+        render_job = RenderJob(job_id=uuid.uuid4().hex, thread_id=thread_id, priority=priority, request=request, created_at=time.time())
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO render_jobs (job_id, thread_id, priority, status, request, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (render_job.job_id, thread_id, priority, render_job.status.value, json.dumps(request), render_job.created_at),
+            )
+        return render_job
+
+    def requeue_abandoned(self) -> List[str]:
+        """Re-queue running jobs whose lease expired, or fail them once they used up `max_attempts`. Returns their job IDs."""
+        now = time.time()
+        with self._connect() as connection:
+            requeued = connection.execute(
+                "UPDATE render_jobs SET status = ?, worker_id = NULL, lease_expires_at = NULL, progress = NULL "
+                "WHERE status = ? AND lease_expires_at < ? AND attempts < ? RETURNING job_id",
+                (RenderJobStatus.QUEUED.value, RenderJobStatus.RUNNING.value, now, self.max_attempts),
+            ).fetchall()
+            failed = connection.execute(
+                "UPDATE render_jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL "
+                "WHERE status = ? AND lease_expires_at < ? RETURNING job_id",
+                (
+                    RenderJobStatus.FAILED.value,
+                    f"Render job was abandoned by its worker {self.max_attempts} times.",
+                    now,
+                    RenderJobStatus.RUNNING.value,
+                    now,
+                ),
+            ).fetchall()
+        return [row[0] for row in requeued + failed]
+
+    def claim(self, worker_id: Union[str, None] = None, lease_seconds: float = RENDER_JOB_LEASE_SECONDS) -> Union[RenderJob, None]:
+        """Atomically lease the next queued job to `worker_id`, mark it as running and return it, or None if the queue is empty."""
+        self.requeue_abandoned()
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "UPDATE render_jobs SET status = ?, started_at = ?, worker_id = ?, lease_expires_at = ?, attempts = attempts + 1 "
+                "WHERE job_id = (SELECT job_id FROM render_jobs WHERE status = ? ORDER BY priority DESC, created_at LIMIT 1) "
+                f"RETURNING {', '.join(RENDER_JOB_COLUMNS)}",
+                (RenderJobStatus.RUNNING.value, now, worker_id, now + lease_seconds, RenderJobStatus.QUEUED.value),
+            ).fetchone()
+        return self._to_job(row) if row is not None else None
+
+    def heartbeat(self, job_id: str, worker_id: Union[str, None], lease_seconds: float = RENDER_JOB_LEASE_SECONDS) -> bool:
+        """Renew the lease of a running job. Returns False if `worker_id` no longer holds the lease."""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE render_jobs SET lease_expires_at = ? WHERE job_id = ? AND status = ? AND worker_id IS ?",
+                (time.time() + lease_seconds, job_id, RenderJobStatus.RUNNING.value, worker_id),
+            )
+        return cursor.rowcount > 0
+
+    def update_progress(self, job_id: str, progress: float, worker_id: Union[str, None] = None) -> None:
+        with self._connect() as connection:
+            connection.execute("UPDATE render_jobs SET progress = ? WHERE job_id = ? AND worker_id IS ?", (progress, job_id, worker_id))
+
+    def complete(self, job_id: str, output_filepath: str, worker_id: Union[str, None] = None) -> bool:
+        """Mark a job as succeeded. Returns False if `worker_id` no longer holds the lease, e.g. the job was re-queued."""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE render_jobs SET status = ?, progress = 100, output_filepath = ?, finished_at = ?, lease_expires_at = NULL "
+                "WHERE job_id = ? AND status = ? AND worker_id IS ?",
+                (RenderJobStatus.SUCCEEDED.value, output_filepath, time.time(), job_id, RenderJobStatus.RUNNING.value, worker_id),
+            )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: str, error: str, worker_id: Union[str, None] = None) -> bool:
+        """Mark a job as failed. Returns False if `worker_id` no longer holds the lease."""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE render_jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL "
+                "WHERE job_id = ? AND status = ? AND worker_id IS ?",
+                (RenderJobStatus.FAILED.value, error, time.time(), job_id, RenderJobStatus.RUNNING.value, worker_id),
+            )
+        return cursor.rowcount > 0
+
+    def unposted(self) -> List[RenderJob]:
+        """Finished jobs of a thread whose outcome wasn't posted back to it yet, oldest first."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT {', '.join(RENDER_JOB_COLUMNS)} FROM render_jobs "
+                "WHERE status IN (?, ?) AND posted_at IS NULL AND thread_id IS NOT NULL ORDER BY finished_at",
+                (RenderJobStatus.SUCCEEDED.value, RenderJobStatus.FAILED.value),
+            ).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def mark_posted(self, job_id: str, posted: bool = True) -> bool:
+        """Record that the outcome of a job was posted, or with `posted=False` that posting it failed and has to be retried.
+        Returns False if the job was already marked, so of several graph servers only one posts a job."""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                f"UPDATE render_jobs SET posted_at = ? WHERE job_id = ? AND posted_at IS {'NULL' if posted else 'NOT NULL'}",
+                (time.time() if posted else None, job_id),
+            )
+        return cursor.rowcount > 0
+
+    def get(self, job_id: str) -> Union[RenderJob, None]:
+        with self._connect() as connection:
+            row = connection.execute(f"SELECT {', '.join(RENDER_JOB_COLUMNS)} FROM render_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row is not None else None
+
+    def list_jobs(self, thread_id: Union[str, None] = None) -> List[RenderJob]:
+        """All jobs, newest first, optionally only those submitted from one thread."""
+        query = f"SELECT {', '.join(RENDER_JOB_COLUMNS)} FROM render_jobs"
+        parameters = ()
+        if thread_id is not None:
+            query += " WHERE thread_id = ?"
+            parameters = (thread_id,)
+        with self._connect() as connection:
+            rows = connection.execute(f"{query} ORDER BY created_at DESC", parameters).fetchall()
+        return [self._to_job(row) for row in rows]
+
+
+RenderJobRunner = Callable[[RenderJob, Callable[[Dict], Awaitable[None]]], Awaitable[str]]
+RenderJobCallback = Callable[[RenderJob], Awaitable[None]]
+
+
+def default_worker_id() -> str:
+    """A worker ID that is unique across the hosts sharing a job store."""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class RenderWorkerPool:
+    """Pool of asyncio workers that claim jobs from a RenderJobStore and run them.
+
+    Args:
+        store (RenderJobStore): The queue to claim jobs from.
+        runner (RenderJobRunner): Coroutine that renders a job and returns the output filepath.
+            It receives a progress callback that accepts `ffmpeg_progress` event data.
+        concurrency (int): Number of jobs rendered at the same time.
+        worker_id (str, optional): ID the pool leases jobs under. Defaults to one derived from the hostname and process ID.
+        lease_seconds (float): How long a lease lasts without a heartbeat.
+        heartbeat_interval (float): Seconds between heartbeats while a job is rendered.
+    """
+
+    def __init__(
+        self,
+        store: RenderJobStore,
+        runner: RenderJobRunner,
+        concurrency: int = 2,
+        worker_id: Union[str, None] = None,
+        lease_seconds: float = RENDER_JOB_LEASE_SECONDS,
+        heartbeat_interval: float = RENDER_JOB_HEARTBEAT_INTERVAL,
+    ) -> None:
+        self.store = store
+        self.runner = runner
+        self.concurrency = concurrency
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self._callbacks: List[RenderJobCallback] = []
+        self._workers: List[asyncio.Task] = []
+        self._wake_up = asyncio.Event()
+
+    def add_done_callback(self, callback: RenderJobCallback) -> None:
+        """Register a coroutine that is called with every job that finishes, successfully or not."""
+        self._callbacks.append(callback)
+
+    def start(self) -> None:
+        """Start the workers on the running event loop. Calling it again while they are running does nothing."""
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        if self._workers:
+            return
+        self._wake_up = asyncio.Event()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    def notify(self) -> None:
+        """Wake idle workers up after a job was submitted."""
+        self._wake_up.set()
+
+    async def wait(self) -> None:
+        """Wait until the workers are stopped."""
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _work(self) -> None:
+        while True:
+            render_job = self.store.claim(self.worker_id, self.lease_seconds)
+            if render_job is None:
+                self._wake_up.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake_up.wait(), timeout=RENDER_JOB_POLL_INTERVAL)
+                continue
+            await self.run_job(render_job)
+
+    async def _heartbeat(self, render_job: RenderJob, render_task: asyncio.Task) -> None:
+        """Renew the lease of a running job, cancelling the render if another worker took the job over."""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if not self.store.heartbeat(render_job.job_id, render_job.worker_id, self.lease_seconds):
+                print(f"[ERROR] Lost the lease on render job {render_job.job_id}, cancelling it.")
+                render_task.cancel()
+                return
+
+    async def run_job(self, render_job: RenderJob) -> RenderJob:
+        """Render a claimed job while keeping its lease alive, record the outcome in the store and call the done callbacks.
+        The callbacks aren't called if the lease was lost, since the job is then owned by another worker."""
+
+        async def on_progress(progress: Dict) -> None:
+            if progress.get("percent") is not None:
+                self.store.update_progress(render_job.job_id, progress["percent"], render_job.worker_id)
+
+        render_task = asyncio.create_task(self.runner(render_job, on_progress))
+        heartbeat_task = asyncio.create_task(self._heartbeat(render_job, render_task))
+        try:
+            output_filepath = await render_task
+            recorded = self.store.complete(render_job.job_id, output_filepath, render_job.worker_id)
+        except asyncio.CancelledError:
+            if not heartbeat_task.done():
+                # the pool itself is being stopped, leave the job to be re-queued once its lease expires
+                render_task.cancel()
+                raise
+            recorded = False
+        except Exception as error:
+            print(f"[ERROR] Render job {render_job.job_id} failed: {error}")
+            recorded = self.store.fail(render_job.job_id, str(error), render_job.worker_id)
+        finally:
+            heartbeat_task.cancel()
+
+        render_job = self.store.get(render_job.job_id)
+        if not recorded:
+            return render_job
+        for callback in self._callbacks:
+            try:
+                await callback(render_job)
+            except Exception as error:
+                print(f"[ERROR] Render job callback failed for {render_job.job_id}: {error}")
+        return render_job
+
+
+class RenderJobPoster:
+    """Polls a RenderJobStore for finished jobs whose outcome wasn't posted yet and hands each of them to the registered
+    callbacks, whichever worker or host rendered it.
+
+    Args:
+        store (RenderJobStore): The queue to read finished jobs from.
+        poll_interval (float): Seconds between checks for finished jobs.
+    """
+
+    def __init__(self, store: RenderJobStore, poll_interval: float = RENDER_JOB_POLL_INTERVAL) -> None:
+        self.store = store
+        self.poll_interval = poll_interval
+        self._callbacks: List[RenderJobCallback] = []
+        self._poller: Union[asyncio.Task, None] = None
+
+    def add_callback(self, callback: RenderJobCallback) -> None:
+        """Register a coroutine that is called once with every job that finishes, successfully or not."""
+        self._callbacks.append(callback)
+
+    def start(self) -> None:
+        """Start polling on the running event loop. Calling it again while it is polling does nothing."""
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+
+    async def post_finished(self) -> List[str]:
+        """Hand every finished job that wasn't posted yet to the callbacks. A job whose callback failed is posted again by
+        the next call. Returns the IDs of the jobs that were posted."""
+        posted = []
+        for render_job in self.store.unposted():
+            if not self.store.mark_posted(render_job.job_id):
+                continue
+            try:
+                for callback in self._callbacks:
+                    await callback(render_job)
+            except Exception as error:
+                print(f"[ERROR] Failed to post render job {render_job.job_id}, retrying: {error}")
+                self.store.mark_posted(render_job.job_id, posted=False)
+                continue
+            posted.append(render_job.job_id)
+        return posted
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                await self.post_finished()
+            except Exception as error:
+                print(f"[ERROR] Failed to check for finished render jobs: {error}")
+            await asyncio.sleep(self.poll_interval)
+
+
+@functools.lru_cache(maxsize=None)
+def _render_job_store(root: str) -> RenderJobStore:
+    return RenderJobStore(os.path.join(root, ".jockey", "render_jobs.sqlite"))
+
+
+def get_render_job_store() -> RenderJobStore:
+    """Get the shared render job store under `HOST_PUBLIC_DIR`."""
+    return _render_job_store(os.environ["HOST_PUBLIC_DIR"])
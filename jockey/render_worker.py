@@ -0,0 +1,79 @@
+"""Standalone render worker that renders background combine-clips jobs.
+
+Every worker claims jobs from the SQLite job store under `HOST_PUBLIC_DIR/.jockey` and writes its renders to
+`HOST_PUBLIC_DIR`, so adding render capacity is a matter of starting more workers on hosts that mount the same volume:
+
+    python -m jockey.render_worker --concurrency 4
+
+The job store uses a SQLite rollback journal and the media cache uses lock files created with O_EXCL, so the volume
+only has to support POSIX locks and exclusive creates, as NFS does. The graph server polls the job store for finished
+jobs and posts them to their threads, whichever worker rendered them.
+
+Set `JOCKEY_RENDER_JOBS=1` on the graph server so combine-clips queues its renders, and optionally
+`JOCKEY_RENDER_WORKER_CONCURRENCY=0` so the graph server leaves all rendering to the workers.
+"""
+
+import os
+import sys
+import signal
+import asyncio
+import argparse
+from dotenv import find_dotenv, load_dotenv
+
+# load the environment before the media config and job store read it
+load_dotenv(find_dotenv(usecwd=True))
+
+from jockey.media_config import RENDER_WORKER_CONCURRENCY, RENDER_JOB_LEASE_SECONDS, RENDER_JOB_HEARTBEAT_INTERVAL
+from jockey.render_jobs import RenderWorkerPool, get_render_job_store
+from jockey.stirrups.video_editing import run_render_job
+
+# the graph server needs LLM credentials as well, a render worker only needs the media
+RENDER_WORKER_ENVIRONMENT_VARIABLES = set(["TWELVE_LABS_API_KEY", "HOST_PUBLIC_DIR"])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Jockey Render Worker")
+    parser.add_argument("--concurrency", type=int, default=max(RENDER_WORKER_CONCURRENCY, 1), help="Number of jobs rendered at the same time.")
+    parser.add_argument("--worker-id", default=None, help="ID the worker leases jobs under. Defaults to the hostname and process ID.")
+    parser.add_argument("--lease-seconds", type=float, default=RENDER_JOB_LEASE_SECONDS, help="How long a lease lasts without a heartbeat.")
+    parser.add_argument("--heartbeat-interval", type=float, default=RENDER_JOB_HEARTBEAT_INTERVAL, help="Seconds between heartbeats.")
+    return parser.parse_args(argv)
+
+
+async def run_render_worker(concurrency: int, worker_id: str = None, lease_seconds: float = None, heartbeat_interval: float = None) -> None:
+    """Render queued jobs until the process receives SIGINT or SIGTERM."""
+    render_worker_pool = RenderWorkerPool(
+        store=get_render_job_store(),
+        runner=run_render_job,
+        concurrency=concurrency,
+        worker_id=worker_id,
+        lease_seconds=lease_seconds or RENDER_JOB_LEASE_SECONDS,
+        heartbeat_interval=heartbeat_interval or RENDER_JOB_HEARTBEAT_INTERVAL,
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+
+    print(f"Render worker {render_worker_pool.worker_id} is rendering up to {concurrency} jobs from {render_worker_pool.store.path}")
+    render_worker_pool.start()
+    await stop.wait()
+
+    # jobs that are cancelled here are re-queued by another worker once their lease expires
+    print(f"Stopping render worker {render_worker_pool.worker_id}...")
+    await render_worker_pool.stop()
+
+
+def main(argv=None):
+    if RENDER_WORKER_ENVIRONMENT_VARIABLES & os.environ.keys() != RENDER_WORKER_ENVIRONMENT_VARIABLES:
+        missing_environment_variables = RENDER_WORKER_ENVIRONMENT_VARIABLES - os.environ.keys()
+        print(f"Missing:\n\t{str.join(', ', missing_environment_variables)}")
+        sys.exit("Missing required environment variables.")
+
+    args = parse_args(argv)
+    asyncio.run(run_render_worker(args.concurrency, args.worker_id, args.lease_seconds, args.heartbeat_interval))
+
+
+if __name__ == "__main__":
+    main()
@@ -42,14 +42,18 @@ class WorkerFunction(str, Enum):
     """Specific functions within the worker node"""
 
     VIDEO_SEARCH = "video_search"
+    BATCH_VIDEO_SEARCH = "batch_video_search"
+    RERANK_CLIPS = "rerank_clips"
     VIDEO_EDITING = "video_editing"
     VIDEO_TEXT_GENERATION = "video_text_generation"
     REMOVE_SEGMENT = "remove_segment"
     COMBINE_CLIPS = "combine_clips"
+    RENDER_JOB_STATUS = "render_job_status"
     DOWNLOAD_VIDEO = "download_video"
     GIST_TEXT_GENERATION = "gist_text_generation"
     SUMMARIZE_TEXT_GENERATION = "summarize_text_generation"
     FREEFORM_TEXT_GENERATION = "freeform_text_generation"
+    BATCH_TEXT_GENERATION = "batch_text_generation"
 
 
 class ErrorType(str, Enum):
@@ -4,8 +4,9 @@ from langchain.tools import BaseTool
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_openai.chat_models.azure import AzureChatOpenAI
 from langchain_openai.chat_models.base import ChatOpenAI
+import asyncio
 from typing import List, Union, Dict
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, PrivateAttr, model_validator
 
 from jockey.stirrups.errors import JockeyError, ErrorType, NodeType, get_langgraph_errors
 from jockey.stirrups.errors import create_langgraph_error_event, create_jockey_error_event
@@ -23,6 +24,8 @@ class Stirrup(BaseModel):
         worker_name (str): Name of the worker. This is used when constructing the graph for a Jockey instance.
             It is recommended this is name that is used in any prompt files as well.
 
+        max_concurrent_tool_calls (int): Maximum number of tool calls from a single message that run at the same time.
+
     Raises:
         TypeError: If a worker LLM instance type isn't supported.
 
@@ -30,31 +33,69 @@ class Stirrup(BaseModel):
         Runnable: A Runnable which consists of a worker LLM bound with tools and a tool routing coroutine.
     """
 
+    # validate assignments so the tool map is rebuilt whenever `tools` is replaced
+    model_config = ConfigDict(validate_assignment=True)
+
     tools: List[BaseTool]
     worker_prompt_file_path: str
     worker_name: str
+    max_concurrent_tool_calls: int = 4
+
+    _tool_map: Dict[str, BaseTool] = PrivateAttr(default_factory=dict)
+
+    @model_validator(mode="after")
+    def _build_tool_map(self) -> "Stirrup":
+        # Create a map as a dictionary where the keys are the names of the tools and the values are the tools themselves.
+        self._tool_map = {tool.name: tool for tool in self.tools}
+        return self
+
+    async def _call_tool(self, tool_call: Dict, semaphore: asyncio.Semaphore) -> Union[Exception, None]:
+        """Run a single tool call, storing its result in `tool_call["output"]`.
+        Errors are stored in `tool_call["error"]` and returned instead of raised so they don't affect the other tool calls."""
+        async with semaphore:
+            try:
+                base_tool: BaseTool = self._tool_map[tool_call["name"]]
+                tool_call["output"] = await base_tool.ainvoke(tool_call["args"])
+                return None
+            except get_langgraph_errors() as error:
+                langgraph_error_event = create_langgraph_error_event(error=error)
+                await parse_langchain_events_terminal(langgraph_error_event)
+                tool_call["error"] = str(error)
+                return error
+            except JockeyError as error:
+                jockey_error_event = create_jockey_error_event(error=error)
+                await parse_langchain_events_terminal(jockey_error_event)
+                tool_call["error"] = str(error)
+                return error
+            except Exception as error:
+                print(f"[DEBUG] Error in tool call: {error}")
+                tool_call["error"] = str(error)
+                return error
 
     async def _call_tools(self, message: AIMessage) -> List[Dict]:
         """Routing coroutine for tools bound to the worker.
 
+        Independent tool calls run concurrently, at most `max_concurrent_tool_calls` at a time, and are returned in the order
+        they appear in the message. A failed tool call gets an `error` instead of an `output`, and an error is only raised
+        when every tool call failed.
+
         Args:
             message (HumanMessage): The output message from the worker after processing the instructor request.
 
+        Raises:
+            Exception: The error of the first tool call, if all of them failed.
+
         Returns:
             List[Dict]: A list of dictionaries representing the tool calls made with inputs and outputs.
         """
-        # Create a map as a dictionary where the keys are the names of the tools and the values are the tools themselves.
-        tool_map = {tool.name: tool for tool in self.tools}
         # Get any tool calls that were provided in the incoming message.
-        tool_calls = message.tool_calls.copy()
+        tool_calls = [dict(tool_call) for tool_call in message.tool_calls]
+        semaphore = asyncio.Semaphore(self.max_concurrent_tool_calls)
 
-        for tool_call in tool_calls:
-            base_tool: BaseTool = tool_map[tool_call["name"]]
-            try:
-                tool_call["output"] = await base_tool.ainvoke(tool_call["args"])
-            except Exception as e:
-                print(f"[DEBUG] Error in tool call: {e}")
-                raise
+        errors = await asyncio.gather(*[self._call_tool(tool_call, semaphore) for tool_call in tool_calls])
+
+        if tool_calls and all(error is not None for error in errors):
+            raise errors[0]
 
         return tool_calls
 
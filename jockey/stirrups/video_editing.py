@@ -1,14 +1,29 @@
 import os
+import json
+import hashlib
+import functools
 import ffmpeg
 from langchain.tools import tool
-from pydantic import BaseModel, Field
-from typing import List, Dict, Union
-from jockey.video_utils import download_video
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel, Field, SerializationInfo, SerializerFunctionWrapHandler, ValidatorFunctionWrapHandler, WrapSerializer, WrapValidator
+from typing import Annotated, Any, Awaitable, Callable, List, Dict, Literal, Sequence, Union
+from jockey.video_utils import download_video, run_ffmpeg, dispatch_jockey_event, smart_cut
+from jockey.clip_ops import plan_clip_renders
+from jockey.media_config import CLIP_MERGE_GAP, ENCODING_PROFILES, DEFAULT_ENCODING_PROFILE
+from jockey.media_config import PROGRESSIVE_OUTPUT_MIN_CLIPS, PROGRESSIVE_FRAGMENT_SECONDS
+from jockey.media_config import RENDER_JOBS_ENABLED, RENDER_WORKER_CONCURRENCY
+from jockey.probe_cache import get_probe_cache
+from jockey.render_jobs import RenderJob, RenderJobPoster, RenderWorkerPool, get_render_job_store
+from jockey.media_cache import get_media_cache
 from jockey.prompts import DEFAULT_VIDEO_EDITING_FILE_PATH
 from jockey.stirrups.stirrup import Stirrup
 from jockey.stirrups.errors import JockeyError, NodeType, WorkerFunction, ErrorType
 import uuid
 
+EncodingProfileName = Literal["draft", "standard", "archival"]
+OutputMode = Literal["auto", "mp4", "fragmented_mp4"]
+RENDER_STREAM_READY_EVENT = "render_stream_ready"
+
 CODEC_FAMILIES = {"mpeg": {"h264", "hevc", "mpeg4"}, "vp": {"vp8", "vp9"}, "av1": {"av1"}}
 
 CODEC_FAMILIES = {
@@ -25,8 +40,9 @@ class Clip(BaseModel):
     end: float = Field(description="The end time of the clip in seconds.")
     metadata: list = Field(description="The metadata of the clip from the search.")
     video_id: str = Field(description="A UUID for the video a clip belongs to.")
+    index_id: Union[str, None] = Field(default=None, description="The Index ID the clip was found in. None for the Index ID of the edit.")
     confidence: str
-    thumbnail_url: str
+    thumbnail_url: Union[str, None] = None
     video_url: str
     video_title: str
 
@@ -40,13 +56,52 @@ class SimplifiedCombineClipsInput(BaseModel):
     output_filename: str = Field(description="The output filename of the combined clips. Must be in the form: [filename].mp4")
 
 
+def _keep_clip_table(clips: Any, handler: ValidatorFunctionWrapHandler) -> Any:
+    """Pass a ClipTable through as is instead of validating every clip of it back into a `Clip` model."""
+    # clip_table imports Clip from this module
+    from jockey.clip_table import ClipTable
+
+    if isinstance(clips, ClipTable):
+        return clips
+    return handler(clips)
+
+
+def _dump_clip_table(clips: Any, handler: SerializerFunctionWrapHandler, info: SerializationInfo) -> Any:
+    """Dump a ClipTable as is, or as clip dicts in JSON mode, instead of warning that it isn't a list."""
+    from jockey.clip_table import ClipTable
+
+    if isinstance(clips, ClipTable):
+        return clips.to_records() if info.mode_is_json() else clips
+    return handler(clips)
+
+
 # used by the worker
 class CombineClipsInput(BaseModel):
     """Ensure the video-editing worker has required inputs for the `@combine_clips` tool."""
 
-    clips: List[Clip] = Field(description="List of clips to be edited together. Each clip must have start and end times and a Video ID.")
+    clips: Annotated[List[Clip], WrapValidator(_keep_clip_table), WrapSerializer(_dump_clip_table, when_used="always")] = Field(
+        description="List of clips to be edited together. Each clip must have start and end times and a Video ID."
+    )
     output_filename: str = Field(description="The output filename of the combined clips. Must be in the form: [filename].mp4")
-    index_id: str = Field(description="Index ID the clips belong to.")
+    index_id: str = Field(description="Index ID the rendered video is stored under and that clips without their own Index ID belong to.")
+    merge_gap: Union[float, None] = Field(
+        default=CLIP_MERGE_GAP,
+        description="Merge clips from the same video that overlap or are at most this many seconds apart before rendering. None disables merging.",
+    )
+    encoding_profile: EncodingProfileName = Field(
+        default=DEFAULT_ENCODING_PROFILE,
+        description="Named encoding profile. Use `draft` for a quick low resolution preview and `archival` for the highest quality.",
+    )
+    output_mode: OutputMode = Field(
+        default="auto",
+        description="`fragmented_mp4` can be watched while it is rendered. `auto` uses it for long compilations and plain `mp4` otherwise.",
+    )
+
+
+class RenderJobStatusInput(BaseModel):
+    """Ensure the video-editing worker has required inputs for the `@render_job_status` tool."""
+
+    job_id: str = Field(description="The Job ID returned by `combine-clips` when the render was queued.")
 
 
 class RemoveSegmentInput(BaseModel):
@@ -62,17 +117,174 @@ def are_codecs_compatible(codecs):
             return True
     return False
 
-def check_video_codecs(video_filepaths):
-    codecs = set()
-    for filepath in video_filepaths:
-        probe = ffmpeg.probe(filepath)
-        video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-        if video_stream:
-            codecs.add(video_stream['codec_name'])
-    return codecs
+def encoding_output_options(encoding_profile: str) -> Dict:
+    """Translate a named encoding profile from media_config.ENCODING_PROFILES into ffmpeg output options."""
+    profile = ENCODING_PROFILES[encoding_profile]
+    output_options = {
+        "vcodec": profile["vcodec"],
+        "preset": profile["preset"],
+        "acodec": profile["acodec"],
+        "audio_bitrate": profile["audio_bitrate"],
+        "threads": profile["threads"],
+    }
+    if profile["crf"] is not None:
+        output_options["crf"] = profile["crf"]
+    else:
+        output_options["video_bitrate"] = profile["video_bitrate"]
+    return output_options
+
+
+def _render_fingerprint(clips: Sequence[Clip], merge_gap: Union[float, None], encoding_profile: str) -> str:
+    """Hash everything that determines the content of a render: the ordered clips, how they are merged and how they are encoded."""
+    render_spec = {
+        "clips": [[clip.video_id, clip.start, clip.end] for clip in clips],
+        "merge_gap": merge_gap,
+        "output_options": encoding_output_options(encoding_profile),
+        "scale_height": ENCODING_PROFILES[encoding_profile]["scale_height"],
+    }
+    return hashlib.sha256(json.dumps(render_spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+async def render_compilation(
+    clips: Sequence[Clip],
+    output_filename: str,
+    index_id: str,
+    merge_gap: Union[float, None] = CLIP_MERGE_GAP,
+    encoding_profile: EncodingProfileName = DEFAULT_ENCODING_PROFILE,
+    output_mode: OutputMode = "auto",
+    on_progress: Union[Callable[[Dict], Awaitable[None]], None] = None,
+) -> str:
+    """Render clips into a single video and get its filepath. This does the work of `combine-clips`, inline or as a background job.
+
+    Args:
+        clips (Sequence[Clip]): Clips in playback order, a list or a ClipTable.
+        on_progress (Callable, optional): Coroutine called with the `ffmpeg_progress` event data of the final encode.
+    """
+    media_cache = get_media_cache()
+
+    # renders are content addressed, so asking for the same compilation again reuses the existing file
+    render_key = os.path.join(index_id, "renders", f"{_render_fingerprint(clips, merge_gap, encoding_profile)}.mp4")
+    scale_height = ENCODING_PROFILES[encoding_profile]["scale_height"]
+
+    # the container isn't part of the render key: a finished render is equally useful whether or not it was fragmented
+    if output_mode == "auto":
+        output_mode = "fragmented_mp4" if len(clips) >= PROGRESSIVE_OUTPUT_MIN_CLIPS else "mp4"
+    output_options = encoding_output_options(encoding_profile)
+    if output_mode == "fragmented_mp4":
+        output_options["movflags"] = "frag_keyframe+empty_moov+default_base_moof"
+        output_options["frag_duration"] = int(PROGRESSIVE_FRAGMENT_SECONDS * 1_000_000)
+
+    async def render(temporary_output_filepath: str) -> None:
+        # plan which source spans to cut so overlapping clips are only downloaded and encoded once
+        render_plan = plan_clip_renders(clips, merge_gap=merge_gap)
+        span_filepaths: Dict[int, str] = {}
+        # clips of a multi-index search remember their own index, video IDs are unique across indexes
+        clip_index_ids = {clip.video_id: clip.index_id or index_id for clip in clips}
+
+        for span_index, span in enumerate(render_plan.spans):
+            video_id = span.video_id
+            video_index_id = clip_index_ids.get(video_id, index_id)
+            start = span.start
+            end = span.end
+            try:
+                video_filepath = await download_video(video_id=video_id, index_id=video_index_id, start=start, end=end)
+            except AssertionError as error:
+                video_filepath = {
+                    "message": f"There was an error retrieving the video metadata for Video ID: {video_id} in Index ID: {video_index_id}. "
+                    "Double check that the Video ID and Index ID are valid and correct.",
+                    "error": str(error),
+                }
+            if isinstance(video_filepath, dict):
+                # a render missing clips would be cached under the fingerprint of every clip, so fail the whole render instead
+                raise JockeyError.create(
+                    node=NodeType.WORKER,
+                    error_type=ErrorType.VIDEO,
+                    function_name=WorkerFunction.COMBINE_CLIPS,
+                    details=f"Error: {video_filepath['message']} {video_filepath['error']}",
+                )
+            span_filepaths[span_index] = video_filepath
+
+        input_streams = []
+
+        for segment in render_plan.segments:
+            # only seek into the span when the segment doesn't cover all of it
+            span = render_plan.spans[segment.span_index]
+            input_options = {}
+            if (segment.start, segment.end) != (span.start, span.end):
+                input_options = {"ss": segment.start - span.start, "t": segment.end - segment.start}
+
+            clip_input_stream = ffmpeg.input(filename=span_filepaths[segment.span_index], loglevel="error", **input_options)
+            clip_video_input_stream = clip_input_stream.video.filter("setpts", "PTS-STARTPTS")
+            if scale_height is not None:
+                clip_video_input_stream = clip_video_input_stream.filter("scale", -2, scale_height).filter("setsar", 1)
+            clip_audio_input_stream = clip_input_stream.audio.filter("asetpts", "PTS-STARTPTS")
+
+            input_streams.extend([clip_video_input_stream, clip_audio_input_stream])
+
+        output_duration = sum(segment.end - segment.start for segment in render_plan.segments)
+        first_segment_duration = render_plan.segments[0].end - render_plan.segments[0].start if render_plan.segments else 0
+        stream_ready = False
+
+        async def report_progress(progress: Dict) -> None:
+            nonlocal stream_ready
+            if on_progress is not None:
+                await on_progress(progress)
+
+            # a fragmented render can be played from its temporary path as soon as the first clip is written
+            if stream_ready or output_mode != "fragmented_mp4" or (progress["out_time_seconds"] or 0) < first_segment_duration:
+                return
+            stream_ready = True
+            stream_data = {"output_filename": output_filename, "output_mode": output_mode, "filepath": temporary_output_filepath}
+            await dispatch_jockey_event(RENDER_STREAM_READY_EVENT, stream_data)
+
+        combine_stream = ffmpeg.concat(*input_streams, v=1, a=1).output(temporary_output_filepath, **output_options).overwrite_output()
+        await run_ffmpeg(
+            combine_stream, label=f"combine {output_filename} ({encoding_profile})", duration=output_duration, on_progress=report_progress
+        )
+
+    await media_cache.get_or_create(render_key, render, keep_partial=output_mode == "fragmented_mp4")
+
+    # every request still gets its own filename, linked to the shared render
+    output_filepath = media_cache.link(render_key, os.path.join(index_id, output_filename))
+    return output_filepath
+
+
+async def run_render_job(render_job: RenderJob, on_progress: Callable[[Dict], Awaitable[None]]) -> str:
+    """Render a background combine-clips job, used as the runner of every RenderWorkerPool."""
+    request = render_job.request
+    return await render_compilation(
+        clips=[Clip(**clip) for clip in request["clips"]],
+        output_filename=request["output_filename"],
+        index_id=request["index_id"],
+        merge_gap=request["merge_gap"],
+        encoding_profile=request["encoding_profile"],
+        output_mode=request["output_mode"],
+        on_progress=on_progress,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_render_worker_pool() -> RenderWorkerPool:
+    """Get the in-process worker pool that renders background combine-clips jobs."""
+    return RenderWorkerPool(store=get_render_job_store(), runner=run_render_job, concurrency=RENDER_WORKER_CONCURRENCY)
+
+
+@functools.lru_cache(maxsize=None)
+def get_render_job_poster() -> RenderJobPoster:
+    """Get the poller that hands the render jobs finished by any worker, in-process or standalone, to the graph server."""
+    return RenderJobPoster(store=get_render_job_store())
+
 
 @tool("combine-clips", args_schema=CombineClipsInput)
-async def combine_clips(clips: List[Clip], output_filename: str, index_id: str) -> Union[str, Dict]:
+async def combine_clips(
+    clips: List[Clip],
+    output_filename: str,
+    index_id: str,
+    merge_gap: Union[float, None] = CLIP_MERGE_GAP,
+    encoding_profile: EncodingProfileName = DEFAULT_ENCODING_PROFILE,
+    output_mode: OutputMode = "auto",
+    config: RunnableConfig = None,
+) -> Union[str, Dict]:
     # """Combine or edit multiple clips together based on their start and end times and video IDs.
     # The full filepath for the combined clips is returned. Return a Union str if successful, or a Dict if an error occurs."""
 
@@ -85,39 +297,40 @@ async def combine_clips(clips: List[Clip], output_filename: str, index_id: str)
             if clip.start < 0:
                 raise ValueError(f"Invalid start time: {clip.start}. Start time cannot be negative.")
 
-        input_streams = []
-        video_filepaths = []
-
-        for clip in clips:
-            video_id = clip.video_id
-            start = clip.start
-            end = clip.end
-            video_filepath = os.path.join(os.environ["HOST_PUBLIC_DIR"], index_id, f"{video_id}_{start}_{end}.mp4")
-            video_filepaths.append(video_filepath)
-            if os.path.isfile(video_filepath) is False:
-                try:
-                    download_video(video_id=video_id, index_id=index_id, start=start, end=end)
-                except AssertionError as error:
-                    error_response = {
-                        "message": f"There was an error retrieving the video metadata for Video ID: {video_id} in Index ID: {index_id}. "
-                        "Double check that the Video ID and Index ID are valid and correct.",
-                        "error": str(error),
-                    }
-                    continue
-
-            clip_video_input_stream = ffmpeg.input(filename=video_filepath, loglevel="error").video
-            clip_audio_input_stream = ffmpeg.input(filename=video_filepath, loglevel="error").audio
-            clip_video_input_stream = clip_video_input_stream.filter("setpts", "PTS-STARTPTS")
-            clip_audio_input_stream = clip_audio_input_stream.filter("asetpts", "PTS-STARTPTS")
+        if RENDER_JOBS_ENABLED:
+            # queue the render and return right away, the result is posted back to the thread when it's done
+            render_request = {
+                "clips": [clip.model_dump() for clip in clips],
+                "output_filename": output_filename,
+                "index_id": index_id,
+                "merge_gap": merge_gap,
+                "encoding_profile": encoding_profile,
+                "output_mode": output_mode,
+            }
+            thread_id = (config or {}).get("configurable", {}).get("thread_id")
+            render_job = get_render_job_store().submit(
+                render_request,
+                thread_id=str(thread_id) if thread_id is not None else None,
+                priority=ENCODING_PROFILES[encoding_profile]["priority"],
+            )
+            render_worker_pool = get_render_worker_pool()
+            render_worker_pool.start()
+            render_worker_pool.notify()
+            get_render_job_poster().start()
+            return {
+                "job_id": render_job.job_id,
+                "status": render_job.status.value,
+                "message": "The render was queued. Its status can be checked with the render-job-status tool.",
+            }
 
-            input_streams.extend([clip_video_input_stream, clip_audio_input_stream])
-
-        output_filepath = os.path.join(os.environ["HOST_PUBLIC_DIR"], index_id, output_filename)
-        ffmpeg.concat(*input_streams, v=1, a=1).output(
-            output_filepath, vcodec="libx264", acodec="libmp3lame", video_bitrate="1M", audio_bitrate="192k"
-        ).overwrite_output().run()
-
-        return output_filepath
+        return await render_compilation(
+            clips=clips,
+            output_filename=output_filename,
+            index_id=index_id,
+            merge_gap=merge_gap,
+            encoding_profile=encoding_profile,
+            output_mode=output_mode,
+        )
 
     except JockeyError:
         # propagate JockeyError as is
@@ -134,39 +347,54 @@ async def combine_clips(clips: List[Clip], output_filename: str, index_id: str)
         raise jockey_error
 
 
-# @tool("remove-segment", args_schema=RemoveSegmentInput)
-# async def remove_segment(video_filepath: str, start: float, end: float) -> Union[str, Dict]:
-#     # """Remove a segment from a video at specified start and end times. The full filepath for the edited video is returned. Return a Union str if successful, or a Dict if an error occurs."""
-#     try:
-#         output_filepath = f"{os.path.splitext(video_filepath)[0]}_clipped.mp4"
-#         left_cut_video_stream = (
-#             ffmpeg.input(filename=video_filepath, loglevel="quiet").video.filter("trim", start=0, end=start).filter("setpts", "PTS-STARTPTS")
-#         )
-#         left_cut_audio_stream = (
-#             ffmpeg.input(filename=video_filepath, loglevel="quiet").audio.filter("atrim", start=0, end=start).filter("asetpts", "PTS-STARTPTS")
-#         )
-#         right_cut_video_stream = (
-#             ffmpeg.input(filename=video_filepath, loglevel="quiet").video.filter("trim", start=end).filter("setpts", "PTS-STARTPTS")
-#         )
-#         right_cut_audio_stream = (
-#             ffmpeg.input(filename=video_filepath, loglevel="quiet").audio.filter("atrim", start=end).filter("asetpts", "PTS-STARTPTS")
-#         )
-#         streams = [left_cut_video_stream, left_cut_audio_stream, right_cut_video_stream, right_cut_audio_stream]
-#         ffmpeg.concat(*streams, v=1, a=1).output(filename=output_filepath, acodec="libmp3lame").overwrite_output().run()
-#         return output_filepath
-#     except Exception as error:
-#         jockey_error = JockeyError.create(
-#             node=NodeType.WORKER,
-#             error_type=ErrorType.VIDEO,
-#             function_name=WorkerFunction.REMOVE_SEGMENT,
-#             details=f"Error: {str(error)}",
-#         )
-#         raise jockey_error
+@tool("render-job-status", args_schema=RenderJobStatusInput)
+async def render_job_status(job_id: str) -> Dict:
+    """Get the status, progress and output filepath of a background render job started by `combine-clips`."""
+    render_job = get_render_job_store().get(job_id)
+    if render_job is None:
+        return {"message": f"There is no render job with Job ID: {job_id}. Double check that the Job ID is valid and correct."}
+    return render_job.model_dump(exclude={"request"})
+
+
+@tool("remove-segment", args_schema=RemoveSegmentInput)
+async def remove_segment(video_filepath: str, start: float, end: float) -> Union[str, Dict]:
+    """Remove a segment from a video at specified start and end times. The full filepath for the edited video is returned.
+    Only the pieces around the cut points are re-encoded, the rest of the video is stream-copied."""
+    try:
+        if start < 0 or end <= start:
+            raise ValueError(f"Invalid segment: {start}-{end}. Start time cannot be negative and must be before the end time.")
+
+        media_probe = await get_probe_cache().probe(video_filepath)
+        if media_probe.duration is None:
+            raise ValueError(f"Could not determine the duration of {video_filepath}.")
+        keep_ranges = [(range_start, range_end) for range_start, range_end in [(0, start), (end, media_probe.duration)] if range_end > range_start]
+        if not keep_ranges:
+            raise ValueError(f"Removing {start}-{end} would leave nothing of {video_filepath}.")
+
+        output_filepath = f"{os.path.splitext(video_filepath)[0]}_clipped.mp4"
+        media_cache = get_media_cache()
+        output_key = media_cache.key_for(output_filepath)
+        if output_key.startswith(os.pardir):
+            # outside of HOST_PUBLIC_DIR, so not managed by the media cache
+            await smart_cut(video_filepath, keep_ranges, output_filepath)
+        else:
+            async with media_cache.write(output_key) as temporary_output_filepath:
+                await smart_cut(video_filepath, keep_ranges, temporary_output_filepath)
+        return output_filepath
+
+    except Exception as error:
+        jockey_error = JockeyError.create(
+            node=NodeType.WORKER,
+            error_type=ErrorType.VIDEO,
+            function_name=WorkerFunction.REMOVE_SEGMENT,
+            details=f"Error: {str(error)}",
+        )
+        raise jockey_error
 
 
 # Construct a valid worker for a Jockey instance.
 video_editing_worker_config = {
-    "tools": [combine_clips],
+    "tools": [combine_clips, render_job_status, remove_segment],
     "worker_prompt_file_path": DEFAULT_VIDEO_EDITING_FILE_PATH,
     "worker_name": "video-editing",
 }
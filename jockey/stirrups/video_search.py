@@ -2,18 +2,33 @@ import requests
 import json
 import urllib
 import os
+import asyncio
 from pydantic import BaseModel, Field
 from langchain.tools import tool
-from typing import Dict, List, Union, Literal
+from typing import AsyncIterator, Dict, List, Tuple, Union, Literal
 from enum import Enum
 from jockey.stirrups.errors import ErrorType, JockeyError, NodeType, WorkerFunction, create_jockey_error_event
-from jockey.video_utils import get_video_metadata
+from jockey.video_utils import dispatch_jockey_event
+from jockey.index_catalog import CatalogVideo, get_index_catalog, lookup_videos
+from jockey.clip_index import clip_key, get_clip_index
+from jockey.transcript_index import get_transcript_index
+from jockey.clip_ops import filter_clip_results
+from jockey.media_config import INDEX_CATALOG_ENABLED, TRANSCRIPT_SEARCH, TRANSCRIPT_MIN_SCORE
+from jockey.media_config import CLIP_MIN_SCORE, CLIP_NMS_IOU_THRESHOLD, CLIP_KNEE_SENSITIVITY
 from jockey.prompts import DEFAULT_VIDEO_SEARCH_FILE_PATH
 from jockey.stirrups.stirrup import Stirrup
 
 TL_BASE_URL = "https://api.twelvelabs.io/v1.2/"
 SEARCH_URL = urllib.parse.urljoin(TL_BASE_URL, "search")
 
+# the search API returns at most this many results per page
+SEARCH_PAGE_LIMIT = 50
+# custom event dispatched for every page of results of a search, as soon as it is hydrated
+SEARCH_RESULTS_PAGE_EVENT = "search_results_page"
+
+# damping constant of reciprocal rank fusion, 60 is the value from the original paper
+RECIPROCAL_RANK_FUSION_K = 60
+
 
 class GroupByEnum(str, Enum):
     CLIP: str = "clip"
@@ -34,8 +49,11 @@ class MarengoSearchInput(BaseModel):
         description="query text to run on a collection of videos, based on the <active_plan> and <tool_call>. Example: 'A man walking a dog'",
     )
     index_id: str = Field(description="parse the <active_plan> to determine the index_id")
+    index_ids: Union[List[str], None] = Field(
+        description="parse the <active_plan> for every index ID to search when it names more than one, including index_id. Otherwise return None",
+    )
     top_n: int = Field(
-        description="parse the <active_plan> to determine the top_n (default: 3, lt: 50)",
+        description="parse the <active_plan> to determine the top_n (default: 3)",
     )
     group_by: Literal["clip"] = Field(
         description="group videos by clip",
@@ -48,15 +66,26 @@ class MarengoSearchInput(BaseModel):
     )
 
 
-async def _base_video_search(
+def _search_headers() -> Dict:
+    return {"x-api-key": os.environ["TWELVE_LABS_API_KEY"], "accept": "application/json", "Content-Type": "application/json"}
+
+
+async def _search_pages(
     query: str,
     index_id: str,
     top_n: int = 3,
     group_by: GroupByEnum = GroupByEnum.CLIP,
     search_options: List[SearchOptionsEnum] = [SearchOptionsEnum.VISUAL, SearchOptionsEnum.CONVERSATION],
     video_filter: Union[List[str], None] = None,
-) -> Union[List[Dict], List]:
-    headers = {"x-api-key": os.environ["TWELVE_LABS_API_KEY"], "accept": "application/json", "Content-Type": "application/json"}
+) -> AsyncIterator[Union[List[Dict], Dict]]:
+    """Run a search on an index and yield its results a page at a time, following the page tokens of the API
+    until top_n results were yielded or there are no more pages. Requests don't block the event loop.
+
+    Yields:
+        Union[List[Dict], Dict]: A page of results without video metadata. If the search fails, an error response is
+            yielded instead of the first page. A failing later page ends the search with the results so far.
+    """
+    headers = _search_headers()
 
     payload = {
         "search_options": search_options,
@@ -64,7 +93,7 @@ async def _base_video_search(
         "threshold": "low",
         "sort_option": "score",
         "conversation_option": "semantic",
-        "page_limit": top_n,
+        "page_limit": min(top_n, SEARCH_PAGE_LIMIT),
         "index_id": index_id,
         "query": query,
     }
@@ -72,46 +101,335 @@ async def _base_video_search(
     if video_filter is not None:
         payload["filter"] = {"id": video_filter}
 
-    video_metadata = requests.post(SEARCH_URL, json=payload, headers=headers)
+    search_response = await asyncio.to_thread(requests.post, SEARCH_URL, json=payload, headers=headers)
+    remaining = top_n
 
-    if video_metadata.status_code != 200:
-        print(f"[ERROR] API request failed with status {video_metadata.status_code}: {video_metadata.text}")
-        error_response = {
-            "message": "There was an API error when searching the index.",
-            "url": SEARCH_URL,
-            "headers": headers,
-            "json_payload": payload,
-            "response": video_metadata.text,
-        }
-        return error_response
+    while True:
+        if search_response.status_code != 200:
+            print(f"[ERROR] API request failed with status {search_response.status_code}: {search_response.text}")
+            if remaining < top_n:
+                return
+            error_response = {
+                "message": "There was an API error when searching the index.",
+                "url": SEARCH_URL,
+                "headers": headers,
+                "json_payload": payload,
+                "response": search_response.text,
+            }
+            yield error_response
+            return
 
-    if group_by == "video":
-        top_n_results = [{"video_id": video["id"]} for video in video_metadata.json()["data"][:top_n]]
-    else:
-        top_n_results = video_metadata.json()["data"][:top_n]
+        search_data = search_response.json()
+        if group_by == "video":
+            page = [{"video_id": video["id"]} for video in search_data["data"][:remaining]]
+        else:
+            page = search_data["data"][:remaining]
 
-    for result in top_n_results:
-        video_id = result["video_id"]
+        remaining -= len(page)
+        if page:
+            yield page
 
-        video_metadata = get_video_metadata(video_id=video_id, index_id=index_id)
+        next_page_token = search_data.get("page_info", {}).get("next_page_token")
+        if remaining <= 0 or not page or not next_page_token:
+            return
 
-        if isinstance(video_metadata, dict) and "error" in video_metadata:
+        search_response = await asyncio.to_thread(requests.get, urllib.parse.urljoin(SEARCH_URL + "/", next_page_token), headers=headers)
+
+
+async def _search_request(
+    query: str,
+    index_id: str,
+    top_n: int = 3,
+    group_by: GroupByEnum = GroupByEnum.CLIP,
+    search_options: List[SearchOptionsEnum] = [SearchOptionsEnum.VISUAL, SearchOptionsEnum.CONVERSATION],
+    video_filter: Union[List[str], None] = None,
+) -> Union[List[Dict], Dict]:
+    """Run a search on an index without blocking the event loop.
+
+    Returns:
+        Union[List[Dict], Dict]: The top_n results without video metadata, or an error response.
+    """
+    results = []
+    async for page in _search_pages(query, index_id, top_n, group_by, search_options, video_filter):
+        if isinstance(page, dict):
+            return page
+        results.extend(page)
+    return results
+
+
+async def _search_indexes(
+    query: str,
+    index_ids: List[str],
+    top_n: int = 3,
+    group_by: GroupByEnum = GroupByEnum.CLIP,
+    search_options: List[SearchOptionsEnum] = [SearchOptionsEnum.VISUAL, SearchOptionsEnum.CONVERSATION],
+    video_filter: Union[List[str], None] = None,
+) -> Union[List[Dict], Dict]:
+    """Run a search on several indexes concurrently and merge the results by score.
+
+    Every result gets the `index_id` it was found in. Indexes whose search fails are skipped.
+
+    Returns:
+        Union[List[Dict], Dict]: The top_n results across all indexes without video metadata, filtered by `filter_clip_results`,
+            or an error response if every search failed.
+    """
+    index_ids = list(dict.fromkeys(index_ids))
+    search_responses = await asyncio.gather(
+        *[_search_request(query, index_id, top_n, group_by, search_options, video_filter) for index_id in index_ids]
+    )
+
+    results = []
+    error_responses = []
+    for index_id, search_response in zip(index_ids, search_responses):
+        if isinstance(search_response, dict):
+            print(f"[WARNING] Skipping Index ID {index_id}, its search failed: {search_response['response']}")
+            error_responses.append(search_response)
+            continue
+        results.extend({**result, "index_id": index_id} for result in search_response)
+
+    if error_responses and len(error_responses) == len(index_ids):
+        return error_responses[0]
+
+    # sorted is stable, so results without a score, like videos, keep the order of their index
+    results = sorted(results, key=lambda result: result.get("score", 0), reverse=True)[:top_n]
+    if group_by == GroupByEnum.CLIP:
+        results, _ = filter_clip_results(results, CLIP_NMS_IOU_THRESHOLD, CLIP_MIN_SCORE, CLIP_KNEE_SENSITIVITY)
+    return results
+
+
+async def _hydrate_results(
+    results: List[Dict], index_id: str, group_by: GroupByEnum = GroupByEnum.CLIP, video_data: Union[Dict[str, CatalogVideo], None] = None
+) -> Union[Dict, None]:
+    """Add the video URL and title to search results in place, looking up each video once in the index catalog.
+    Results are looked up in their own `index_id` if they have one and in `index_id` otherwise.
+
+    Args:
+        video_data (Dict[str, CatalogVideo], optional): Videos by video ID that were already looked up, e.g. for an earlier page
+            of the same search. Videos looked up by this call are added to it.
+
+    Returns:
+        Union[Dict, None]: An error response if the metadata of any of the videos couldn't be retrieved.
+    """
+    video_data = video_data if video_data is not None else {}
+    missing_video_ids: Dict[str, List[str]] = {}
+    for result in results:
+        if result["video_id"] not in video_data:
+            missing_video_ids.setdefault(result.get("index_id", index_id), []).append(result["video_id"])
+
+    lookups = await asyncio.gather(*[lookup_videos(video_index_id, video_ids) for video_index_id, video_ids in missing_video_ids.items()])
+    for catalog_videos, errors in lookups:
+        for video_id, error in errors.items():
             error_response = {
                 "message": "There was an API error when retrieving video metadata.",
                 "video_id": video_id,
-                "response": video_metadata["error"],
+                "response": error,
             }
             return error_response
+        video_data.update(catalog_videos)
 
-        video_data = video_metadata.json()
+    for result in results:
+        catalog_video = video_data[result["video_id"]]
 
         if "video_url" not in result or not result["video_url"]:
-            result["video_url"] = video_data["hls"]["video_url"]
+            result["video_url"] = catalog_video.video_url
 
-        result["video_title"] = video_data["metadata"]["filename"]
+        result["video_title"] = catalog_video.filename
 
         if group_by == "video":
-            result["thumbnail_url"] = video_data["hls"]["thumbnail_urls"][0]
+            result["thumbnail_url"] = catalog_video.thumbnail_url
+
+    return None
+
+
+async def _validate_video_filter(index_ids: List[str], video_filter: Union[List[str], None]) -> Union[Dict, None]:
+    """Check that every Video ID of a video filter is in one of the searched indexes, so a wrong ID is reported instead of
+    silently matching nothing. Only checked against the index catalog, without it every filter passes.
+
+    Returns:
+        Union[Dict, None]: An error response listing the unknown Video IDs.
+    """
+    if not INDEX_CATALOG_ENABLED or not video_filter:
+        return None
+
+    index_ids = list(dict.fromkeys(index_ids))
+    try:
+        index_catalog = get_index_catalog()
+        found = await asyncio.gather(*[index_catalog.lookup(index_id, video_filter) for index_id in index_ids])
+    except Exception as error:
+        print(f"[WARNING] Skipping the video_filter check, the index catalog is unavailable: {error}")
+        return None
+
+    known_video_ids = set().union(*found)
+    unknown_video_ids = [video_id for video_id in video_filter if video_id not in known_video_ids]
+    if unknown_video_ids:
+        return {
+            "message": f"These Video IDs of the video_filter aren't in Index ID {', '.join(index_ids)}: {', '.join(unknown_video_ids)}. "
+            "Double check that the Video IDs are valid and correct.",
+            "video_filter": video_filter,
+        }
+    return None
+
+
+async def stream_video_search(
+    query: str,
+    index_id: str,
+    top_n: int = 3,
+    group_by: GroupByEnum = GroupByEnum.CLIP,
+    search_options: List[SearchOptionsEnum] = [SearchOptionsEnum.VISUAL, SearchOptionsEnum.CONVERSATION],
+    video_filter: Union[List[str], None] = None,
+) -> AsyncIterator[Union[List[Dict], Dict]]:
+    """Search an index for up to top_n results and yield them a page at a time with their video metadata.
+
+    The next page is fetched while the current one is hydrated, and the metadata of a video is only fetched once per search.
+    Clip results are filtered by `filter_clip_results` before they are hydrated, and no more pages are fetched once the
+    filter would drop every later result.
+
+    Yields:
+        Union[List[Dict], Dict]: A page of hydrated results, or an error response after which nothing else is yielded.
+    """
+    pages = _search_pages(query, index_id, top_n, group_by, search_options, video_filter)
+    video_data: Dict[str, CatalogVideo] = {}
+    kept_results: List[Dict] = []
+    next_page = asyncio.ensure_future(anext(pages, None))
+    try:
+        while True:
+            page = await next_page
+            if page is None:
+                return
+            if isinstance(page, dict):
+                yield page
+                return
+
+            exhausted = False
+            if group_by == GroupByEnum.CLIP:
+                page, exhausted = filter_clip_results(page, CLIP_NMS_IOU_THRESHOLD, CLIP_MIN_SCORE, CLIP_KNEE_SENSITIVITY, kept_results)
+                kept_results.extend(page)
+            if not exhausted:
+                next_page = asyncio.ensure_future(anext(pages, None))
+
+            if page:
+                error_response = await _hydrate_results(page, index_id, group_by, video_data)
+                if error_response is not None:
+                    yield error_response
+                    return
+                yield page
+            if exhausted:
+                return
+    finally:
+        # stop fetching pages nobody is going to read
+        next_page.cancel()
+        await asyncio.gather(next_page, return_exceptions=True)
+        await pages.aclose()
+
+
+async def _video_index_ids(index_ids: List[str], video_ids: List[str]) -> Dict[str, str]:
+    """Find the index each video belongs to, Video IDs are unique across indexes. Videos are looked up in the index catalog
+    and among the transcripts indexed before, a video neither of them knows is left out.
+
+    Returns:
+        Dict[str, str]: The Index ID of every video that was found, by Video ID.
+    """
+    if len(index_ids) == 1:
+        return {video_id: index_ids[0] for video_id in video_ids}
+
+    video_index_ids = {}
+    if INDEX_CATALOG_ENABLED:
+        try:
+            index_catalog = get_index_catalog()
+            found = await asyncio.gather(*[index_catalog.lookup(index_id, video_ids) for index_id in index_ids])
+            for index_id, catalog_videos in zip(index_ids, found):
+                for video_id in catalog_videos:
+                    video_index_ids.setdefault(video_id, index_id)
+        except Exception as error:
+            print(f"[WARNING] The index catalog is unavailable, only videos with an indexed transcript are searched locally: {error}")
+
+    transcript_index = get_transcript_index()
+    for index_id in index_ids:
+        for video_id in await asyncio.to_thread(transcript_index.indexed_videos, index_id, video_ids):
+            video_index_ids.setdefault(video_id, index_id)
+    return video_index_ids
+
+
+async def _transcript_search(query: str, index_ids: List[str], top_n: int, video_filter: Union[List[str], None] = None) -> Union[List[Dict], Dict]:
+    """Answer a conversation search from the local transcript index, merged with the API's results if it can't answer alone.
+
+    With `JOCKEY_TRANSCRIPT_SEARCH=local` the local matches are enough when there are top_n of them or when every video of
+    the video filter is indexed, counting only matches that score at least `TRANSCRIPT_MIN_SCORE`. Otherwise, and always
+    with `merge`, they are merged with the API's results by reciprocal rank fusion.
+
+    Returns:
+        Union[List[Dict], Dict]: The top_n results without video metadata, or an error response if the API search failed
+            and there are no local matches.
+    """
+    transcript_index = get_transcript_index()
+    index_ids = list(dict.fromkeys(index_ids))
+    complete = False
+    if video_filter:
+        # a filter names few videos, so index the missing ones, each from its own index, and answer for all of them
+        video_ids_by_index: Dict[str, List[str]] = {}
+        for video_id, index_id in (await _video_index_ids(index_ids, video_filter)).items():
+            video_ids_by_index.setdefault(index_id, []).append(video_id)
+        await asyncio.gather(*[transcript_index.add_videos(index_id, video_ids) for index_id, video_ids in video_ids_by_index.items()])
+        indexed_video_ids = set().union(
+            *[await asyncio.to_thread(transcript_index.indexed_videos, index_id, video_ids) for index_id, video_ids in video_ids_by_index.items()]
+        )
+        complete = set(video_filter) <= indexed_video_ids
+
+    local_results = await asyncio.to_thread(transcript_index.search, query, index_ids, top_n, video_filter)
+    # weak matches, e.g. of words found in most segments, don't answer a search on their own
+    confident_results = [result for result in local_results if result["score"] >= TRANSCRIPT_MIN_SCORE]
+    if TRANSCRIPT_SEARCH == "local" and confident_results and (complete or len(confident_results) >= top_n):
+        return confident_results
+
+    remote_results = await _search_indexes(query, index_ids, top_n, GroupByEnum.CLIP, [SearchOptionsEnum.CONVERSATION], video_filter)
+    if isinstance(remote_results, dict):
+        return local_results or remote_results
+
+    results, _ = merge_search_results([("transcript", local_results), ("search", remote_results)])
+    return results[:top_n]
+
+
+async def _base_video_search(
+    query: str,
+    index_id: str,
+    top_n: int = 3,
+    group_by: GroupByEnum = GroupByEnum.CLIP,
+    search_options: List[SearchOptionsEnum] = [SearchOptionsEnum.VISUAL, SearchOptionsEnum.CONVERSATION],
+    video_filter: Union[List[str], None] = None,
+    index_ids: Union[List[str], None] = None,
+) -> Union[List[Dict], List]:
+    error_response = await _validate_video_filter([index_id, *(index_ids or [])], video_filter)
+    if error_response is not None:
+        return error_response
+
+    if TRANSCRIPT_SEARCH != "off" and group_by == GroupByEnum.CLIP and set(search_options) == {SearchOptionsEnum.CONVERSATION}:
+        top_n_results = await _transcript_search(query, [index_id, *(index_ids or [])], top_n, video_filter)
+        if isinstance(top_n_results, dict):
+            return top_n_results
+        error_response = await _hydrate_results(top_n_results, index_id)
+        if error_response is not None:
+            return error_response
+        return json.dumps(top_n_results)
+
+    if set(index_ids or []) <= {index_id}:
+        # a single index streams its pages, so the first results are shown while the rest are still fetched
+        top_n_results = []
+        page_number = 0
+        async for page in stream_video_search(query, index_id, top_n, group_by, search_options, video_filter):
+            if isinstance(page, dict):
+                return page
+            page_number += 1
+            top_n_results.extend(page)
+            await dispatch_jockey_event(SEARCH_RESULTS_PAGE_EVENT, {"query": query, "page": page_number, "results": page})
+        return json.dumps(top_n_results)
+
+    top_n_results = await _search_indexes(query, [index_id, *(index_ids or [])], top_n, group_by, search_options, video_filter)
+    if isinstance(top_n_results, dict):
+        return top_n_results
+
+    error_response = await _hydrate_results(top_n_results, index_id, group_by)
+    if error_response is not None:
+        return error_response
 
     top_n_results = json.dumps(top_n_results)
 
@@ -135,9 +453,10 @@ async def simple_video_search(
     group_by: GroupByEnum = GroupByEnum.CLIP,
     search_options: List[SearchOptionsEnum] = [SearchOptionsEnum.VISUAL, SearchOptionsEnum.CONVERSATION],
     video_filter: Union[List[str], None] = None,
+    index_ids: Union[List[str], None] = None,
 ) -> Union[List[Dict], List]:
     try:
-        search_results = await _base_video_search(query, index_id, top_n, group_by, search_options, video_filter)
+        search_results = await _base_video_search(query, index_id, top_n, group_by, search_options, video_filter, index_ids)
 
         if isinstance(search_results, list):
             try:
@@ -169,9 +488,194 @@ async def simple_video_search(
         raise jockey_error
 
 
+class SearchQuery(BaseModel):
+    """A single query of a batch search."""
+
+    query: str = Field(description="query text to run on a collection of videos. Example: 'A man walking a dog'")
+    search_options: List[Literal["visual", "conversation", "text_in_video", "logo"]] = Field(
+        description="Determine which modalities would be suitable for this query",
+    )
+
+
+class BatchSearchInput(BaseModel):
+    """Create a valid input for the batch-video-search tool based on the <active_plan> and <tool_call>"""
+
+    queries: List[SearchQuery] = Field(
+        description="one query per thing to find, based on the <active_plan>. Example: 'dunks', 'blocks' and 'three-pointers' are three queries",
+    )
+    index_id: str = Field(description="parse the <active_plan> to determine the index_id")
+    index_ids: Union[List[str], None] = Field(
+        description="parse the <active_plan> for every index ID to search when it names more than one, including index_id. Otherwise return None",
+    )
+    top_n: int = Field(
+        description="parse the <active_plan> to determine the top_n for each query (default: 3, lt: 50)",
+    )
+    video_filter: Union[List[str], None] = Field(
+        description="Filter search results to only include results from video IDs in this list. If <video_filter> is not provided, return None",
+    )
+
+
+def merge_search_results(query_results: List[Tuple[str, List[Dict]]]) -> Tuple[List[Dict], Dict[str, List[int]]]:
+    """Merge the clip results of several queries into one ranking with reciprocal rank fusion.
+
+    A clip found by several queries is kept once and ranks higher the better it ranked for each of them, which works even
+    though the scores of different queries aren't comparable. Ties are broken by the best search score.
+
+    Args:
+        query_results (List[Tuple[str, List[Dict]]]): The query and its results, in the order the search returned them.
+
+    Returns:
+        Tuple[List[Dict], Dict[str, List[int]]]: The merged results, best first, each with the `queries` that found it and its
+            1-based `rank`, and the ranks of the results of each query in the order that query returned them.
+    """
+    merged: Dict[Tuple[str, float, float], Dict] = {}
+    fusion_scores: Dict[Tuple[str, float, float], float] = {}
+    query_keys: Dict[str, List[Tuple[str, float, float]]] = {}
+
+    for query, results in query_results:
+        for position, result in enumerate(results):
+            key = (result["video_id"], result.get("start"), result.get("end"))
+            fusion_scores[key] = fusion_scores.get(key, 0.0) + 1.0 / (RECIPROCAL_RANK_FUSION_K + position + 1)
+            if key not in merged:
+                merged[key] = {**result, "queries": []}
+            elif result.get("score", 0) > merged[key].get("score", 0):
+                merged[key] = {**result, "queries": merged[key]["queries"]}
+            if query not in merged[key]["queries"]:
+                merged[key]["queries"].append(query)
+                query_keys.setdefault(query, []).append(key)
+
+    ranked_keys = sorted(merged, key=lambda key: (fusion_scores[key], merged[key].get("score", 0)), reverse=True)
+    ranks = {key: rank for rank, key in enumerate(ranked_keys, start=1)}
+    for key, rank in ranks.items():
+        merged[key]["rank"] = rank
+
+    groups = {query: [ranks[key] for key in keys] for query, keys in query_keys.items()}
+    return [merged[key] for key in ranked_keys], groups
+
+
+@tool("batch-video-search", args_schema=BatchSearchInput, return_direct=True)
+async def batch_video_search(
+    queries: List[SearchQuery],
+    index_id: str,
+    top_n: int = 3,
+    video_filter: Union[List[str], None] = None,
+    index_ids: Union[List[str], None] = None,
+) -> Union[List[Dict], List]:
+    """Search for clips matching several queries at once, e.g. "dunks and blocks and three-pointers".
+    Results found by more than one query are returned once, ranked across all queries, with the ranks that belong to each query."""
+    try:
+        queries = [SearchQuery.model_validate(query) for query in queries]
+        index_ids = [index_id, *(index_ids or [])]
+        error_response = await _validate_video_filter(index_ids, video_filter)
+        if error_response is not None:
+            return error_response
+
+        query_responses = await asyncio.gather(
+            *[_search_indexes(query.query, index_ids, top_n, GroupByEnum.CLIP, query.search_options, video_filter) for query in queries]
+        )
+
+        query_results = []
+        errors = {}
+        for query, response in zip(queries, query_responses):
+            if isinstance(response, dict):
+                errors[query.query] = response["response"]
+            else:
+                query_results.append((query.query, response))
+
+        if not query_results:
+            return {"message": "There was an API error when searching the index.", "errors": errors}
+
+        results, groups = merge_search_results(query_results)
+
+        # the metadata of a video is fetched once, however many queries found it
+        error_response = await _hydrate_results(results, index_id)
+        if error_response is not None:
+            return error_response
+
+        response = {"results": results, "groups": groups}
+        if errors:
+            response["errors"] = errors
+        return json.dumps(response)
+
+    except Exception as error:
+        print(f"[ERROR] Batch search operation failed: {str(error)}")
+        jockey_error = JockeyError.create(
+            node=NodeType.WORKER,
+            error_type=ErrorType.SEARCH,
+            function_name=WorkerFunction.BATCH_VIDEO_SEARCH,
+            details=f"Error: {str(error)}",
+        )
+        raise jockey_error
+
+
+class SimplifiedRerankClipsInput(BaseModel):
+    """Create a valid input for re-ranking the clips of earlier searches based on the <active_plan> and <tool_call>"""
+
+    query: str = Field(
+        description="query text the clips are re-ranked by, based on the <active_plan> and <tool_call>. Example: 'only the ones outdoors'",
+    )
+    index_id: str = Field(description="parse the <active_plan> to determine the index_id")
+    top_n: int = Field(description="parse the <active_plan> to determine the top_n (default: 10)")
+    min_score: Union[float, None] = Field(
+        description="Drop clips whose cosine similarity to the query is below this value, from -1 to 1. "
+        "If the <active_plan> only asks to re-order the clips, return None",
+    )
+
+
+class RerankClipsInput(SimplifiedRerankClipsInput):
+    clips: List[Dict] = Field(description="The search results to re-rank.")
+
+
+@tool("rerank-clips", args_schema=RerankClipsInput, return_direct=True)
+async def rerank_clips(
+    query: str,
+    index_id: str,
+    clips: List[Dict],
+    top_n: int = 10,
+    min_score: Union[float, None] = None,
+) -> Union[List[Dict], List]:
+    """Re-rank or filter the clips of earlier searches by a new query without searching the index again.
+    The clips are compared to the query in the local clip index. When none of them can be embedded or none is similar enough,
+    the query is searched remotely within the videos of the clips."""
+    try:
+        candidates = {clip_key(index_id, clip): clip for clip in clips}
+        similar_clips = []
+        if candidates:
+            try:
+                clip_index = get_clip_index()
+                await clip_index.add(index_id, list(candidates.values()))
+                similar_clips = await clip_index.query(query, top_n, list(candidates))
+            except Exception as error:
+                print(f"[WARNING] Failed to re-rank clips locally, searching the index instead: {error}")
+
+        reranked_clips = [
+            {**candidates[clip_key(index_id, stored_clip)], "similarity": similarity}
+            for stored_clip, similarity in similar_clips
+            if min_score is None or similarity >= min_score
+        ]
+        if reranked_clips:
+            return json.dumps(reranked_clips)
+
+        video_filter = list(dict.fromkeys(clip["video_id"] for clip in clips)) or None
+        index_ids = list(dict.fromkeys(clip.get("index_id") or index_id for clip in clips)) or None
+        return await _base_video_search(
+            query, index_id, top_n, GroupByEnum.CLIP, [SearchOptionsEnum.VISUAL, SearchOptionsEnum.CONVERSATION], video_filter, index_ids
+        )
+
+    except Exception as error:
+        print(f"[ERROR] Rerank operation failed: {str(error)}")
+        jockey_error = JockeyError.create(
+            node=NodeType.WORKER,
+            error_type=ErrorType.SEARCH,
+            function_name=WorkerFunction.RERANK_CLIPS,
+            details=f"Error: {str(error)}",
+        )
+        raise jockey_error
+
+
 # Construct a valid worker for a Jockey instance.
 video_search_worker_config = {
-    "tools": [simple_video_search],
+    "tools": [simple_video_search, batch_video_search, rerank_clips],
     "worker_prompt_file_path": DEFAULT_VIDEO_SEARCH_FILE_PATH,
     "worker_name": "video-search",
 }
@@ -2,11 +2,16 @@ import requests
 import json
 import urllib
 import os
+import asyncio
 from pydantic import BaseModel, Field
 from langchain.tools import tool
-from typing import Dict, List, Union
+from typing import Dict, List, Tuple, Union
 from enum import Enum
-from jockey.video_utils import get_video_metadata
+from openai import AsyncOpenAI
+from jockey.index_catalog import get_index_catalog, lookup_videos
+from jockey.model_config import OPENAI_MODELS
+from jockey.media_config import TEXT_GENERATION_CONCURRENCY, INDEX_CATALOG_ENABLED
+from jockey.text_generation_cache import get_text_generation_cache
 from jockey.prompts import DEFAULT_VIDEO_TEXT_GENERATION_FILE_PATH
 from jockey.stirrups.stirrup import Stirrup
 from jockey.stirrups.errors import ErrorType, JockeyError, NodeType, WorkerFunction, create_jockey_error_event
@@ -80,11 +85,95 @@ class PegasusFreeformInput(BaseModel):
     )
 
 
+def _text_generation_headers() -> Dict:
+    return {"accept": "application/json", "x-api-key": os.environ["TWELVE_LABS_API_KEY"], "Content-Type": "application/json"}
+
+
+async def _post_text_generation(url: str, payload: Dict, headers: Dict) -> Dict:
+    """Post a text generation request without blocking the event loop, reusing the cached response if there is one.
+    Only successful responses are cached, so failed requests are retried the next time."""
+    text_generation_cache = get_text_generation_cache()
+    response = await asyncio.to_thread(text_generation_cache.get, url, payload)
+    if response is not None:
+        return response
+
+    http_response = await asyncio.to_thread(requests.post, url, json=payload, headers=headers)
+    response = http_response.json()
+    if http_response.ok:
+        await asyncio.to_thread(text_generation_cache.put, url, payload, response)
+    return response
+
+
+async def _video_url(index_id: str, video_id: str) -> str:
+    """Get the HLS URL of a video from the index catalog, or an error message to show in its place."""
+    try:
+        catalog_videos, errors = await lookup_videos(index_id, [video_id])
+    except Exception as e:
+        return f"Error getting video metadata: {str(e)}"
+    if video_id not in catalog_videos:
+        return f"Error getting video metadata: {errors.get(video_id)}"
+    return catalog_videos[video_id].video_url or "Video URL not available in metadata"
+
+
+# the list of segments in a highlight or chapter response, and the fields of each segment's title and description
+TIMELINE_FIELDS = {
+    "highlight": ("highlights", "highlight", "highlight_summary"),
+    "chapter": ("chapters", "chapter_title", "chapter_summary"),
+}
+
+
+def parse_timeline(response: Dict, kind: str, index_id: str, video_id: str, video_url: str, video_title: str) -> List[Dict]:
+    """Turn the segments of a `highlight` or `chapter` response into clips shaped like search results, in the order of the video.
+
+    Segments without a valid time range are skipped. The clips weren't scored by a search, so they all get a score of 100.
+    """
+    list_field, title_field, summary_field = TIMELINE_FIELDS[kind]
+    clips = []
+    for segment in response.get(list_field) or []:
+        # the time range is named start/end or start_sec/end_sec depending on the API version
+        start = segment.get("start", segment.get("start_sec"))
+        end = segment.get("end", segment.get("end_sec"))
+        if start is None or end is None or float(end) <= float(start):
+            continue
+        clips.append({
+            "score": 100.0,
+            "start": float(start),
+            "end": float(end),
+            "metadata": [{"type": kind, "text": segment.get(title_field), "summary": segment.get(summary_field)}],
+            "video_id": video_id,
+            "index_id": index_id,
+            "confidence": "high",
+            "video_url": video_url,
+            "video_title": video_title,
+        })
+    return sorted(clips, key=lambda clip: clip["start"])
+
+
+async def _timeline_clips(response: Dict, kind: str, index_id: str, video_id: str) -> Tuple[str, List[Dict]]:
+    """Get the HLS URL of a video and the clips of its `highlight` or `chapter` response.
+
+    Returns:
+        Tuple[str, List[Dict]]: The URL, or an error message in its place, and the clips. A clip can't be edited without
+            the URL of its video, so there are no clips when it couldn't be looked up.
+    """
+    try:
+        catalog_videos, errors = await lookup_videos(index_id, [video_id])
+    except Exception as e:
+        return f"Error getting video metadata: {str(e)}", []
+    if video_id not in catalog_videos:
+        return f"Error getting video metadata: {errors.get(video_id)}", []
+
+    catalog_video = catalog_videos[video_id]
+    if not catalog_video.video_url:
+        return "Video URL not available in metadata", []
+    return catalog_video.video_url, parse_timeline(response, kind, index_id, video_id, catalog_video.video_url, catalog_video.filename or video_id)
+
+
 @tool("gist-text-generation", args_schema=PegasusGistInput)
 async def gist_text_generation(video_id: str, index_id: str = None, endpoint_options: List[GistEndpointsEnum] = None) -> Dict:
     """Generate `gist` output for a single video. This can include any combination of: topics, hashtags, and a title"""
     try:
-        headers = {"accept": "application/json", "x-api-key": os.environ["TWELVE_LABS_API_KEY"], "Content-Type": "application/json"}
+        headers = _text_generation_headers()
         
         # 기본값 설정
         if endpoint_options is None:
@@ -93,30 +182,11 @@ async def gist_text_generation(video_id: str, index_id: str = None, endpoint_opt
         payload = {"video_id": video_id, "types": endpoint_options}
 
         # API 호출
-        response = requests.post(GIST_URL, json=payload, headers=headers)
-        response = response.json()
+        response = await _post_text_generation(GIST_URL, payload, headers)
         
         # 비디오 메타데이터 가져오기 (선택적)
         if index_id:
-            try:
-                video_metadata = get_video_metadata(index_id=index_id, video_id=video_id)
-                # Add video_url if available
-                try:
-                    # 응답 객체인 경우
-                    if hasattr(video_metadata, 'json'):
-                        metadata_dict = video_metadata.json()
-                    # 이미 딕셔너리인 경우
-                    else:
-                        metadata_dict = video_metadata
-                    
-                    if "hls" in metadata_dict and "video_url" in metadata_dict["hls"]:
-                        response["video_url"] = metadata_dict["hls"]["video_url"]
-                    else:
-                        response["video_url"] = "Video URL not available in metadata"
-                except (AttributeError, KeyError) as e:
-                    response["video_url"] = f"Error getting video URL: {str(e)}"
-            except Exception as e:
-                response["video_url"] = f"Error getting video metadata: {str(e)}"
+            response["video_url"] = await _video_url(index_id, video_id)
             
         return json.dumps(response)
 
@@ -139,7 +209,15 @@ async def summarize_text_generation(video_id: str, index_id: str = None, endpoin
     - highlight: A chronologically ordered list of the most important events within a video.
     """
     try:
-        headers = {"accept": "application/json", "x-api-key": os.environ["TWELVE_LABS_API_KEY"], "Content-Type": "application/json"}
+        # highlights and chapters become clips, the ones generated with the default prompt are kept as the video's timeline
+        timeline_kind = SummarizeEndpointEnum(endpoint_option).value if endpoint_option != SummarizeEndpointEnum.SUMMARY and index_id else None
+        cache_timeline = timeline_kind is not None and prompt is None
+        if cache_timeline:
+            timeline = await asyncio.to_thread(get_text_generation_cache().get_timeline, index_id, video_id, timeline_kind)
+            if timeline is not None:
+                return json.dumps({**timeline["response"], "clips": timeline["clips"]})
+
+        headers = _text_generation_headers()
         payload = {
             "video_id": video_id,
             "type": endpoint_option,
@@ -158,30 +236,16 @@ async def summarize_text_generation(video_id: str, index_id: str = None, endpoin
             payload["prompt"] = prompt
 
         # API 호출
-        response = requests.post(SUMMARIZE_URL, json=payload, headers=headers)
-        response = response.json()
+        response = await _post_text_generation(SUMMARIZE_URL, payload, headers)
         
         # 비디오 메타데이터 가져오기 (선택적)
-        if index_id:
-            try:
-                video_metadata = get_video_metadata(index_id=index_id, video_id=video_id)
-                # Add video_url if available
-                try:
-                    # 응답 객체인 경우
-                    if hasattr(video_metadata, 'json'):
-                        metadata_dict = video_metadata.json()
-                    # 이미 딕셔너리인 경우
-                    else:
-                        metadata_dict = video_metadata
-                    
-                    if "hls" in metadata_dict and "video_url" in metadata_dict["hls"]:
-                        response["video_url"] = metadata_dict["hls"]["video_url"]
-                    else:
-                        response["video_url"] = "Video URL not available in metadata"
-                except (AttributeError, KeyError) as e:
-                    response["video_url"] = f"Error getting video URL: {str(e)}"
-            except Exception as e:
-                response["video_url"] = f"Error getting video metadata: {str(e)}"
+        if timeline_kind is not None and not ("code" in response and "message" in response):
+            response["video_url"], clips = await _timeline_clips(response, timeline_kind, index_id, video_id)
+            if cache_timeline and clips:
+                await asyncio.to_thread(get_text_generation_cache().put_timeline, index_id, video_id, timeline_kind, response, clips)
+            response["clips"] = clips
+        elif index_id:
+            response["video_url"] = await _video_url(index_id, video_id)
             
         return json.dumps(response)
 
@@ -200,37 +264,18 @@ async def freeform_text_generation(video_id: str, index_id: str = None, prompt:
     """Generate any type of text output for a single video.
     Useful for answering specific questions, understanding fine grained details, and anything else that doesn't fall neatly into the other tools."""
     try:
-        headers = {"accept": "application/json", "x-api-key": os.environ["TWELVE_LABS_API_KEY"], "Content-Type": "application/json"}
+        headers = _text_generation_headers()
         payload = {
             "video_id": video_id,
             "prompt": prompt,
         }
 
         # API 호출
-        response = requests.post(GENERATE_URL, json=payload, headers=headers)
-        response = response.json()
+        response = await _post_text_generation(GENERATE_URL, payload, headers)
         
         # 비디오 메타데이터 가져오기 (선택적)
         if index_id:
-            try:
-                video_metadata = get_video_metadata(index_id=index_id, video_id=video_id)
-                # Add video_url if available
-                try:
-                    # 응답 객체인 경우
-                    if hasattr(video_metadata, 'json'):
-                        metadata_dict = video_metadata.json()
-                    # 이미 딕셔너리인 경우
-                    else:
-                        metadata_dict = video_metadata
-                    
-                    if "hls" in metadata_dict and "video_url" in metadata_dict["hls"]:
-                        response["video_url"] = metadata_dict["hls"]["video_url"]
-                    else:
-                        response["video_url"] = "Video URL not available in metadata"
-                except (AttributeError, KeyError) as e:
-                    response["video_url"] = f"Error getting video URL: {str(e)}"
-            except Exception as e:
-                response["video_url"] = f"Error getting video metadata: {str(e)}"
+            response["video_url"] = await _video_url(index_id, video_id)
             
         return json.dumps(response)
 
@@ -244,9 +289,148 @@ async def freeform_text_generation(video_id: str, index_id: str = None, prompt:
         raise jockey_error
 
 
+class BatchTextGenerationTaskEnum(str, Enum):
+    """Helps to ensure the video-text-generation worker selects a valid `task` for the batch tool."""
+
+    GIST = "gist"
+    SUMMARY = "summary"
+    HIGHLIGHT = "highlight"
+    CHAPTER = "chapter"
+    FREEFORM = "freeform"
+
+
+class BatchTextGenerationInput(BaseModel):
+    """Help to ensure the video-text-generation worker provides valid arguments to any tool it calls."""
+
+    video_ids: List[str] = Field(description="IDs of the videos to generate text from. Leave empty to use the videos of the selected search results.")
+    index_id: str = Field(description="Index ID which contains a collection of videos.")
+    task: BatchTextGenerationTaskEnum = Field(
+        description="Determines what output to generate for every video.", default=BatchTextGenerationTaskEnum.SUMMARY
+    )
+    prompt: Union[str, None] = Field(
+        description="Instructions on how the text is generated for every video. Required for the freeform task.", default=None, max_length=300
+    )
+    combine: bool = Field(description="Combine the outputs for all videos into one answer, e.g. to compare or rank the videos.", default=False)
+
+
+def _text_generation_request(video_id: str, task: BatchTextGenerationTaskEnum, prompt: Union[str, None]) -> Tuple[str, Dict]:
+    """Build the endpoint URL and payload of one task of a batch for a single video."""
+    if task == BatchTextGenerationTaskEnum.GIST:
+        return GIST_URL, {"video_id": video_id, "types": [option.value for option in GistEndpointsEnum]}
+    if task == BatchTextGenerationTaskEnum.FREEFORM:
+        return GENERATE_URL, {"video_id": video_id, "prompt": prompt}
+
+    payload = {"video_id": video_id, "type": task.value}
+    if prompt is not None:
+        payload["prompt"] = prompt
+    return SUMMARIZE_URL, payload
+
+
+async def _reduce_text_generation(task: BatchTextGenerationTaskEnum, prompt: Union[str, None], results: List[Dict]) -> str:
+    """Combine the per video outputs of a batch into one answer."""
+    instructions = (
+        f"You are given the {task.value} output generated for each of {len(results)} videos. "
+        "Combine them into one answer that covers every video, refers to the videos by their Video ID, "
+        "and points out what they have in common and where they differ. Only use the information in the outputs."
+    )
+    if prompt:
+        instructions += f" The outputs were generated with these instructions, follow them for the combined answer as well: {prompt}"
+
+    completion = await AsyncOpenAI().chat.completions.create(
+        model=OPENAI_MODELS["worker"],
+        messages=[
+            {"role": "system", "content": instructions},
+            {"role": "user", "content": json.dumps([{"video_id": result["video_id"], "output": result["output"]} for result in results])},
+        ],
+        temperature=0,
+    )
+    return completion.choices[0].message.content
+
+
+@tool("batch-text-generation", args_schema=BatchTextGenerationInput)
+async def batch_text_generation(
+    video_ids: List[str],
+    index_id: str = None,
+    task: BatchTextGenerationTaskEnum = BatchTextGenerationTaskEnum.SUMMARY,
+    prompt: Union[str, None] = None,
+    combine: bool = False,
+) -> Dict:
+    """Generate the same `gist` `summary` `highlight` `chapter` or `freeform` output for many videos at once,
+    and optionally combine the outputs into one answer. Use it instead of calling a single video tool once per video."""
+    try:
+        task = BatchTextGenerationTaskEnum(task)
+        if task == BatchTextGenerationTaskEnum.FREEFORM and not prompt:
+            raise ValueError("The freeform task needs a prompt.")
+
+        headers = _text_generation_headers()
+        semaphore = asyncio.Semaphore(TEXT_GENERATION_CONCURRENCY)
+        video_ids = list(dict.fromkeys(video_ids))
+
+        # titles and URLs come with the index catalog, so they don't cost a request per video
+        catalog_videos = None
+        if INDEX_CATALOG_ENABLED and index_id:
+            try:
+                catalog_videos = await get_index_catalog().lookup(index_id, video_ids)
+            except Exception as error:
+                print(f"[WARNING] The catalog of Index ID {index_id} is unavailable: {error}")
+
+        async def generate(video_id: str) -> Dict:
+            result = {"video_id": video_id}
+            if catalog_videos is not None:
+                if video_id not in catalog_videos:
+                    return {**result, "error": f"Video ID {video_id} isn't in Index ID {index_id}."}
+                result["video_title"] = catalog_videos[video_id].filename
+                result["video_url"] = catalog_videos[video_id].video_url
+
+            timeline_kind = task.value if task in (BatchTextGenerationTaskEnum.HIGHLIGHT, BatchTextGenerationTaskEnum.CHAPTER) and index_id else None
+            cache_timeline = timeline_kind is not None and prompt is None
+            if cache_timeline:
+                timeline = await asyncio.to_thread(get_text_generation_cache().get_timeline, index_id, video_id, timeline_kind)
+                if timeline is not None:
+                    return {**result, "output": timeline["response"], "clips": timeline["clips"]}
+
+            url, payload = _text_generation_request(video_id, task, prompt)
+            try:
+                async with semaphore:
+                    response = await _post_text_generation(url, payload, headers)
+            except Exception as error:
+                return {**result, "error": str(error)}
+
+            # failed requests return an error message instead of the generated text
+            if "code" in response and "message" in response:
+                return {**result, "error": response["message"]}
+            if timeline_kind is None:
+                return {**result, "output": response}
+
+            _, clips = await _timeline_clips(response, timeline_kind, index_id, video_id)
+            if cache_timeline and clips:
+                await asyncio.to_thread(get_text_generation_cache().put_timeline, index_id, video_id, timeline_kind, response, clips)
+            return {**result, "output": response, "clips": clips}
+
+        # map: every video is generated once, in the order it was asked for
+        results = await asyncio.gather(*[generate(video_id) for video_id in video_ids])
+        response = {"task": task.value, "results": results}
+
+        # reduce: combine the outputs that were generated
+        generated_results = [result for result in results if "output" in result]
+        if combine and generated_results:
+            response["combined"] = await _reduce_text_generation(task, prompt, generated_results)
+
+        return json.dumps(response)
+
+    except Exception as error:
+        jockey_error = JockeyError.create(
+            node=NodeType.WORKER,
+            error_type=ErrorType.TEXT_GENERATION,
+            function_name=WorkerFunction.BATCH_TEXT_GENERATION,
+            details=f"Error: {str(error)}",
+        )
+        raise jockey_error
+
+
 # Construct a valid worker for a Jockey instance.
 video_text_generation_worker_config = {
-    "tools": [gist_text_generation, summarize_text_generation, freeform_text_generation],
+    "tools": [gist_text_generation, summarize_text_generation, freeform_text_generation, batch_text_generation],
     "worker_prompt_file_path": DEFAULT_VIDEO_TEXT_GENERATION_FILE_PATH,
     "worker_name": "video-text-generation",
 }
@@ -0,0 +1,23 @@
+import pytest
+
+from jockey.stirrups.video_editing import Clip
+
+
+@pytest.fixture
+def make_clip():
+    """factory for search result clips, five seconds long unless `end` is given"""
+
+    def make(video_id, start, end=None, score=80, metadata=None, **fields):
+        return Clip(
+            score=score,
+            start=start,
+            end=start + 5 if end is None else end,
+            metadata=metadata or [],
+            video_id=video_id,
+            confidence="high",
+            video_url=f"https://hls/{video_id}.m3u8",
+            video_title=f"{video_id}.mp4",
+            **fields,
+        )
+
+    return make
@@ -0,0 +1,170 @@
+import json
+import threading
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# testing clip_index.py
+from jockey import clip_index
+from jockey.clip_index import ClipIndex, TwelveLabsEmbedder, clip_key
+from jockey.stirrups import video_search
+
+
+class FakeEmbedder:
+    """embeds a clip by the direction of its video, so clips of one video are the same"""
+
+    name = "fake"
+
+    def __init__(self, directions):
+        self.directions = directions
+        self.embedded_clips = []
+
+    async def embed_texts(self, texts):
+        return np.stack([np.asarray(self.directions[text], dtype=np.float32) for text in texts])
+
+    async def embed_clips(self, keys):
+        self.embedded_clips.extend(keys)
+        return [np.asarray(self.directions[video_id], dtype=np.float32) if video_id in self.directions else None for _, video_id, _, _ in keys]
+
+
+@pytest.fixture
+def make_result(make_clip):
+    """search results reach the index as JSON, so the clips are dumped to dicts"""
+    return lambda video_id, start: make_clip(video_id, start).model_dump()
+
+
+@pytest.fixture
+def embedder():
+    return FakeEmbedder({"outdoors": [1, 0, 0], "indoors": [0, 1, 0], "park": [3, 1, 0], "gym": [0, 2, 1], "beach": [2, 0, 1]})
+
+
+@pytest.mark.asyncio
+async def test_clip_index_ranks_and_persists(tmp_path, embedder, make_result):
+    index = ClipIndex(str(tmp_path / "clip_index"), embedder)
+    clips = [make_result("park", 0), make_result("gym", 0), make_result("beach", 10), make_result("unembeddable", 0)]
+
+    assert await index.add("index", clips) == 3
+    # clips already in the index aren't embedded again
+    assert await index.add("index", clips[:2]) == 0
+    assert len(embedder.embedded_clips) == 4
+
+    ranked = await index.query("outdoors", 2)
+    assert [clip["video_id"] for clip, _ in ranked] == ["park", "beach"]
+    assert ranked[0][1] == pytest.approx(3 / np.sqrt(10))
+
+    # a subset is ranked on its own, keys that aren't in the index are skipped
+    keys = [clip_key("index", clip) for clip in clips[1:]]
+    assert [clip["video_id"] for clip, _ in await index.query("indoors", 5, keys)] == ["gym", "beach"]
+
+    reloaded = ClipIndex(str(tmp_path / "clip_index"), embedder)
+    assert len(reloaded) == 3 and clip_key("index", clips[0]) in reloaded
+    # an index built by another embedder is discarded
+    embedder.name = "other"
+    assert len(ClipIndex(str(tmp_path / "clip_index"), embedder)) == 0
+
+    # so is a chunk whose matrix doesn't have a row for every clip
+    embedder.name = "fake"
+    keys = [clip_key("index", make_result("park", 20)), clip_key("index", make_result("gym", 20))]
+    reloaded._write_chunk(2, reloaded.embeddings[:1], keys, clips[:2])
+    assert len(ClipIndex(str(tmp_path / "clip_index"), embedder)) == 3
+
+
+@pytest.mark.asyncio
+async def test_clip_index_appends_chunks_and_merges_them(tmp_path, embedder, make_result):
+    directory = tmp_path / "clip_index"
+    index = ClipIndex(str(directory), embedder)
+
+    with patch.object(clip_index, "MAX_CHUNK_FILES", 3):
+        for start in range(3):
+            await index.add("index", [make_result("park", start), make_result("gym", start)])
+        # every add only writes its own rows
+        assert sorted(path.name for path in directory.iterdir()) == ["chunk-00000001.npz", "chunk-00000002.npz", "chunk-00000003.npz"]
+        with np.load(directory / "chunk-00000003.npz") as stored:
+            assert stored["embeddings"].shape == (2, 3)
+
+        await index.add("index", [make_result("beach", 0)])
+        assert sorted(path.name for path in directory.iterdir()) == ["chunk-00000004.npz"]
+
+    reloaded = ClipIndex(str(directory), embedder)
+    assert reloaded.clips == index.clips
+    np.testing.assert_array_equal(reloaded.embeddings, index.embeddings)
+    assert [clip["video_id"] for clip, _ in await reloaded.query("outdoors", 1)] == ["park"]
+
+
+class FakeAnnIndex:
+    """exact search behind the hnswlib interface, remembering the thread it was built on"""
+
+    def __init__(self, space, dim):
+        self.build_thread = None
+
+    def init_index(self, max_elements, ef_construction, M):
+        self.build_thread = threading.current_thread()
+
+    def add_items(self, data, ids):
+        self.data = data
+
+    def set_ef(self, ef):
+        pass
+
+    def knn_query(self, vector, k):
+        scores = self.data @ vector
+        labels = np.argsort(-scores)[:k]
+        return labels[None], 1 - scores[labels][None]
+
+
+@pytest.mark.asyncio
+async def test_ann_index_is_built_off_the_event_loop(tmp_path, embedder, make_result):
+    index = ClipIndex(str(tmp_path / "clip_index"), embedder, ann_threshold=2)
+    await index.add("index", [make_result("park", 0), make_result("gym", 0), make_result("beach", 10)])
+
+    with patch.object(clip_index, "hnswlib", MagicMock(Index=FakeAnnIndex)):
+        ranked = await index.query("outdoors", 2)
+
+    assert [clip["video_id"] for clip, _ in ranked] == ["park", "beach"]
+    assert index._ann_index.build_thread is not threading.main_thread()
+
+
+@pytest.mark.asyncio
+async def test_twelve_labs_embedder_averages_overlapping_segments(monkeypatch):
+    monkeypatch.setenv("TWELVE_LABS_API_KEY", "test")
+    response = MagicMock()
+    response.json.return_value = {
+        "embedding": {
+            "video_embedding": {
+                "segments": [
+                    {"start_offset_sec": 0, "end_offset_sec": 6, "embedding_option": "visual-text", "float": [1, 0]},
+                    {"start_offset_sec": 6, "end_offset_sec": 12, "embedding_option": "visual-text", "float": [0, 1]},
+                    {"start_offset_sec": 12, "end_offset_sec": 18, "embedding_option": "visual-text", "float": [1, 1]},
+                ]
+            }
+        }
+    }
+
+    with patch.object(clip_index.requests, "get", return_value=response) as mock_get:
+        vectors = await TwelveLabsEmbedder().embed_clips([("index", "a", 4, 8), ("index", "a", 13, 14), ("index", "a", 30, 35)])
+
+    mock_get.assert_called_once()
+    np.testing.assert_allclose(vectors[0], [0.5, 0.5])
+    np.testing.assert_allclose(vectors[1], [1, 1])
+    # past the last segment, the closest segment is used
+    np.testing.assert_allclose(vectors[2], [1, 1])
+
+
+@pytest.mark.asyncio
+async def test_rerank_clips_filters_locally_and_falls_back_to_search(tmp_path, embedder, make_result):
+    index = ClipIndex(str(tmp_path / "clip_index"), embedder)
+    clips = [make_result("gym", 0), make_result("park", 0), make_result("beach", 10)]
+
+    with patch.object(video_search, "get_clip_index", return_value=index), patch.object(
+        video_search, "_base_video_search", new_callable=AsyncMock, return_value="[]"
+    ) as mock_search:
+        output = json.loads(
+            await video_search.rerank_clips.ainvoke({"query": "outdoors", "index_id": "index", "clips": clips, "top_n": 5, "min_score": 0.5})
+        )
+        await video_search.rerank_clips.ainvoke({"query": "indoors", "index_id": "index", "clips": clips[1:], "top_n": 5, "min_score": 0.9})
+
+    assert [clip["video_id"] for clip in output] == ["park", "beach"]
+    assert output[0]["video_url"] == "https://hls/park.m3u8"
+    # no clip of park or beach is indoors, so only their videos are searched
+    assert mock_search.call_count == 1
+    assert mock_search.call_args.args[5] == ["park", "beach"]
@@ -0,0 +1,93 @@
+
+# testing clip_ops.py
+from jockey.clip_ops import filter_clip_results, knee_cutoff, merge_intervals, plan_clip_renders, plan_smart_cut, suppress_overlaps
+
+
+def test_merge_intervals_with_gap():
+    assert merge_intervals([(9, 12), (0, 5), (5.5, 7)], gap=1) == [[0, 7], [9, 12]]
+    assert merge_intervals([(9, 12), (0, 5), (5.5, 7)], gap=0) == [[0, 5], [5.5, 7], [9, 12]]
+
+
+def test_plan_clip_renders_without_merging(make_clip):
+    clips = [make_clip("video1", 0, 10), make_clip("video1", 5, 15)]
+    plan = plan_clip_renders(clips, merge_gap=None)
+
+    assert len(plan.spans) == 2
+    assert [(segment.start, segment.end) for segment in plan.segments] == [(0, 10), (5, 15)]
+
+
+def test_plan_clip_renders_merges_spans_and_preserves_order(make_clip):
+    clips = [
+        make_clip("video1", 0, 10),
+        make_clip("video1", 9, 15),  # overlaps the previous clip, played back as one segment
+        make_clip("video2", 3, 6),
+        make_clip("video1", 15.5, 20),  # near-adjacent, cut from the same span as the first segment
+        make_clip("video1", 40, 45),
+    ]
+    plan = plan_clip_renders(clips, merge_gap=1)
+
+    assert [(span.video_id, span.start, span.end) for span in plan.spans] == [
+        ("video1", 0, 20),
+        ("video1", 40, 45),
+        ("video2", 3, 6),
+    ]
+    assert [(segment.span_index, segment.start, segment.end) for segment in plan.segments] == [
+        (0, 0, 15),
+        (2, 3, 6),
+        (0, 15.5, 20),
+        (1, 40, 45),
+    ]
+
+
+def test_plan_smart_cut_copies_between_keyframes():
+    pieces = plan_smart_cut([(0, 3), (5, 10)], keyframes=[0, 2, 4, 6, 8], duration=10)
+
+    assert [(piece.start, piece.end, piece.copy_stream) for piece in pieces] == [
+        (0, 2, True),
+        (2, 3, False),
+        (5, 6, False),
+        (6, 10, True),
+    ]
+
+
+def test_plan_smart_cut_reencodes_ranges_without_keyframes():
+    pieces = plan_smart_cut([(2.5, 3.5), (4, 4)], keyframes=[0, 2, 4])
+
+    assert [(piece.start, piece.end, piece.copy_stream) for piece in pieces] == [(2.5, 3.5, False)]
+
+
+def make_result(video_id, start, end, score):
+    return {"video_id": video_id, "start": start, "end": end, "score": score}
+
+
+def test_suppress_overlaps_keeps_the_best_clip_of_each_video():
+    # the same timestamps in another video are a different clip
+    keep = suppress_overlaps(["a", "a", "b", "a", "a"], [0, 2, 0, 8, 30], [10, 10, 10, 20, 40], iou_threshold=0.5)
+    assert keep.tolist() == [True, False, True, True, True]
+
+    # clips kept from an earlier page suppress the clips they overlap
+    keep = suppress_overlaps(["a", "a"], [1, 30], [11, 40], iou_threshold=0.5, kept=[("a", 0, 10)])
+    assert keep.tolist() == [False, True]
+
+
+def test_knee_cutoff():
+    assert knee_cutoff([95, 94, 60, 58, 57, 56, 55], sensitivity=0.2) == 2
+    assert knee_cutoff([95, 90], sensitivity=0.2) == 2
+    # a late drop isn't a knee, the clips before it are all good
+    assert knee_cutoff([95, 94, 93, 92, 40], sensitivity=0.2) == 5
+
+
+def test_filter_clip_results_reports_when_the_rest_would_be_dropped():
+    results = [make_result("a", 0, 10, 90), make_result("a", 1, 10, 89), make_result("b", 0, 10, 80), make_result("c", 0, 10, 40)]
+
+    kept, exhausted = filter_clip_results(results)
+    assert kept == results and not exhausted
+
+    kept, exhausted = filter_clip_results(results, iou_threshold=0.5, min_score=50)
+    assert [(result["video_id"], result["score"]) for result in kept] == [("a", 90), ("b", 80)]
+    assert exhausted
+
+    # a next page is filtered against the results kept so far
+    kept, exhausted = filter_clip_results([make_result("a", 2, 11, 79), make_result("d", 0, 10, 78)], iou_threshold=0.5, kept=results[:1])
+    assert [result["video_id"] for result in kept] == ["d"]
+    assert not exhausted
@@ -0,0 +1,58 @@
+import copy
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+# testing clip_registry.py
+from jockey.clip_registry import ClipRegistry, as_clip_registry
+from jockey.clip_table import ClipTable
+
+
+def spans(clips):
+    return [(clip.video_id, clip.start, clip.end) for clip in clips]
+
+
+def test_merge_appends_new_clips_and_leaves_earlier_versions_alone(make_clip):
+    first = as_clip_registry({"call_1": [make_clip("a", 0, 10), make_clip("a", 0, 10)]})
+    second = first.merge({"call_1": [make_clip("a", 0, 10, score=10), make_clip("b", 0, 10)], "call_2": [make_clip("a", 0, 10)]})
+
+    # both versions share one log
+    assert second._log is first._log
+    assert spans(first["call_1"]) == [("a", 0, 10)]
+    assert list(first) == ["call_1"] and "call_2" not in first
+    assert spans(second["call_1"]) == [("a", 0, 10), ("b", 0, 10)]
+    assert second["call_1"][0].score == 80
+    assert spans(second["call_2"]) == [("a", 0, 10)]
+    assert first.merge({}) is first
+    # clips a tool call already has add nothing
+    assert second.merge({"call_2": [make_clip("a", 0, 10)]}).model_dump() == second.model_dump()
+    assert copy.deepcopy(second) is second
+
+    # merging into an earlier version again forks the log instead of changing the later version
+    fork = first.merge({"call_3": [make_clip("c", 0, 5)]})
+    assert fork._log is not first._log
+    assert list(fork) == ["call_1", "call_3"]
+    assert list(second) == ["call_1", "call_2"]
+    assert len(second.clips_for_video("c")) == 0
+
+
+def test_video_lookups_span_tool_calls_and_stop_at_the_version(make_clip):
+    first = as_clip_registry({"call_1": [make_clip("a", 0, 10), make_clip("b", 0, 10), make_clip("a", 30, 40)]})
+    second = first.merge({"call_2": [make_clip("a", 8, 20), make_clip("a", 0, 10)]})
+
+    assert spans(second.clips_for_video("a")) == [("a", 0, 10), ("a", 30, 40), ("a", 8, 20), ("a", 0, 10)]
+    assert spans(second.overlapping("a", 9, 31)) == [("a", 0, 10), ("a", 30, 40), ("a", 8, 20), ("a", 0, 10)]
+    assert spans(second.overlapping("a", 10, 30)) == [("a", 8, 20)]
+    assert spans(first.overlapping("a", 10, 30)) == []
+    assert len(second.clips_for_video("z")) == 0
+    assert spans(second.select(["call_2", "unknown", "call_1"]))[:2] == [("a", 8, 20), ("a", 0, 10)]
+
+
+def test_registry_survives_the_checkpoint_serializer(make_clip):
+    registry = as_clip_registry({"call_1": [make_clip("a", 0, 10)]}).merge({"call_1": [make_clip("b", 7.5, 9)], "call_2": [make_clip("c", 0, 5)]})
+    serializer = JsonPlusSerializer()
+
+    restored = serializer.loads_typed(serializer.dumps_typed({"clips_from_search": registry}))["clips_from_search"]
+
+    assert isinstance(restored, ClipRegistry)
+    assert all(isinstance(chunk, ClipTable) for chunk in restored.model_dump()["chunks"])
+    assert {key: spans(clips) for key, clips in restored.items()} == {key: spans(clips) for key, clips in registry.items()}
+    assert spans(restored.overlapping("b", 8, 8.5)) == [("b", 7.5, 9)]
@@ -0,0 +1,67 @@
+import copy
+import numpy as np
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+# testing clip_table.py
+from jockey.clip_table import ClipTable
+from jockey.stirrups.video_editing import combine_clips
+
+
+def test_clip_table_interns_strings_and_reads_like_a_list(make_clip):
+    metadata = [{"type": "visual", "confidence": "high"}]
+    clips = [make_clip("a", 0, metadata=metadata), make_clip("a", 10, metadata=metadata), make_clip("b", 0, metadata=metadata, index_id="season_2")]
+    table = ClipTable.from_clips(clips)
+
+    # a, its title and URL, b, its title and URL, the confidence and the index ID
+    assert len(table.strings) == 8
+    assert len(table) == 3
+    assert list(table) == clips
+    assert table[-1] == clips[-1]
+    assert isinstance(table[1:], ClipTable) and table[1:].column("video_id") == ["a", "b"]
+    assert table.column("index_id") == [None, None, "season_2"]
+    assert table.to_records(exclude=("video_url", "thumbnail_url"))[0] == {
+        "score": 80.0,
+        "start": 0.0,
+        "end": 5.0,
+        "metadata": [{"type": "visual", "confidence": "high"}],
+        "video_id": "a",
+        "index_id": None,
+        "confidence": "high",
+        "video_title": "a.mp4",
+    }
+    # tables never change, so copies are the table itself
+    assert copy.deepcopy(table) is table
+
+
+def test_concat_merges_string_pools_and_dedupe_keeps_first_clips(make_clip):
+    first = ClipTable.from_clips([make_clip("a", 0), make_clip("b", 0)])
+    second = ClipTable.from_clips([make_clip("c", 0), make_clip("b", 0, score=10), make_clip("a", 10)])
+
+    table = ClipTable.concat([first, ClipTable(), second])
+
+    assert table.column("video_id") == ["a", "b", "c", "b", "a"]
+    assert len(table.strings) == len(set(table.strings))
+    deduped = table.dedupe()
+    assert [(clip.video_id, clip.start, clip.score) for clip in deduped] == [("a", 0, 80), ("b", 0, 80), ("c", 0, 80), ("a", 10, 80)]
+
+
+def test_clip_table_survives_the_checkpoint_serializer(make_clip):
+    table = ClipTable.from_clips([make_clip("a", 0), make_clip("b", 7.5, index_id="season_2")])
+    serializer = JsonPlusSerializer()
+
+    restored = serializer.loads_typed(serializer.dumps_typed({"call_1": table}))["call_1"]
+
+    assert isinstance(restored, ClipTable)
+    assert list(restored) == list(table)
+    np.testing.assert_array_equal(restored.starts, table.starts)
+
+
+def test_combine_clips_input_keeps_the_table(make_clip):
+    table = ClipTable.from_clips([make_clip("a", 0), make_clip("b", 10)])
+
+    parsed = combine_clips._parse_input({"clips": table, "output_filename": "combined.mp4", "index_id": "index1"}, None)
+
+    assert parsed["clips"] is table
+    # plain clip dicts are still validated into clips
+    parsed = combine_clips._parse_input({"clips": table.to_records(), "output_filename": "combined.mp4", "index_id": "index1"}, None)
+    assert [clip.video_id for clip in parsed["clips"]] == ["a", "b"]
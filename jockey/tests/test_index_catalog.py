@@ -0,0 +1,96 @@
+import pytest
+from unittest.mock import patch
+
+# testing index_catalog.py
+from jockey import index_catalog
+from jockey.index_catalog import IndexCatalog, lookup_videos
+
+
+def make_video(video_id, updated_at):
+    return {
+        "_id": video_id,
+        "updated_at": updated_at,
+        "system_metadata": {"filename": f"{video_id}.mp4", "duration": 60.0},
+        "hls": {"video_url": f"https://hls/{video_id}.m3u8", "thumbnail_urls": [f"https://hls/{video_id}.jpg"]},
+    }
+
+
+class FakeIndex:
+    """list videos API over a list of videos, sorted by updated_at like the real one"""
+
+    def __init__(self, videos, page_limit=2):
+        self.videos = videos
+        self.page_limit = page_limit
+        self.pages_read = []
+
+    def list_videos_page(self, index_id, page):
+        self.pages_read.append(page)
+        videos = sorted(self.videos, key=lambda video: video["updated_at"], reverse=True)
+        total_pages = max(1, -(-len(videos) // self.page_limit))
+        return {"data": videos[(page - 1) * self.page_limit : page * self.page_limit], "page_info": {"page": page, "total_page": total_pages}}
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return IndexCatalog(str(tmp_path / ".jockey" / "index_catalog.sqlite"), refresh_seconds=0, full_refresh_seconds=3600)
+
+
+@pytest.mark.asyncio
+async def test_catalog_loads_and_refreshes_incrementally(catalog):
+    fake_index = FakeIndex([make_video(f"v{number}", f"2024-01-0{number}T00:00:00Z") for number in range(1, 6)])
+
+    with patch.object(index_catalog, "list_videos_page", side_effect=fake_index.list_videos_page):
+        assert await catalog.refresh("index") == 5
+        assert sorted(fake_index.pages_read) == [1, 2, 3]
+
+        # only the page with the new video is read
+        fake_index.pages_read.clear()
+        fake_index.videos.append(make_video("v6", "2024-01-06T00:00:00Z"))
+        await catalog.refresh("index")
+        assert fake_index.pages_read == [1]
+
+        # a full refresh drops deleted videos
+        fake_index.videos = [video for video in fake_index.videos if video["_id"] != "v1"]
+        await catalog.refresh("index", full=True)
+
+    assert [catalog_video.video_id for catalog_video in catalog.list_videos("index")] == ["v6", "v5", "v4", "v3", "v2"]
+    assert catalog.get_many("index", ["v6"])["v6"].video_url == "https://hls/v6.m3u8"
+    assert catalog.state("index").high_water == "2024-01-06T00:00:00Z"
+
+
+@pytest.mark.asyncio
+async def test_lookup_videos_reads_from_catalog(catalog):
+    fake_index = FakeIndex([make_video("v1", "2024-01-01T00:00:00Z"), make_video("v2", "2024-01-02T00:00:00Z")])
+
+    with patch.object(index_catalog, "INDEX_CATALOG_ENABLED", True), patch.object(
+        index_catalog, "get_index_catalog", return_value=catalog
+    ), patch.object(index_catalog, "list_videos_page", side_effect=fake_index.list_videos_page), patch.object(
+        index_catalog, "get_video_metadata"
+    ) as mock_metadata:
+        catalog_videos, errors = await lookup_videos("index", ["v1", "v2", "v1"])
+
+    assert {video_id: catalog_video.filename for video_id, catalog_video in catalog_videos.items()} == {"v1": "v1.mp4", "v2": "v2.mp4"}
+    assert errors == {}
+    mock_metadata.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_lookup_refreshes_for_missing_videos_at_most_once_per_interval(tmp_path):
+    catalog = IndexCatalog(str(tmp_path / "index_catalog.sqlite"), refresh_seconds=3600, full_refresh_seconds=3600, miss_refresh_seconds=0)
+    fake_index = FakeIndex([make_video("v1", "2024-01-01T00:00:00Z")])
+
+    with patch.object(index_catalog, "list_videos_page", side_effect=fake_index.list_videos_page):
+        await catalog.refresh("index")
+
+        # a video added since the last refresh is found by refreshing on the miss
+        fake_index.videos.append(make_video("v2", "2024-01-02T00:00:00Z"))
+        fake_index.pages_read.clear()
+        assert list(await catalog.lookup("index", ["v1", "v2"])) == ["v1", "v2"]
+        assert fake_index.pages_read == [1]
+
+        # an unknown video doesn't refresh the index again within the interval
+        catalog.miss_refresh_seconds = 3600
+        fake_index.pages_read.clear()
+        for _ in range(3):
+            assert list(await catalog.lookup("index", ["v1", "unknown"])) == ["v1"]
+        assert fake_index.pages_read == []
@@ -1,3 +1,7 @@
+# testing jockey_graph.py
+from jockey.jockey_graph import add_clips
+
+
 # import pytest
 # from unittest.mock import patch, MagicMock, AsyncMock
 # from langchain_core.messages import HumanMessage
@@ -112,3 +116,13 @@
 # #     assert result["chat_history"].name == "unexpected_worker_error"
 # #     assert "An unexpected error occurred" in result["chat_history"].content
 # #     assert "The task may need to be reformulated" in result["chat_history"].content
+
+
+def test_add_clips_dedupes_by_video_and_timestamps(make_clip):
+    left = {"call_1": [make_clip("a", 0, 10)]}
+    right = {"call_1": [make_clip("a", 0, 10), make_clip("b", 0, 10), make_clip("b", 0, 10)], "call_2": [make_clip("c", 5, 15)]}
+
+    merged = add_clips(left, right)
+
+    assert [(clip.video_id, clip.start, clip.end) for clip in merged["call_1"]] == [("a", 0, 10), ("b", 0, 10)]
+    assert [clip.video_id for clip in merged["call_2"]] == ["c"]
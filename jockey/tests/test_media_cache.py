@@ -0,0 +1,147 @@
+import os
+import time
+import asyncio
+import pytest
+from unittest.mock import patch
+
+# testing media_cache.py
+from jockey.media_cache import MediaCache
+
+
+async def fake_validate(self, path):
+    """treat any non-empty file as valid media, ffprobe isn't needed for these tests"""
+    return os.path.isfile(path) and os.path.getsize(path) > 0
+
+
+@pytest.fixture
+def media_cache(tmp_path):
+    with patch.object(MediaCache, "validate", fake_validate), patch("jockey.media_cache.MEDIA_CACHE_EVICTION_GRACE_SECONDS", 0):
+        yield MediaCache(str(tmp_path), max_bytes=10)
+
+
+@pytest.mark.asyncio
+async def test_get_or_create_creates_once(media_cache):
+    calls = []
+
+    async def create(path):
+        calls.append(path)
+        await asyncio.sleep(0.05)
+        with open(path, "wb") as f:
+            f.write(b"12345")
+
+    paths = await asyncio.gather(*[media_cache.get_or_create("index1/clip.mp4", create) for _ in range(3)])
+
+    assert len(calls) == 1
+    assert set(paths) == {os.path.join(media_cache.root, "index1/clip.mp4")}
+    assert [entry.key for entry in media_cache.entries()] == ["index1/clip.mp4"]
+
+
+@pytest.mark.asyncio
+async def test_partial_file_is_never_a_cache_hit(media_cache):
+    async def crash(path):
+        with open(path, "wb") as f:
+            f.write(b"half")
+        raise RuntimeError("ffmpeg crashed")
+
+    with pytest.raises(RuntimeError):
+        await media_cache.get_or_create("index1/clip.mp4", crash)
+
+    assert os.listdir(os.path.join(media_cache.root, "index1")) == []
+    assert await media_cache.lookup("index1/clip.mp4") is None
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_under_byte_cap(media_cache):
+    for name in ["a.mp4", "b.mp4"]:
+        async with media_cache.write(name) as path:
+            with open(path, "wb") as f:
+                f.write(b"1234")
+        time.sleep(0.01)
+
+    # using `a` makes `b` the least recently used entry
+    await media_cache.lookup("a.mp4")
+    async with media_cache.write("c.mp4") as path:
+        with open(path, "wb") as f:
+            f.write(b"1234")
+
+    assert sorted(entry.key for entry in media_cache.entries()) == ["a.mp4", "c.mp4"]
+    assert not os.path.exists(os.path.join(media_cache.root, "b.mp4"))
+
+
+@pytest.mark.asyncio
+async def test_link_gives_unique_names_to_a_shared_render(media_cache):
+    async def render(path):
+        with open(path, "wb") as f:
+            f.write(b"123")
+
+    await media_cache.get_or_create("index1/renders/abc.mp4", render)
+    first = media_cache.link("index1/renders/abc.mp4", "index1/first.mp4")
+    second = media_cache.link("index1/renders/abc.mp4", "index1/second.mp4")
+
+    assert first != second
+    assert os.path.samefile(first, os.path.join(media_cache.root, "index1/renders/abc.mp4"))
+    assert open(second, "rb").read() == b"123"
+
+
+@pytest.mark.asyncio
+async def test_kept_partial_is_removed_after_the_grace_period_and_with_its_entry(media_cache):
+    with patch("jockey.media_cache.MEDIA_CACHE_EVICTION_GRACE_SECONDS", 60):
+        async with media_cache.write("index1/renders/long.mp4", keep_partial=True) as partial_path:
+            with open(partial_path, "wb") as f:
+                f.write(b"12345678901")
+
+        # the render is over the byte cap but was just written, so it and its streaming name are kept
+        assert os.path.samefile(partial_path, os.path.join(media_cache.root, "index1/renders/long.mp4"))
+
+        with patch("jockey.media_cache.time.time", return_value=time.time() + 120):
+            assert media_cache.evict() == ["index1/renders/long.mp4"]
+
+    assert os.listdir(os.path.join(media_cache.root, "index1/renders")) == []
+
+
+@pytest.mark.asyncio
+async def test_lock_is_shared_between_caches_and_taken_over_once_stale(tmp_path):
+    # two caches on one root stand in for two hosts mounting the same volume
+    first_host, second_host = MediaCache(str(tmp_path)), MediaCache(str(tmp_path), lock_lease_seconds=0.2)
+    events = []
+
+    async def hold(media_cache, name):
+        async with media_cache.lock("index1/clip.mp4"):
+            events.append(f"{name} locked")
+            await asyncio.sleep(0.05)
+            events.append(f"{name} unlocked")
+
+    await asyncio.gather(hold(first_host, "first"), hold(second_host, "second"))
+    assert events in (
+        ["first locked", "first unlocked", "second locked", "second unlocked"],
+        ["second locked", "second unlocked", "first locked", "first unlocked"],
+    )
+    assert not second_host._is_locked("index1/clip.mp4")
+
+    # a lock file left behind by a crashed host is taken over once it wasn't renewed for the lease
+    lock_path = second_host._lock_path("index1/clip.mp4")
+    with open(lock_path, "w") as lock_file:
+        lock_file.write("crashed")
+    assert second_host._is_locked("index1/clip.mp4")
+    await asyncio.sleep(0.25)
+    async with asyncio.timeout(1):
+        async with second_host.lock("index1/clip.mp4"):
+            assert second_host._is_locked("index1/clip.mp4")
+    assert not os.path.exists(lock_path)
+
+
+@pytest.mark.asyncio
+async def test_only_fragmented_mp4_may_leave_out_the_duration(tmp_path):
+    def box(box_type, payload=b""):
+        return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+    fragmented_path = tmp_path / "fragmented.mp4"
+    fragmented_path.write_bytes(box(b"ftyp", b"isom") + box(b"moov") + box(b"moof") + box(b"mdat", b"x" * 16))
+    truncated_path = tmp_path / "truncated.mkv"
+    truncated_path.write_bytes(b"\x1a\x45\xdf\xa3" + b"x" * 32)
+    probe = {"format": {}, "streams": [{"codec_type": "video"}]}
+
+    with patch("jockey.media_cache.ffmpeg.probe", return_value=probe):
+        media_cache = MediaCache(str(tmp_path / "cache"))
+        assert await media_cache.validate(str(fragmented_path))
+        assert not await media_cache.validate(str(truncated_path))
@@ -0,0 +1,101 @@
+import os
+import asyncio
+import pytest
+from unittest.mock import patch
+
+# testing prefetch.py
+from jockey.prefetch import Prefetcher
+from jockey.media_cache import MediaCache
+from jockey.video_utils import ffmpeg_niceness
+
+
+@pytest.fixture
+def media_cache(tmp_path):
+    async def fake_validate(self, path):
+        return os.path.isfile(path) and os.path.getsize(path) > 0
+
+    with patch.object(MediaCache, "validate", fake_validate):
+        media_cache = MediaCache(str(tmp_path))
+        with patch("jockey.prefetch.get_media_cache", return_value=media_cache):
+            yield media_cache
+
+
+def fake_fetch(media_cache, delay=0.0, niceness=None):
+    async def fetch(video_id, index_id, start, end):
+        if niceness is not None:
+            niceness.append(ffmpeg_niceness.get())
+        await asyncio.sleep(delay)
+        path = media_cache.path_for(os.path.join(index_id, f"{video_id}_{start}_{end}.mp4"))
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+        return path
+
+    return fetch
+
+
+@pytest.mark.asyncio
+async def test_prefetch_top_clips_and_report_hit_rate(media_cache, make_clip):
+    niceness = []
+    prefetcher = Prefetcher(fetch=fake_fetch(media_cache, niceness=niceness), top_n=2, niceness=7)
+    clips = [make_clip("a", 0, 5, 0.5), make_clip("b", 0, 5, 0.9), make_clip("c", 0, 5, 0.7)]
+
+    scheduled = prefetcher.schedule("thread", "index", clips)
+    assert [video_id for _, video_id, _, _ in scheduled] == ["b", "c"]
+    await asyncio.gather(*prefetcher._tasks["thread"].values())
+    assert niceness == [7, 7]
+    assert ffmpeg_niceness.get() == 0
+
+    # the edit uses one prefetched clip and one that wasn't prefetched
+    prefetcher.record_use("thread", "index", [clips[1], clips[0]], None)
+
+    assert prefetcher.stats.hits == 1
+    assert prefetcher.stats.misses == 1
+    assert prefetcher.stats.hit_rate == 0.5
+    assert prefetcher.stats.bytes_fetched == 200
+    assert prefetcher.stats.bytes_wasted == 100
+    assert "50%" in prefetcher.report()
+    assert prefetcher.stats.model_dump()["hit_rate"] == 0.5 and prefetcher.stats.model_dump()["bytes_wasted"] == 100
+
+
+@pytest.mark.asyncio
+async def test_cancel_stops_pending_prefetches(media_cache, make_clip):
+    prefetcher = Prefetcher(fetch=fake_fetch(media_cache, delay=10), concurrency=1)
+    prefetcher.schedule("thread", "index", [make_clip("a", 0, 5, 0.5), make_clip("b", 0, 5, 0.9)])
+    tasks = list(prefetcher._tasks["thread"].values())
+    await asyncio.sleep(0.01)
+
+    assert prefetcher.cancel("thread") == 2
+    await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(task.cancelled() for task in tasks)
+    assert prefetcher.stats.cancelled == 2
+    assert prefetcher.stats.completed == 0
+
+
+@pytest.mark.asyncio
+async def test_clip_in_flight_counts_as_late_hit(media_cache, make_clip):
+    prefetcher = Prefetcher(fetch=fake_fetch(media_cache, delay=0.05))
+    clip = make_clip("a", 0, 5, 0.5)
+    prefetcher.schedule("thread", "index", [clip])
+
+    prefetcher.record_use("thread", "index", [clip], None)
+    await asyncio.gather(*prefetcher._tasks["thread"].values())
+
+    assert prefetcher.stats.late_hits == 1
+    assert prefetcher.stats.bytes_wasted == 0
+
+
+@pytest.mark.asyncio
+async def test_merged_clips_are_prefetched_and_counted_as_spans(media_cache, make_clip):
+    prefetcher = Prefetcher(fetch=fake_fetch(media_cache), merge_gap=2)
+    clips = [make_clip("a", 0, 5, 0.9), make_clip("a", 6, 10, 0.5)]
+
+    assert prefetcher.schedule("thread", "index", clips) == [("index", "a", 0, 10)]
+    await asyncio.gather(*prefetcher._tasks["thread"].values())
+
+    # an edit of both clips cuts the prefetched span, an edit of one of them or one that doesn't merge cuts other spans
+    prefetcher.record_use("thread", "index", clips, 2)
+    prefetcher.record_use("thread", "index", clips[:1], 2)
+    prefetcher.record_use("thread", "index", clips, None)
+
+    assert prefetcher.stats.hits == 1
+    assert prefetcher.stats.misses == 3
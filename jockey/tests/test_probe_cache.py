@@ -0,0 +1,73 @@
+import os
+import stat
+import pytest
+
+# testing probe_cache.py
+from jockey.probe_cache import ProbeCache, parse_keyframes
+
+FAKE_FFPROBE = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls.log"
+case "$*" in
+  *show_streams*)
+    printf '{"format": {"format_name": "mov,mp4", "duration": "4.0"}, "streams": ['
+    printf '{"codec_type": "video", "codec_name": "h264", "width": 1280, "height": 720, "time_base": "1/15360", "avg_frame_rate": "30/1"},'
+    printf '{"codec_type": "audio", "codec_name": "aac"}]}'
+    ;;
+  *)
+    printf '0.000000,K__\\n1.000000,___\\n2.000000,K__\\nN/A,K__\\n'
+    ;;
+esac
+"""
+
+
+@pytest.fixture
+def fake_ffprobe(tmp_path, monkeypatch):
+    """put an ffprobe on the PATH that logs its calls and prints canned output"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    path = bin_dir / "ffprobe"
+    path.write_text(FAKE_FFPROBE)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return bin_dir / "calls.log"
+
+
+def test_parse_keyframes():
+    assert parse_keyframes("2.5,K__\n0.0,K_\n1.0,__\n") == [0.0, 2.5]
+
+
+@pytest.mark.asyncio
+async def test_probe_is_cached_until_file_changes(tmp_path, fake_ffprobe):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"video")
+    probe_cache = ProbeCache(str(tmp_path / ".jockey" / "probe_cache.sqlite"))
+
+    media_probe = await probe_cache.probe(str(video_path))
+    assert media_probe.video_codec == "h264"
+    assert media_probe.audio_codec == "aac"
+    assert (media_probe.width, media_probe.height) == (1280, 720)
+    assert media_probe.time_base == "1/15360"
+    assert media_probe.duration == 4.0
+    assert media_probe.keyframes == [0.0, 2.0]
+
+    # a second cache instance reads the persisted probe without running ffprobe
+    assert await ProbeCache(probe_cache.path).probe(str(video_path)) == media_probe
+    assert len(fake_ffprobe.read_text().splitlines()) == 2
+
+    video_path.write_bytes(b"a different video")
+    await probe_cache.probe(str(video_path))
+    assert len(fake_ffprobe.read_text().splitlines()) == 4
+
+
+@pytest.mark.asyncio
+async def test_probe_many_keeps_order(tmp_path, fake_ffprobe):
+    paths = []
+    for name in ["c", "a", "b"]:
+        path = tmp_path / f"{name}.mp4"
+        path.write_bytes(name.encode())
+        paths.append(str(path))
+    probe_cache = ProbeCache(str(tmp_path / "probe_cache.sqlite"))
+
+    media_probes = await probe_cache.probe_many(paths, concurrency=2)
+
+    assert [media_probe.path for media_probe in media_probes] == paths
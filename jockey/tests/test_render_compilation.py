@@ -0,0 +1,26 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+
+# testing stirrups/video_editing.py
+from jockey.stirrups.video_editing import render_compilation
+from jockey.stirrups.errors import JockeyError, WorkerFunction
+from jockey.media_cache import get_media_cache
+
+
+@pytest.mark.asyncio
+async def test_render_fails_when_a_span_fails_to_download(tmp_path, monkeypatch, make_clip):
+    monkeypatch.setenv("HOST_PUBLIC_DIR", str(tmp_path))
+    clips = [make_clip("a", 0, 5), make_clip("b", 0, 5)]
+    download_error = {"message": "There was an error downloading the video with Video ID: b.", "error": "404"}
+
+    with patch("jockey.stirrups.video_editing.download_video", AsyncMock(side_effect=[str(tmp_path / "a.mp4"), download_error])), patch(
+        "jockey.stirrups.video_editing.run_ffmpeg", AsyncMock()
+    ) as mock_run_ffmpeg:
+        with pytest.raises(JockeyError) as exc_info:
+            await render_compilation(clips, output_filename="combined.mp4", index_id="index1", merge_gap=None)
+
+    assert exc_info.value.error_data.function_name == WorkerFunction.COMBINE_CLIPS
+    assert "Video ID: b" in str(exc_info.value)
+    # nothing was rendered or cached under the fingerprint of the full clip list
+    mock_run_ffmpeg.assert_not_called()
+    assert get_media_cache().entries() == []
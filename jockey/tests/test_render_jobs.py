@@ -0,0 +1,131 @@
+import asyncio
+import pytest
+
+# testing render_jobs.py
+from jockey.render_jobs import RenderJobPoster, RenderJobStatus, RenderJobStore, RenderWorkerPool
+
+
+@pytest.fixture
+def store(tmp_path):
+    return RenderJobStore(str(tmp_path / "render_jobs.sqlite"))
+
+
+def test_claim_prefers_higher_priority_then_submission_order(store):
+    archival = store.submit({"output_filename": "archival.mp4"}, priority=-10)
+    first_draft = store.submit({"output_filename": "first.mp4"}, priority=10)
+    second_draft = store.submit({"output_filename": "second.mp4"}, priority=10)
+
+    claimed = [store.claim().job_id for _ in range(3)]
+
+    assert claimed == [first_draft.job_id, second_draft.job_id, archival.job_id]
+    assert store.claim() is None
+    assert store.get(archival.job_id).status == RenderJobStatus.RUNNING
+
+
+@pytest.mark.asyncio
+async def test_run_job_records_progress_and_outcome(store):
+    async def runner(render_job, on_progress):
+        await on_progress({"percent": 50.0})
+        assert store.get(render_job.job_id).progress == 50.0
+        if render_job.request["output_filename"] == "broken.mp4":
+            raise ValueError("ffmpeg exited with 1")
+        return f"/tmp/{render_job.request['output_filename']}"
+
+    finished = []
+
+    async def on_done(render_job):
+        finished.append(render_job)
+
+    pool = RenderWorkerPool(store, runner)
+    pool.add_done_callback(on_done)
+
+    store.submit({"output_filename": "ok.mp4"}, thread_id="thread")
+    store.submit({"output_filename": "broken.mp4"}, thread_id="thread")
+    succeeded = await pool.run_job(store.claim())
+    failed = await pool.run_job(store.claim())
+
+    assert succeeded.status == RenderJobStatus.SUCCEEDED
+    assert succeeded.output_filepath == "/tmp/ok.mp4"
+    assert failed.status == RenderJobStatus.FAILED
+    assert "ffmpeg exited with 1" in failed.error
+    assert [render_job.job_id for render_job in finished] == [succeeded.job_id, failed.job_id]
+    assert len(store.list_jobs(thread_id="thread")) == 2
+
+
+def test_abandoned_jobs_are_requeued_until_max_attempts(tmp_path):
+    store = RenderJobStore(str(tmp_path / "render_jobs.sqlite"), max_attempts=2)
+    render_job = store.submit({"output_filename": "abandoned.mp4"})
+
+    # the first worker dies without renewing its lease, so the job is leased to the next worker
+    assert store.claim("worker-1", lease_seconds=-1).attempts == 1
+    reclaimed = store.claim("worker-2", lease_seconds=-1)
+    assert reclaimed.job_id == render_job.job_id
+    assert reclaimed.worker_id == "worker-2"
+    assert reclaimed.attempts == 2
+
+    # a worker that lost its lease can't record an outcome anymore
+    assert not store.heartbeat(render_job.job_id, "worker-1")
+    assert not store.complete(render_job.job_id, "/tmp/abandoned.mp4", "worker-1")
+
+    # after max_attempts claims the job is failed instead of re-queued
+    assert store.claim("worker-3") is None
+    assert store.get(render_job.job_id).status == RenderJobStatus.FAILED
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_keeps_lease_alive_during_long_renders(store):
+    async def runner(render_job, on_progress):
+        await asyncio.sleep(0.3)
+        return "/tmp/long.mp4"
+
+    pool = RenderWorkerPool(store, runner, worker_id="worker-1", lease_seconds=0.1, heartbeat_interval=0.02)
+    store.submit({"output_filename": "long.mp4"})
+    render_job = store.claim(pool.worker_id, pool.lease_seconds)
+
+    async def claim_elsewhere():
+        # another worker polling the queue after the original lease ran out must not take the job over
+        await asyncio.sleep(0.2)
+        return store.claim("worker-2")
+
+    finished, claimed_elsewhere = await asyncio.gather(pool.run_job(render_job), claim_elsewhere())
+
+    assert claimed_elsewhere is None
+
+    assert finished.status == RenderJobStatus.SUCCEEDED
+    assert finished.worker_id == "worker-1"
+    assert finished.attempts == 1
+
+
+@pytest.mark.asyncio
+async def test_poster_posts_jobs_finished_by_any_worker_once(tmp_path):
+    store = RenderJobStore(str(tmp_path / "render_jobs.sqlite"))
+    # a second graph server sharing the job store
+    other_store = RenderJobStore(str(tmp_path / "render_jobs.sqlite"))
+    posted = []
+    broken = True
+
+    async def post(render_job):
+        if broken and render_job.request["output_filename"] == "retry.mp4":
+            raise ConnectionError("thread unavailable")
+        posted.append(render_job.job_id)
+
+    poster, other_poster = RenderJobPoster(store), RenderJobPoster(other_store)
+    poster.add_callback(post)
+    other_poster.add_callback(post)
+
+    # jobs finished by a standalone worker, and one without a thread to post to
+    finished = store.submit({"output_filename": "ok.mp4"}, thread_id="thread")
+    retried = store.submit({"output_filename": "retry.mp4"}, thread_id="thread")
+    store.submit({"output_filename": "no_thread.mp4"})
+    queued = store.submit({"output_filename": "queued.mp4"}, thread_id="thread")
+    for _ in range(3):
+        render_job = store.claim("worker-on-another-host")
+        store.complete(render_job.job_id, "/tmp/out.mp4", "worker-on-another-host")
+
+    assert await poster.post_finished() == [finished.job_id]
+    assert await other_poster.post_finished() == []
+    # a job whose post failed is posted again
+    broken = False
+    assert await other_poster.post_finished() == [retried.job_id]
+    assert posted == [finished.job_id, retried.job_id]
+    assert queued.job_id not in posted
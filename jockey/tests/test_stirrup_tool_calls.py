@@ -0,0 +1,76 @@
+import os
+import pytest
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+from langchain_core.messages import AIMessage
+from langchain.tools import BaseTool
+
+# testing stirrups/stirrup.py
+from jockey.stirrups.stirrup import Stirrup
+
+VIDEO_SEARCH_PROMPT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "prompts", "video_search.md"))
+
+
+@pytest.fixture
+def stirrup():
+    return Stirrup(tools=[], worker_prompt_file_path=VIDEO_SEARCH_PROMPT, worker_name="test_worker")
+
+
+def make_tool(name, side_effect):
+    tool = MagicMock(spec=BaseTool)
+    tool.name = name
+    tool.ainvoke = AsyncMock(side_effect=side_effect)
+    return tool
+
+
+@pytest.mark.asyncio
+async def test_toolcalls_run_concurrently_in_order(stirrup):
+    # Arrange
+    running = 0
+    max_running = 0
+
+    async def slow_tool(args):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        # the first call finishes last
+        await asyncio.sleep(0.05 if args["input"] == 0 else 0.01)
+        running -= 1
+        return f"output {args['input']}"
+
+    stirrup.tools = [make_tool("test_tool", slow_tool)]
+    stirrup.max_concurrent_tool_calls = 2
+    message = AIMessage(
+        content="Test message",
+        tool_calls=[{"name": "test_tool", "args": {"input": i}, "id": f"call_0{i}", "type": "function"} for i in range(4)],
+    )
+
+    # Act
+    tool_calls = await stirrup._call_tools(message)
+
+    # Assert
+    assert [tool_call["output"] for tool_call in tool_calls] == [f"output {i}" for i in range(4)]
+    assert max_running == 2
+    assert "output" not in message.tool_calls[0]
+
+
+@pytest.mark.asyncio
+async def test_toolcall_error_is_isolated(stirrup):
+    # Arrange
+    stirrup.tools = [make_tool("good_tool", ["good output"]), make_tool("bad_tool", ValueError("bad input"))]
+    message = AIMessage(
+        content="Test message",
+        tool_calls=[
+            {"name": "bad_tool", "args": {}, "id": "call_01", "type": "function"},
+            {"name": "good_tool", "args": {}, "id": "call_02", "type": "function"},
+        ],
+    )
+
+    # Act
+    tool_calls = await stirrup._call_tools(message)
+
+    # Assert
+    assert tool_calls[0]["error"] == "bad input"
+    assert "output" not in tool_calls[0]
+    assert tool_calls[1]["output"] == "good output"
+    assert "error" not in tool_calls[1]
@@ -0,0 +1,78 @@
+import os
+import pytest
+from unittest.mock import patch
+
+# testing thumbnails.py
+from jockey.thumbnails import attach_thumbnails, thumbnail_time
+from jockey.media_cache import MediaCache
+
+
+@pytest.fixture
+def ffmpeg_calls(tmp_path):
+    """fake ffmpeg that writes every jpg output, one still per time or a single sprite sheet"""
+    calls = []
+
+    async def fake_run_ffmpeg(stream_spec, label, duration=None, on_progress=None):
+        args = stream_spec.compile()
+        calls.append(args)
+        for output_path in [arg for arg in args if arg.endswith(".jpg")]:
+            with open(output_path, "wb") as f:
+                f.write(b"thumbnail")
+
+    async def fake_validate(self, path):
+        return os.path.isfile(path) and os.path.getsize(path) > 0
+
+    with (
+        patch.object(MediaCache, "validate", fake_validate),
+        patch("jockey.thumbnails.get_media_cache", return_value=MediaCache(str(tmp_path))),
+        patch("jockey.thumbnails.run_ffmpeg", fake_run_ffmpeg),
+    ):
+        yield calls
+
+
+def seeks(args):
+    return [args[position + 1] for position, arg in enumerate(args) if arg == "-ss"]
+
+
+def test_thumbnail_time_rounds_to_half_seconds():
+    assert [thumbnail_time(time) for time in [0.1, 0.3, 7.74, 12.0]] == [0.0, 0.5, 7.5, 12.0]
+
+
+@pytest.mark.asyncio
+async def test_stills_seek_to_each_time_in_one_call_and_are_cached(ffmpeg_calls, tmp_path, make_clip):
+    clips = [make_clip("a", 10), make_clip("b", 3), make_clip("a", 2), make_clip("b", 5, thumbnail_url="https://cdn/b.jpg")]
+
+    task = attach_thumbnails(clips, mode="still")
+    # the URLs are set right away, the stills are cut in the background
+    assert clips[0].thumbnail_url == "/public/thumbnails/a/10.0.jpg"
+    assert clips[2].thumbnail_url == "/public/thumbnails/a/2.0.jpg"
+    assert clips[3].thumbnail_url == "https://cdn/b.jpg"
+    await task
+
+    assert len(ffmpeg_calls) == 2
+    assert os.path.exists(tmp_path / "thumbnails" / "a" / "10.0.jpg")
+    # every still of `a` is read from its own seek instead of decoding from the first to the last one
+    a_args = next(args for args in ffmpeg_calls if "https://hls/a.m3u8" in args)
+    assert seeks(a_args) == ["2.0", "10.0"]
+
+    ffmpeg_calls.clear()
+    cached_clips = [make_clip("a", 10), make_clip("a", 2)]
+    await attach_thumbnails(cached_clips, mode="still")
+    assert ffmpeg_calls == []
+    assert [clip.thumbnail_url for clip in cached_clips] == [clips[0].thumbnail_url, clips[2].thumbnail_url]
+
+
+@pytest.mark.asyncio
+async def test_sprite_locates_each_thumbnail(ffmpeg_calls, tmp_path, make_clip):
+    clips = [make_clip("a", start) for start in [0, 4, 8, 12, 16, 20, 24]]
+
+    await attach_thumbnails(clips, mode="sprite")
+
+    assert len(ffmpeg_calls) == 1
+    assert seeks(ffmpeg_calls[0]) == ["0.0", "4.0", "8.0", "12.0", "16.0", "20.0", "24.0"]
+    assert "tile=5x2" in ffmpeg_calls[0][ffmpeg_calls[0].index("-filter_complex") + 1]
+    sprite_url = clips[0].thumbnail_url.split("#")[0]
+    assert sprite_url.startswith("/public/thumbnails/a/sprite_")
+    assert os.path.exists(tmp_path / sprite_url.removeprefix("/public/"))
+    assert clips[0].thumbnail_url.endswith("#xywh=0,0,320,180")
+    assert clips[6].thumbnail_url.endswith("#xywh=320,180,320,180")
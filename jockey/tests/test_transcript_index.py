@@ -0,0 +1,111 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, patch
+
+# testing transcript_index.py
+from jockey import transcript_index
+from jockey.transcript_index import TranscriptIndex, transcript_match_expression
+from jockey.stirrups import video_search
+
+TRANSCRIPTS = {
+    "a": [
+        {"start": 0, "end": 4, "value": "Welcome back to the show"},
+        {"start": 4, "end": 9, "value": "Tonight we talk about dunks and blocks"},
+    ],
+    "b": [
+        {"start": 0, "end": 6, "value": "Back to the show after the break, the best dunks of the season"},
+        {"start": 6, "end": 8, "value": ""},
+    ],
+    "silent": [],
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return TranscriptIndex(str(tmp_path / ".jockey" / "transcript_index.sqlite"))
+
+
+def test_transcript_match_expression():
+    assert transcript_match_expression("dunks, blocks") == '"dunks" AND "blocks"'
+    # stopwords are dropped from keyword queries but kept in phrases
+    assert transcript_match_expression("the dunks of the season") == '"dunks" AND "season"'
+    assert transcript_match_expression('"back to the show"') == '"back to the show"'
+    assert transcript_match_expression("?!") is None
+    assert transcript_match_expression("to the") is None
+
+
+@pytest.mark.asyncio
+async def test_transcript_index_is_updated_incrementally_and_searched(index):
+    with patch.object(transcript_index, "fetch_transcript", side_effect=lambda index_id, video_id: TRANSCRIPTS[video_id]) as mock_fetch:
+        await index.add_videos("index", ["a", "silent"])
+        await index.add_videos("index", ["a", "b", "silent"])
+
+    # videos are fetched once, even those without speech
+    assert [call.args[1] for call in mock_fetch.call_args_list] == ["a", "silent", "b"]
+    assert index.indexed_videos("index", ["a", "b", "silent", "unseen"]) == {"a", "b", "silent"}
+
+    results = index.search("dunks", ["index"], top_n=5)
+    assert sorted((result["video_id"], result["start"], result["end"]) for result in results) == [("a", 4, 9), ("b", 0, 6)]
+    assert results[0]["confidence"] == "high"
+    # every word has to match
+    assert [(result["video_id"], result["start"]) for result in index.search("dunks and blocks", ["index"], top_n=5)] == [("a", 4)]
+
+    phrase_results = index.search('"welcome back to the show"', ["index"], top_n=5)
+    assert [(result["video_id"], result["start"]) for result in phrase_results] == [("a", 0)]
+    assert phrase_results[0]["metadata"] == [{"type": "conversation", "text": "Welcome back to the show"}]
+
+    assert [result["video_id"] for result in index.search("dunks", ["index"], top_n=5, video_filter=["b"])] == ["b"]
+    assert index.search("dunks", ["other_index"], top_n=5) == []
+
+
+@pytest.mark.asyncio
+async def test_conversation_search_is_answered_locally(index):
+    async def fake_hydrate(results, index_id, *args):
+        for result in results:
+            result["video_title"] = f"{result['video_id']}.mp4"
+
+    with (
+        patch.object(video_search, "TRANSCRIPT_SEARCH", "local"),
+        patch.object(video_search, "TRANSCRIPT_MIN_SCORE", 0.5),
+        patch.object(video_search, "get_transcript_index", return_value=index),
+        patch.object(transcript_index, "fetch_transcript", side_effect=lambda index_id, video_id: TRANSCRIPTS[video_id]),
+        patch.object(video_search, "_hydrate_results", side_effect=fake_hydrate),
+        patch.object(
+            video_search, "_search_indexes", new_callable=AsyncMock, return_value=[{"video_id": "c", "start": 10, "end": 15, "score": 70}]
+        ) as mock_search,
+    ):
+        # every filtered video is indexed on the spot, so the API isn't needed
+        output = json.loads(await video_search._base_video_search('"welcome back to the show"', "index", 3, "clip", ["conversation"], ["a", "b"]))
+        assert [result["video_id"] for result in output] == ["a"]
+        mock_search.assert_not_called()
+
+        # matches of a word found in every segment score under the floor, so the API is searched too
+        output = json.loads(await video_search._base_video_search("the show", "index", 3, "clip", ["conversation"], ["a", "b"]))
+        assert sorted(result["video_id"] for result in output) == ["a", "b", "c"]
+        assert mock_search.call_count == 1
+
+        # without a filter, fewer than top_n local matches are merged with the API's results
+        output = json.loads(await video_search._base_video_search("blocks", "index", 3, "clip", ["conversation"]))
+        assert sorted(result["video_id"] for result in output) == ["a", "c"]
+        assert mock_search.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_filtered_videos_are_indexed_from_their_own_index(index):
+    catalog = AsyncMock()
+    catalog.lookup.side_effect = lambda index_id, video_ids: {"i1": {"a": object()}, "i2": {"b": object()}}[index_id]
+
+    with (
+        patch.object(video_search, "TRANSCRIPT_SEARCH", "local"),
+        patch.object(video_search, "TRANSCRIPT_MIN_SCORE", 0),
+        patch.object(video_search, "INDEX_CATALOG_ENABLED", True),
+        patch.object(video_search, "get_index_catalog", return_value=catalog),
+        patch.object(video_search, "get_transcript_index", return_value=index),
+        patch.object(transcript_index, "fetch_transcript", side_effect=lambda index_id, video_id: TRANSCRIPTS[video_id]) as mock_fetch,
+        patch.object(video_search, "_search_indexes", new_callable=AsyncMock) as mock_search,
+    ):
+        results = await video_search._transcript_search("dunks", ["i1", "i2"], 3, ["a", "b"])
+
+    assert sorted(call.args for call in mock_fetch.call_args_list) == [("i1", "a"), ("i2", "b")]
+    assert sorted((result["index_id"], result["video_id"]) for result in results) == [("i1", "a"), ("i2", "b")]
+    mock_search.assert_not_called()
@@ -0,0 +1,140 @@
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+
+# testing video_search.py
+from jockey import index_catalog
+from jockey.stirrups import video_search
+from jockey.stirrups.video_search import batch_video_search, merge_search_results
+
+
+def make_result(video_id, start, score):
+    return {"video_id": video_id, "start": start, "end": start + 5, "score": score}
+
+
+def fake_video_metadata(video_id, index_id):
+    response = MagicMock()
+    response.json.return_value = {"hls": {"video_url": f"https://hls/{video_id}.m3u8"}, "metadata": {"filename": f"{video_id}.mp4"}}
+    return response
+
+
+def test_merge_search_results_dedupes_and_reranks():
+    results, groups = merge_search_results([
+        ("dunks", [make_result("a", 0, 90), make_result("b", 10, 80)]),
+        ("blocks", [make_result("c", 20, 95), make_result("b", 10, 85)]),
+    ])
+
+    # b is found by both queries, so it ranks above the top result of each query
+    assert [(result["video_id"], result["rank"]) for result in results] == [("b", 1), ("c", 2), ("a", 3)]
+    assert results[0]["queries"] == ["dunks", "blocks"]
+    assert results[0]["score"] == 85
+    assert groups == {"dunks": [3, 1], "blocks": [2, 1]}
+
+
+@pytest.mark.asyncio
+async def test_batch_video_search_hydrates_each_video_once():
+    query_responses = {
+        "dunks": [make_result("a", 0, 90), make_result("b", 10, 80)],
+        "blocks": [make_result("a", 30, 70)],
+        "logos": {"message": "There was an API error when searching the index.", "response": "rate limited"},
+    }
+
+    async def fake_search_request(query, *args):
+        return query_responses[query]
+
+    with patch.object(video_search, "_search_request", side_effect=fake_search_request), patch.object(
+        index_catalog, "get_video_metadata", side_effect=fake_video_metadata
+    ) as mock_metadata:
+        output = json.loads(
+            await batch_video_search.ainvoke({
+                "queries": [{"query": query, "search_options": ["visual"]} for query in query_responses],
+                "index_id": "index",
+                "top_n": 2,
+                "video_filter": None,
+                "index_ids": None,
+            })
+        )
+
+    assert sorted(call.kwargs["video_id"] for call in mock_metadata.call_args_list) == ["a", "b"]
+    assert [result["video_title"] for result in output["results"]] == ["a.mp4", "a.mp4", "b.mp4"]
+    assert set(output["groups"]) == {"dunks", "blocks"}
+    assert output["errors"] == {"logos": "rate limited"}
+
+
+@pytest.mark.asyncio
+async def test_search_fans_out_to_every_index():
+    index_responses = {
+        "season_1": [make_result("a", 0, 70), make_result("b", 0, 60)],
+        "season_2": [make_result("c", 0, 90), make_result("d", 0, 50)],
+        "season_3": {"message": "There was an API error when searching the index.", "response": "index not found"},
+    }
+
+    async def fake_search_request(query, index_id, *args):
+        return index_responses[index_id]
+
+    with patch.object(video_search, "_search_request", side_effect=fake_search_request), patch.object(
+        index_catalog, "get_video_metadata", side_effect=fake_video_metadata
+    ) as mock_metadata:
+        output = json.loads(
+            await video_search.simple_video_search.ainvoke({
+                "query": "dunks",
+                "index_id": "season_1",
+                "index_ids": ["season_1", "season_2", "season_3"],
+                "top_n": 3,
+                "group_by": "clip",
+                "search_options": ["visual"],
+                "video_filter": None,
+            })
+        )
+
+    assert [(result["video_id"], result["index_id"]) for result in output] == [("c", "season_2"), ("a", "season_1"), ("b", "season_1")]
+    assert {(call.kwargs["index_id"], call.kwargs["video_id"]) for call in mock_metadata.call_args_list} == {
+        ("season_2", "c"),
+        ("season_1", "a"),
+        ("season_1", "b"),
+    }
+
+
+def make_page(results, next_page_token=None):
+    response = MagicMock(status_code=200)
+    response.json.return_value = {"data": results, "page_info": {"next_page_token": next_page_token}}
+    return response
+
+
+@pytest.mark.asyncio
+async def test_stream_video_search_follows_page_tokens(monkeypatch):
+    monkeypatch.setenv("TWELVE_LABS_API_KEY", "test")
+    first_page = make_page([make_result("a", start, 90 - start) for start in range(0, 50)], next_page_token="token_2")
+    second_page = make_page([make_result("a", 50, 40), make_result("b", 0, 30), make_result("b", 10, 20)], next_page_token="token_3")
+
+    with patch.object(video_search.requests, "post", return_value=first_page) as mock_post, patch.object(
+        video_search.requests, "get", return_value=second_page
+    ) as mock_get, patch.object(index_catalog, "get_video_metadata", side_effect=fake_video_metadata) as mock_metadata:
+        pages = [page async for page in video_search.stream_video_search("dunks", "index", top_n=52)]
+
+    assert [len(page) for page in pages] == [50, 2]
+    assert mock_post.call_args.kwargs["json"]["page_limit"] == 50
+    # the search stops once top_n results were found, so the third page is never fetched
+    assert mock_get.call_count == 1
+    assert mock_get.call_args.args[0].endswith("/search/token_2")
+    # a is hydrated for the first page and reused for the second
+    assert [call.kwargs["video_id"] for call in mock_metadata.call_args_list] == ["a", "b"]
+    assert pages[1][1]["video_title"] == "b.mp4"
+
+
+@pytest.mark.asyncio
+async def test_stream_video_search_filters_before_hydrating(monkeypatch):
+    monkeypatch.setenv("TWELVE_LABS_API_KEY", "test")
+    first_page = make_page([make_result("a", start, 90 - start) for start in range(0, 50, 10)] + [make_result("b", 0, 30)], next_page_token="token_2")
+
+    with patch.object(video_search, "CLIP_MIN_SCORE", 50), patch.object(video_search, "CLIP_NMS_IOU_THRESHOLD", 0.5), patch.object(
+        video_search.requests, "post", return_value=first_page
+    ), patch.object(video_search.requests, "get") as mock_get, patch.object(
+        index_catalog, "get_video_metadata", side_effect=fake_video_metadata
+    ) as mock_metadata:
+        pages = [page async for page in video_search.stream_video_search("dunks", "index", top_n=100)]
+
+    assert [[result["start"] for result in page] for page in pages] == [[0, 10, 20, 30, 40]]
+    # every later result scores below the minimum, so the next page isn't fetched and b is never hydrated
+    mock_get.assert_not_called()
+    assert [call.kwargs["video_id"] for call in mock_metadata.call_args_list] == ["a"]
@@ -0,0 +1,108 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# testing video_text_generation.py
+from jockey.stirrups import video_text_generation
+from jockey.index_catalog import CatalogVideo
+from jockey.stirrups.video_editing import Clip
+from jockey.stirrups.video_text_generation import batch_text_generation, parse_timeline, summarize_text_generation, SUMMARIZE_URL
+from jockey.text_generation_cache import TextGenerationCache
+
+
+@pytest.fixture
+def text_generation_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("TWELVE_LABS_API_KEY", "test")
+    cache = TextGenerationCache(str(tmp_path / ".jockey" / "text_generation_cache.sqlite"))
+    with patch.object(video_text_generation, "get_text_generation_cache", return_value=cache):
+        yield cache
+
+
+def fake_post(url, json, headers):
+    response = MagicMock()
+    if json["video_id"] == "broken":
+        response.ok = False
+        response.json.return_value = {"code": "video_not_found", "message": "broken not found"}
+    else:
+        response.ok = True
+        response.json.return_value = {"id": f"result_{json['video_id']}", "summary": f"summary of {json['video_id']}"}
+    return response
+
+
+@pytest.mark.asyncio
+async def test_batch_text_generation_dedupes_and_isolates_errors(text_generation_cache):
+    with patch.object(video_text_generation.requests, "post", side_effect=fake_post) as mock_post:
+        output = json.loads(await batch_text_generation.ainvoke({"video_ids": ["a", "broken", "b", "a"], "index_id": "index", "task": "summary"}))
+
+    assert [result["video_id"] for result in output["results"]] == ["a", "broken", "b"]
+    assert output["results"][0]["output"]["summary"] == "summary of a"
+    assert output["results"][1]["error"] == "broken not found"
+    assert mock_post.call_count == 3
+    assert "combined" not in output
+
+
+@pytest.mark.asyncio
+async def test_batch_text_generation_uses_cache(text_generation_cache):
+    text_generation_cache.put(SUMMARIZE_URL, {"video_id": "a", "type": "summary"}, {"id": "cached", "summary": "cached summary of a"})
+
+    with patch.object(video_text_generation.requests, "post", side_effect=fake_post) as mock_post:
+        await batch_text_generation.ainvoke({"video_ids": ["a", "b", "broken"], "index_id": "index"})
+        output = json.loads(await batch_text_generation.ainvoke({"video_ids": ["a", "b", "broken"], "index_id": "index"}))
+
+    assert output["results"][0]["output"]["summary"] == "cached summary of a"
+    # b is cached by the first batch, the failed request is retried
+    assert sorted(call.kwargs["json"]["video_id"] for call in mock_post.call_args_list) == ["b", "broken", "broken"]
+
+
+@pytest.mark.asyncio
+async def test_batch_text_generation_combines_outputs(text_generation_cache):
+    with patch.object(video_text_generation.requests, "post", side_effect=fake_post), patch.object(
+        video_text_generation, "_reduce_text_generation", return_value="both videos"
+    ) as mock_reduce:
+        output = json.loads(
+            await batch_text_generation.ainvoke({"video_ids": ["a", "b", "broken"], "index_id": "index", "task": "summary", "combine": True})
+        )
+
+    assert output["combined"] == "both videos"
+    # only the outputs that were generated are combined
+    assert [result["video_id"] for result in mock_reduce.call_args.args[2]] == ["a", "b"]
+
+
+def test_parse_timeline_skips_segments_without_a_time_range():
+    response = {
+        "chapters": [
+            {"chapter_number": 1, "start_sec": 30, "end_sec": 60, "chapter_title": "Second half", "chapter_summary": "The comeback"},
+            {"chapter_number": 0, "start_sec": 0, "end_sec": 30, "chapter_title": "First half", "chapter_summary": "The opening"},
+            {"chapter_number": 2, "start_sec": 60, "end_sec": 60, "chapter_title": "Final whistle"},
+        ]
+    }
+
+    clips = parse_timeline(response, "chapter", "index", "a", "https://hls/a.m3u8", "a.mp4")
+
+    assert [(clip["start"], clip["end"]) for clip in clips] == [(0, 30), (30, 60)]
+    assert clips[0]["metadata"] == [{"type": "chapter", "text": "First half", "summary": "The opening"}]
+    assert Clip(**clips[0]).video_title == "a.mp4"
+
+
+@pytest.mark.asyncio
+async def test_highlights_become_clips_and_are_cached(text_generation_cache):
+    response = MagicMock(ok=True)
+    response.json.return_value = {
+        "id": "result_a",
+        "highlights": [{"start": 12, "end": 20, "highlight": "Buzzer beater", "highlight_summary": "A three at the buzzer"}],
+    }
+    catalog_video = CatalogVideo(index_id="index", video_id="a", filename="a.mp4", video_url="https://hls/a.m3u8")
+
+    with patch.object(video_text_generation.requests, "post", return_value=response) as mock_post, patch.object(
+        video_text_generation, "lookup_videos", new_callable=AsyncMock, return_value=({"a": catalog_video}, {})
+    ) as mock_lookup:
+        arguments = {"video_id": "a", "index_id": "index", "endpoint_option": "highlight", "prompt": None}
+        output = json.loads(await summarize_text_generation.ainvoke(arguments))
+        cached_output = json.loads(await summarize_text_generation.ainvoke(arguments))
+
+    assert output["video_url"] == "https://hls/a.m3u8"
+    assert [(clip["video_id"], clip["start"], clip["end"]) for clip in output["clips"]] == [("a", 12, 20)]
+    # the second call reads the timeline without a request or a metadata lookup
+    assert cached_output == output
+    assert mock_post.call_count == 1
+    assert mock_lookup.call_count == 1
@@ -0,0 +1,109 @@
+import os
+import json
+import stat
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+
+# testing video_utils.py
+from jockey.video_utils import run_ffmpeg, download_m3u8_videos, clip_cache_key, FFMPEG_PROGRESS_EVENT
+from jockey.media_cache import MediaCache
+
+FAKE_FFMPEG = """#!/bin/sh
+printf 'frame=10\\nout_time=00:00:01.000000\\nspeed=2.0x\\nprogress=continue\\n'
+printf 'frame=20\\nout_time=00:00:02.000000\\nspeed=2.1x\\nprogress=end\\n'
+"""
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path):
+    """write an executable that prints ffmpeg `-progress` blocks"""
+    path = tmp_path / "ffmpeg"
+    path.write_text(FAKE_FFMPEG)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+@pytest.mark.asyncio
+async def test_run_ffmpeg_emits_progress_events(fake_ffmpeg):
+    with patch("jockey.video_utils.dispatch_jockey_event", new_callable=AsyncMock) as mock_dispatch:
+        await run_ffmpeg([fake_ffmpeg, "-i", "in.mp4", "out.mp4"], label="combine", duration=4)
+
+    assert mock_dispatch.await_count == 2
+    name, first = mock_dispatch.await_args_list[0].args
+    assert name == FFMPEG_PROGRESS_EVENT
+    assert first == {
+        "label": "combine",
+        "frame": 10,
+        "out_time": "00:00:01.000000",
+        "out_time_seconds": 1.0,
+        "speed": "2.0x",
+        "status": "continue",
+        "percent": 25.0,
+    }
+    assert mock_dispatch.await_args_list[1].args[1]["status"] == "end"
+
+
+@pytest.mark.asyncio
+async def test_run_ffmpeg_kills_process_on_cancel(tmp_path):
+    path = tmp_path / "ffmpeg"
+    path.write_text(f"#!/bin/sh\necho $$ > {tmp_path}/pid\nexec sleep 30\n")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+
+    task = asyncio.create_task(run_ffmpeg([str(path)], label="slow"))
+    while not os.path.exists(tmp_path / "pid"):
+        await asyncio.sleep(0.01)
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    pid = int((tmp_path / "pid").read_text())
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+
+
+@pytest.mark.asyncio
+async def test_download_m3u8_videos_downloads_each_source_once(tmp_path):
+    labels = []
+
+    async def fake_run_ffmpeg(stream_spec, label, duration=None, on_progress=None):
+        labels.append(label)
+        await asyncio.sleep(0.01)
+        with open(stream_spec.compile()[-1], "wb") as f:
+            f.write(b"video")
+
+    async def fake_smart_cut(input_path, keep_ranges, output_path):
+        labels.append(f"trim {os.path.basename(input_path)[0]}")
+        with open(output_path, "wb") as f:
+            f.write(b"clip")
+
+    async def fake_validate(self, path):
+        return os.path.isfile(path) and os.path.getsize(path) > 0
+
+    results = [
+        {"video_id": "a", "video_url": "https://example.com/a.m3u8", "start": 0, "end": 5},
+        {"video_id": "a", "video_url": "https://example.com/a.m3u8", "start": 10, "end": 15},
+        {"video_id": "b", "video_url": "https://example.com/b.m3u8", "start": 3, "end": 4, "index_id": "season_2"},
+    ]
+    event = {"event": "on_tool_end", "name": "simple-video-search", "data": {"input": {"index_id": "index1"}, "output": json.dumps(results)}}
+
+    with (
+        patch.object(MediaCache, "validate", fake_validate),
+        patch("jockey.video_utils.get_media_cache", return_value=MediaCache(str(tmp_path))),
+        patch("jockey.video_utils.run_ffmpeg", fake_run_ffmpeg),
+        patch("jockey.video_utils.smart_cut", fake_smart_cut),
+    ):
+        clip_paths = await download_m3u8_videos(event)
+        assert sorted(labels) == ["download a", "download b", "trim a", "trim a", "trim b"]
+        # clips are cached under the keys download_video looks them up with
+        assert clip_paths == [
+            os.path.join(str(tmp_path), clip_cache_key("index1", "a", 0.0, 5.0)),
+            os.path.join(str(tmp_path), clip_cache_key("index1", "a", 10.0, 15.0)),
+            os.path.join(str(tmp_path), clip_cache_key("season_2", "b", 3.0, 4.0)),
+        ]
+
+        # everything is cached now, so nothing is downloaded or trimmed again
+        labels.clear()
+        assert await download_m3u8_videos(event) == clip_paths
+        assert labels == []
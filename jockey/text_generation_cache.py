@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import functools
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Union
+from jockey.media_config import TEXT_GENERATION_CACHE_TTL_SECONDS
+
+
+def text_generation_cache_key(url: str, payload: Dict) -> str:
+    """Key of a text generation request. Payloads that only differ in key order get the same key."""
+    request = json.dumps({"url": url, "payload": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+class TextGenerationCache:
+    """Responses of the Twelve Labs text generation endpoints persisted in a SQLite file.
+
+    Generating text for a video is slow and billed per request, while the output for the same video, endpoint and prompt
+    rarely changes, so successful responses are kept for `ttl_seconds` and reused by every worker sharing the directory.
+    The default highlights and chapters of a video are also kept as a timeline of clips, see `put_timeline`.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        ttl_seconds (float): Age after which a cached response is generated again. None keeps responses forever.
+    """
+
+    def __init__(self, path: str, ttl_seconds: Union[float, None] = None) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, video_id TEXT NOT NULL, created_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS timelines (index_id TEXT NOT NULL, video_id TEXT NOT NULL, kind TEXT NOT NULL, "
+                "created_at REAL NOT NULL, data TEXT NOT NULL, PRIMARY KEY (index_id, video_id, kind))"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, url: str, payload: Dict) -> Union[Dict, None]:
+        """Get the cached response of a request, or None if it was never made or expired."""
+        min_created_at = time.time() - self.ttl_seconds if self.ttl_seconds is not None else 0
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT data FROM responses WHERE key = ? AND created_at >= ?", (text_generation_cache_key(url, payload), min_created_at)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, url: str, payload: Dict, response: Dict) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, video_id, created_at, data) VALUES (?, ?, ?, ?)",
+                (text_generation_cache_key(url, payload), payload.get("video_id", ""), time.time(), json.dumps(response)),
+            )
+
+    def get_timeline(self, index_id: str, video_id: str, kind: str) -> Union[Dict, None]:
+        """Get the cached `highlight` or `chapter` timeline of a video, or None if it was never parsed or expired."""
+        min_created_at = time.time() - self.ttl_seconds if self.ttl_seconds is not None else 0
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT data FROM timelines WHERE index_id = ? AND video_id = ? AND kind = ? AND created_at >= ?",
+                (index_id, video_id, kind, min_created_at),
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_timeline(self, index_id: str, video_id: str, kind: str, response: Dict, clips: List[Dict]) -> None:
+        """Keep the `highlight` or `chapter` response of a video together with the clips parsed from it."""
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO timelines (index_id, video_id, kind, created_at, data) VALUES (?, ?, ?, ?, ?)",
+                (index_id, video_id, kind, time.time(), json.dumps({"response": response, "clips": clips})),
+            )
+
+    def forget(self, video_id: str) -> None:
+        """Drop every cached response and timeline of a video, e.g. after it was re-indexed."""
+        with self._connect() as connection:
+            connection.execute("DELETE FROM responses WHERE video_id = ?", (video_id,))
+            connection.execute("DELETE FROM timelines WHERE video_id = ?", (video_id,))
+
+
+@functools.lru_cache(maxsize=None)
+def _text_generation_cache(root: str, ttl_seconds: Union[float, None]) -> TextGenerationCache:
+    return TextGenerationCache(os.path.join(root, ".jockey", "text_generation_cache.sqlite"), ttl_seconds)
+
+
+def get_text_generation_cache() -> TextGenerationCache:
+    """Get the shared text generation cache, stored next to the media cache under `HOST_PUBLIC_DIR`."""
+    return _text_generation_cache(os.environ["HOST_PUBLIC_DIR"], TEXT_GENERATION_CACHE_TTL_SECONDS)
@@ -57,7 +57,7 @@ session_id = uuid.uuid4()
 
 # Create the thread configuration
 thread: RunnableConfig = {
-    "configurable": {"thread_id": session_id, "stream_mode": ["updates", "events"]},
+    "configurable": {"thread_id": str(session_id), "stream_mode": ["updates", "events"]},
     "tags": ["jockey"],
     "metadata": {"source": "jockey"},
 }
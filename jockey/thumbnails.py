@@ -0,0 +1,173 @@
+import os
+import math
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import ffmpeg
+from typing import Dict, List, Literal, Sequence, Set, Tuple
+from jockey.media_cache import get_media_cache
+from jockey.media_config import CLIP_THUMBNAIL_MODE, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, THUMBNAIL_SPRITE_COLUMNS, THUMBNAIL_CONCURRENCY
+from jockey.video_utils import run_ffmpeg, source_cache_key
+
+ThumbnailMode = Literal["still", "sprite"]
+
+# thumbnail times are rounded to this many seconds, so two of them never fall between the same pair of frames
+THUMBNAIL_TIME_RESOLUTION = 0.5
+
+# thumbnails being cut in the background, referenced so they aren't garbage collected
+_thumbnail_tasks: Set[asyncio.Task] = set()
+
+
+def thumbnail_time(time: float) -> float:
+    """Round a clip start time to the time its thumbnail is taken at."""
+    return round(time / THUMBNAIL_TIME_RESOLUTION) * THUMBNAIL_TIME_RESOLUTION
+
+
+def _thumbnail_frame(source: str, time: float):
+    """Read the frame of `source` at `time`, scaled and padded to the thumbnail size. The seek is done on the input, so
+    ffmpeg jumps to the keyframe before `time` and over HLS only downloads the segment holding it."""
+    return (
+        ffmpeg.input(source, ss=time)
+        .video.filter("scale", THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, force_original_aspect_ratio="decrease")
+        .filter("pad", THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, "(ow-iw)/2", "(oh-ih)/2")
+        .filter("trim", end_frame=1)
+    )
+
+
+def _still_key(video_id: str, time: float) -> str:
+    return os.path.join("thumbnails", video_id, f"{time}.jpg")
+
+
+def _sprite_layout(video_id: str, times: Sequence[float]) -> Tuple[str, int, int]:
+    """Get the media cache key, columns and rows of the sprite sheet of the given sorted times of a source video."""
+    columns = min(len(times), THUMBNAIL_SPRITE_COLUMNS)
+    rows = math.ceil(len(times) / columns)
+    times_hash = hashlib.sha1(",".join(str(time) for time in times).encode("utf-8")).hexdigest()[:16]
+    return os.path.join("thumbnails", video_id, f"sprite_{THUMBNAIL_WIDTH}x{THUMBNAIL_HEIGHT}_{times_hash}.jpg"), columns, rows
+
+
+def thumbnail_urls(video_id: str, times: Sequence[float], mode: ThumbnailMode = CLIP_THUMBNAIL_MODE) -> Dict[float, str]:
+    """Get the URL the thumbnail at each time of a source video is served at, which is known before the thumbnail is cut.
+
+    Returns:
+        Dict[float, str]: The URL of the still for each time, or of the sprite sheet with a `#xywh=` media fragment
+            locating the thumbnail in it.
+    """
+    media_cache = get_media_cache()
+    times = sorted(set(times))
+    if mode == "still":
+        return {time: media_cache.url_for(_still_key(video_id, time)) for time in times}
+
+    sprite_key, columns, _ = _sprite_layout(video_id, times)
+    sprite_url = media_cache.url_for(sprite_key)
+    return {
+        time: f"{sprite_url}#xywh={(index % columns) * THUMBNAIL_WIDTH},{(index // columns) * THUMBNAIL_HEIGHT},{THUMBNAIL_WIDTH},{THUMBNAIL_HEIGHT}"
+        for index, time in enumerate(times)
+    }
+
+
+async def generate_stills(video_id: str, source: str, times: Sequence[float]) -> Dict[float, str]:
+    """Cut a still at each time of a source video into the media cache, in one ffmpeg call that seeks to each of the
+    stills that aren't cached yet.
+
+    Returns:
+        Dict[float, str]: Filepath of the still for each time. Times past the end of the source are left out.
+    """
+    media_cache = get_media_cache()
+    stills = {}
+    missing = []
+    for time in sorted(set(times)):
+        still_path = await media_cache.lookup(_still_key(video_id, time))
+        if still_path is not None:
+            stills[time] = still_path
+        else:
+            missing.append(time)
+
+    if not missing:
+        return stills
+
+    still_dir = tempfile.mkdtemp(dir=os.path.dirname(media_cache.path_for(os.path.join("thumbnails", video_id, "stills"))))
+    try:
+        still_stream = ffmpeg.merge_outputs(*[
+            _thumbnail_frame(source, time).output(os.path.join(still_dir, f"{index + 1:04d}.jpg"), vframes=1) for index, time in enumerate(missing)
+        ]).global_args("-loglevel", "error")
+        await run_ffmpeg(still_stream, label=f"thumbnails {video_id}")
+
+        for index, time in enumerate(missing):
+            still_path = os.path.join(still_dir, f"{index + 1:04d}.jpg")
+            if not os.path.exists(still_path):
+                continue
+            async with media_cache.write(_still_key(video_id, time)) as temporary_still_path:
+                os.replace(still_path, temporary_still_path)
+            stills[time] = os.path.join(media_cache.root, _still_key(video_id, time))
+    finally:
+        shutil.rmtree(still_dir, ignore_errors=True)
+
+    return stills
+
+
+async def generate_sprite(video_id: str, source: str, times: Sequence[float]) -> str:
+    """Cut one sprite sheet with a thumbnail for each time of a source video into the media cache, in one ffmpeg call
+    that seeks to each time. Thumbnails are laid out in time order, see `thumbnail_urls`.
+
+    Returns:
+        str: Filepath of the sprite sheet.
+    """
+    times = sorted(set(times))
+    sprite_key, columns, rows = _sprite_layout(video_id, times)
+
+    async def render(output_path: str) -> None:
+        frames = ffmpeg.concat(*[_thumbnail_frame(source, time) for time in times], v=1, a=0)
+        sprite_stream = frames.filter("tile", f"{columns}x{rows}").output(output_path, vframes=1).global_args("-loglevel", "error")
+        await run_ffmpeg(sprite_stream, label=f"sprite {video_id}")
+
+    return await get_media_cache().get_or_create(sprite_key, render)
+
+
+async def generate_thumbnails(
+    clips_by_video: Dict[str, List], mode: ThumbnailMode = CLIP_THUMBNAIL_MODE, concurrency: int = THUMBNAIL_CONCURRENCY
+) -> None:
+    """Cut the thumbnails of clips grouped by source video, from the source in the media cache if it was already downloaded
+    and from its HLS stream otherwise. Failures are logged."""
+    media_cache = get_media_cache()
+    semaphore = asyncio.Semaphore(concurrency)
+    generate = generate_sprite if mode == "sprite" else generate_stills
+
+    async def cut(video_id: str, video_clips: List) -> None:
+        try:
+            async with semaphore:
+                source = await media_cache.lookup(source_cache_key(video_id)) or video_clips[0].video_url
+                await generate(video_id, source, [thumbnail_time(clip.start) for clip in video_clips])
+        except Exception as error:
+            print(f"[ERROR] Failed to generate thumbnails for Video ID {video_id}: {error}")
+
+    await asyncio.gather(*[cut(video_id, video_clips) for video_id, video_clips in clips_by_video.items()])
+
+
+def attach_thumbnails(clips: List, mode: ThumbnailMode = CLIP_THUMBNAIL_MODE, concurrency: int = THUMBNAIL_CONCURRENCY) -> asyncio.Task:
+    """Set the `thumbnail_url` of every clip that has none to the URL of a thumbnail taken at its start time, and cut the
+    thumbnails in the background. Until a thumbnail is cut its URL isn't served yet, and it never is if cutting it failed.
+
+    Args:
+        clips (List[Clip]): Clips to attach thumbnails to, updated in place.
+        mode (ThumbnailMode): `still` for a file per clip, `sprite` for one sprite sheet per source video.
+        concurrency (int): Maximum number of source videos thumbnails are cut from at the same time.
+
+    Returns:
+        asyncio.Task: The task cutting the thumbnails.
+    """
+    clips_by_video: Dict[str, List] = {}
+    for clip in clips:
+        if not clip.thumbnail_url:
+            clips_by_video.setdefault(clip.video_id, []).append(clip)
+
+    for video_id, video_clips in clips_by_video.items():
+        urls = thumbnail_urls(video_id, [thumbnail_time(clip.start) for clip in video_clips], mode)
+        for clip in video_clips:
+            clip.thumbnail_url = urls[thumbnail_time(clip.start)]
+
+    task = asyncio.create_task(generate_thumbnails(clips_by_video, mode, concurrency))
+    _thumbnail_tasks.add(task)
+    task.add_done_callback(_thumbnail_tasks.discard)
+    return task
@@ -0,0 +1,175 @@
+import os
+import re
+import time
+import asyncio
+import sqlite3
+import functools
+import requests
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Set, Union
+from jockey.media_config import TRANSCRIPT_INDEX_CONCURRENCY
+from jockey.video_utils import INDEX_URL
+
+
+def fetch_transcript(index_id: str, video_id: str) -> List[Dict]:
+    """Get the time-aligned transcript of an indexed video as a list of {start, end, value} segments."""
+    headers = {"accept": "application/json", "x-api-key": os.environ["TWELVE_LABS_API_KEY"]}
+    response = requests.get(f"{INDEX_URL}{index_id}/videos/{video_id}", params={"transcription": "true"}, headers=headers)
+    response.raise_for_status()
+    return response.json().get("transcription") or []
+
+
+# words too common to tell transcript segments apart, left out of keyword queries
+STOPWORDS = frozenset(
+    "a about an and are as at be but by did do does for from had has have he her his i if in into is it its me my no not of "
+    "on or our she so that the their them then there these they this to was we were what when where which who will with "
+    "you your".split()
+)
+
+
+def transcript_match_expression(query: str) -> Union[str, None]:
+    """Turn a query into an FTS5 match expression. A query in double quotes matches the exact phrase, any other query
+    matches segments with every one of its words that isn't a stopword, ranked by BM25. Returns None for queries
+    without such words."""
+    words = re.findall(r"\w+", query)
+    if len(query.strip()) > 1 and query.strip().startswith('"') and query.strip().endswith('"'):
+        return '"' + " ".join(words) + '"' if words else None
+    keywords = list(dict.fromkeys(word for word in words if word.lower() not in STOPWORDS))
+    if not keywords:
+        return None
+    return " AND ".join(f'"{keyword}"' for keyword in keywords)
+
+
+class TranscriptIndex:
+    """Transcripts of indexed videos with a full-text index over their segments, persisted in a SQLite file.
+
+    Each transcript segment is a row of an FTS5 table, which SQLite keeps as an on-disk inverted index and ranks with BM25,
+    so conversation queries over videos that were already seen are answered locally with the segment's timestamps.
+    A video is fetched once, videos without speech are remembered so they aren't fetched again.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        concurrency (int): Maximum number of transcripts fetched at the same time.
+    """
+
+    def __init__(self, path: str, concurrency: int = TRANSCRIPT_INDEX_CONCURRENCY) -> None:
+        self.path = path
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._index_tasks: Set[asyncio.Task] = set()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS videos "
+                "(index_id TEXT NOT NULL, video_id TEXT NOT NULL, fetched_at REAL NOT NULL, PRIMARY KEY (index_id, video_id))"
+            )
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS segments USING fts5"
+                "(text, index_id UNINDEXED, video_id UNINDEXED, start UNINDEXED, end UNINDEXED, tokenize='porter unicode61')"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def indexed_videos(self, index_id: str, video_ids: Sequence[str]) -> Set[str]:
+        """Get the IDs of the given videos whose transcript is in the index."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT video_id FROM videos WHERE index_id = ? AND video_id IN ({', '.join('?' * len(video_ids))})", (index_id, *video_ids)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def put(self, index_id: str, video_id: str, transcript: List[Dict]) -> None:
+        """Store the transcript of a video, replacing an earlier one."""
+        with self._connect() as connection:
+            connection.execute("DELETE FROM segments WHERE index_id = ? AND video_id = ?", (index_id, video_id))
+            connection.executemany(
+                "INSERT INTO segments (text, index_id, video_id, start, end) VALUES (?, ?, ?, ?, ?)",
+                [(segment["value"], index_id, video_id, segment["start"], segment["end"]) for segment in transcript if segment.get("value")],
+            )
+            connection.execute("INSERT OR REPLACE INTO videos (index_id, video_id, fetched_at) VALUES (?, ?, ?)", (index_id, video_id, time.time()))
+
+    async def _index_video(self, index_id: str, video_id: str) -> None:
+        async with self._semaphore:
+            try:
+                transcript = await asyncio.to_thread(fetch_transcript, index_id, video_id)
+            except Exception as error:
+                print(f"[WARNING] Failed to get the transcript of Video ID {video_id}: {error}")
+                return
+        await asyncio.to_thread(self.put, index_id, video_id, transcript)
+
+    async def add_videos(self, index_id: str, video_ids: Sequence[str]) -> None:
+        """Fetch and index the transcripts of the videos that aren't in the index yet."""
+        video_ids = list(dict.fromkeys(video_ids))
+        indexed_video_ids = await asyncio.to_thread(self.indexed_videos, index_id, video_ids)
+        await asyncio.gather(*[self._index_video(index_id, video_id) for video_id in video_ids if video_id not in indexed_video_ids])
+
+    def schedule(self, index_id: str, video_ids: Sequence[str]) -> asyncio.Task:
+        """Index the transcripts of videos in the background, e.g. the videos of a search that just ran."""
+        task = asyncio.create_task(self.add_videos(index_id, video_ids))
+        self._index_tasks.add(task)
+        task.add_done_callback(self._index_tasks.discard)
+        return task
+
+    def search(self, query: str, index_ids: Sequence[str], top_n: int, video_filter: Union[List[str], None] = None) -> List[Dict]:
+        """Find the transcript segments that best match a query, in the shape of clip search results.
+
+        Args:
+            query (str): Words that must all be in a segment, or a phrase in double quotes.
+            index_ids (Sequence[str]): Indexes to search.
+            top_n (int): Maximum number of segments to return.
+            video_filter (List[str], optional): Only search these videos.
+
+        Returns:
+            List[Dict]: Matching segments, best first, with their `video_id`, `index_id`, `start`, `end` and `score`.
+                The score is the BM25 score of the segment, `confidence` compares it to the best match.
+        """
+        match_expression = transcript_match_expression(query)
+        if match_expression is None or not index_ids:
+            return []
+
+        sql = (
+            "SELECT video_id, index_id, start, end, text, -bm25(segments) AS score FROM segments "
+            f"WHERE segments MATCH ? AND index_id IN ({', '.join('?' * len(index_ids))})"
+        )
+        parameters = [match_expression, *index_ids]
+        if video_filter:
+            sql += f" AND video_id IN ({', '.join('?' * len(video_filter))})"
+            parameters.extend(video_filter)
+        sql += " ORDER BY bm25(segments) LIMIT ?"
+        parameters.append(top_n)
+
+        with self._connect() as connection:
+            rows = connection.execute(sql, parameters).fetchall()
+
+        results = []
+        for video_id, index_id, start, end, text, score in rows:
+            relative_score = score / rows[0][5] if rows[0][5] > 0 else 1
+            results.append({
+                "video_id": video_id,
+                "index_id": index_id,
+                "start": start,
+                "end": end,
+                "score": round(score, 4),
+                "confidence": "high" if relative_score >= 2 / 3 else "medium" if relative_score >= 1 / 3 else "low",
+                "metadata": [{"type": "conversation", "text": text}],
+                "modules": [{"type": "conversation", "confidence": "high"}],
+            })
+        return results
+
+
+@functools.lru_cache(maxsize=None)
+def _transcript_index(root: str) -> TranscriptIndex:
+    return TranscriptIndex(os.path.join(root, ".jockey", "transcript_index.sqlite"))
+
+
+def get_transcript_index() -> TranscriptIndex:
+    """Get the shared transcript index, stored next to the media cache under `HOST_PUBLIC_DIR`."""
+    return _transcript_index(os.environ["HOST_PUBLIC_DIR"])
@@ -83,6 +83,23 @@ async def parse_langchain_events_terminal(event: dict):
         except (json.decoder.JSONDecodeError, TypeError):
             console.print(Padding(str(event["data"]["output"]), (0, 6)))
 
+    elif event["event"] == "on_custom_event" and event["name"] == "ffmpeg_progress":
+        progress = event["data"]
+        percent = f" ({progress['percent']}%)" if progress.get("percent") is not None else ""
+        if progress["status"] == "end":
+            console.print(Padding(f"[cyan]🏇 Finished {progress['label']}: {progress['frame']} frames{percent}", (0, 2)))
+        else:
+            status = f"frame={progress['frame']} time={progress['out_time']} speed={progress['speed']}{percent}"
+            console.print(Padding(f"[cyan]🏇 {progress['label']}: {status}", (0, 2)))
+
+    elif event["event"] == "on_custom_event" and event["name"] == "search_results_page":
+        search_page = event["data"]
+        found = f"{len(search_page['results'])} results for \"{search_page['query']}\""
+        console.print(Padding(f"[cyan]🏇 Found {found} (page {search_page['page']})", (0, 2)))
+
+    elif event["event"] == "on_custom_event" and event["name"] == "render_stream_ready":
+        console.print(Padding(f"[cyan]🏇 {event['data']['output_filename']} can be watched while rendering: {event['data']['filepath']}", (0, 2)))
+
     elif event["event"] == "on_chat_model_start":
         if "instructor" in event["tags"]:
             console.print(Padding(f"[red]🏇 Instructor: ", (1, 0)), end="")
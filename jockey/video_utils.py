@@ -1,14 +1,166 @@
 import os
+import shutil
+import asyncio
 import requests
 import ffmpeg
 import urllib.parse
 import tqdm
 import json
-import subprocess
-from jockey.thread import session_id
+import tempfile
+import contextlib
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Sequence, Union
+from langchain_core.callbacks.manager import adispatch_custom_event
+from langchain_core.runnables.schema import StreamEvent
+from jockey.media_cache import get_media_cache
+from jockey.probe_cache import get_probe_cache
+from jockey.clip_ops import plan_smart_cut
+from jockey.media_config import SOURCE_DOWNLOAD_CONCURRENCY, CLIP_TRIM_CONCURRENCY
 
 TL_BASE_URL = "https://api.twelvelabs.io/v1.3/"
 INDEX_URL = urllib.parse.urljoin(TL_BASE_URL, "indexes/")
+FFMPEG_PROGRESS_EVENT = "ffmpeg_progress"
+
+# ffmpeg processes started while this is set run at a lower CPU priority, e.g. speculative prefetches
+ffmpeg_niceness: ContextVar[int] = ContextVar("ffmpeg_niceness", default=0)
+
+
+def _parse_out_time(out_time: str) -> Union[float, None]:
+    """Convert an ffmpeg `out_time` value (HH:MM:SS.micro) to seconds."""
+    try:
+        hours, minutes, seconds = out_time.split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (AttributeError, ValueError):
+        return None
+
+
+async def dispatch_jockey_event(name: str, data: Dict) -> None:
+    """Dispatch a LangChain custom event, ignoring calls made outside of a graph run (e.g. from scripts)."""
+    with contextlib.suppress(RuntimeError):
+        await adispatch_custom_event(name, data)
+
+
+async def run_ffmpeg(
+    stream_spec,
+    label: str,
+    duration: Union[float, None] = None,
+    on_progress: Union[Callable[[Dict], Awaitable[None]], None] = None,
+) -> None:
+    """Run an ffmpeg-python stream spec as an async subprocess.
+
+    ffmpeg's `-progress` output is parsed and emitted as `ffmpeg_progress` custom events with the frame count,
+    output time and speed so the terminal and API clients can follow long renders.
+    The child process is killed if the awaiting task is cancelled, e.g. when a graph run is cancelled.
+
+    Args:
+        stream_spec: An ffmpeg-python output stream, or an already compiled list of ffmpeg arguments.
+        label (str): Short name for the job that is included in every progress event.
+        duration (float, optional): Expected output duration in seconds, used to report a completion percentage.
+        on_progress (Callable, optional): Coroutine called with the data of every progress event.
+    """
+    args = stream_spec if isinstance(stream_spec, list) else stream_spec.compile()
+    command = [args[0], "-nostats", "-progress", "pipe:1", *args[1:]]
+    if ffmpeg_niceness.get() > 0 and shutil.which("nice"):
+        command = ["nice", "-n", str(ffmpeg_niceness.get()), *command]
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    stderr_task = asyncio.create_task(process.stderr.read())
+
+    try:
+        progress = {}
+        async for raw_line in process.stdout:
+            key, _, value = raw_line.decode("utf-8", errors="replace").strip().partition("=")
+            progress[key] = value
+
+            # every progress block ends with `progress=continue` or `progress=end`
+            if key != "progress":
+                continue
+
+            out_time_seconds = _parse_out_time(progress.get("out_time"))
+            event_data = {
+                "label": label,
+                "frame": int(progress.get("frame", 0) or 0),
+                "out_time": progress.get("out_time"),
+                "out_time_seconds": out_time_seconds,
+                "speed": progress.get("speed"),
+                "status": value,
+            }
+            if duration and out_time_seconds is not None:
+                event_data["percent"] = round(min(100.0, 100 * out_time_seconds / duration), 1)
+            await dispatch_jockey_event(FFMPEG_PROGRESS_EVENT, event_data)
+            if on_progress is not None:
+                await on_progress(event_data)
+            progress = {}
+
+        stderr = await stderr_task
+        await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        stderr_task.cancel()
+        raise
+
+    if process.returncode != 0:
+        raise ffmpeg.Error("ffmpeg", b"", stderr)
+
+
+# encoders that produce streams which can be joined with stream-copied pieces of the same codec
+SMART_CUT_VIDEO_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+SMART_CUT_AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame"}
+
+
+async def smart_cut(input_path: str, keep_ranges: Sequence[Sequence[float]], output_path: str) -> None:
+    """Join `keep_ranges` of a video into `output_path`, stream-copying everything between keyframes.
+
+    Only the pieces between a cut point and the nearest keyframe are re-encoded, with the codec, resolution and time base
+    of the source so the pieces can be joined without another encode. Keyframes come from the probe cache.
+    Sources with a codec that has no matching encoder are re-encoded whole, with libx264 and aac.
+
+    Args:
+        input_path (str): Path of the source video.
+        keep_ranges (Sequence): (start, end) ranges in seconds to keep, in output order.
+        output_path (str): Path of the joined video.
+    """
+    media_probe = await get_probe_cache().probe(input_path)
+    video_encoder = SMART_CUT_VIDEO_ENCODERS.get(media_probe.video_codec)
+    audio_encoder = SMART_CUT_AUDIO_ENCODERS.get(media_probe.audio_codec, "aac")
+
+    if video_encoder is not None:
+        pieces = plan_smart_cut(keep_ranges, media_probe.keyframes, media_probe.duration)
+    else:
+        video_encoder = "libx264"
+        pieces = plan_smart_cut(keep_ranges, keyframes=[])
+
+    encode_options = {"vcodec": video_encoder, "acodec": audio_encoder}
+    if media_probe.width and media_probe.height:
+        encode_options["s"] = f"{media_probe.width}x{media_probe.height}"
+    if media_probe.frame_rate and media_probe.frame_rate != "0/0":
+        encode_options["r"] = media_probe.frame_rate
+    if media_probe.time_base and media_probe.time_base.startswith("1/"):
+        encode_options["video_track_timescale"] = media_probe.time_base[2:]
+
+    piece_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+
+        async def cut_piece(index: int) -> str:
+            piece = pieces[index]
+            piece_path = os.path.join(piece_dir, f"{index}.mp4")
+            output_options = {"c": "copy"} if piece.copy_stream else encode_options
+            piece_stream = ffmpeg.input(input_path, loglevel="error", ss=piece.start, t=piece.end - piece.start).output(
+                piece_path, avoid_negative_ts="make_zero", **output_options
+            )
+            await run_ffmpeg(piece_stream, label=f"cut {os.path.basename(input_path)}", duration=piece.end - piece.start)
+            return piece_path
+
+        piece_paths = await asyncio.gather(*[cut_piece(index) for index in range(len(pieces))])
+
+        concat_list_path = os.path.join(piece_dir, "pieces.txt")
+        with open(concat_list_path, "w") as f:
+            # paths in the list are resolved relative to the list itself
+            f.writelines(f"file '{os.path.basename(piece_path)}'\n" for piece_path in piece_paths)
+        concat_stream = ffmpeg.input(concat_list_path, format="concat", safe=0, loglevel="error").output(output_path, c="copy")
+        await run_ffmpeg(concat_stream, label=f"join {os.path.basename(output_path)}", duration=sum(piece.end - piece.start for piece in pieces))
+    finally:
+        shutil.rmtree(piece_dir, ignore_errors=True)
 
 
 def get_video_metadata(index_id: str, video_id: str) -> dict:
@@ -31,96 +183,158 @@ def get_video_metadata(index_id: str, video_id: str) -> dict:
     return response
 
 
-def download_video(video_id: str, index_id: str, start: float, end: float) -> str:
+def source_cache_key(video_id: str) -> str:
+    """Media cache key of a full source video downloaded by `download_m3u8_videos`."""
+    return os.path.join("sources", f"{video_id}.mp4")
+
+
+def clip_cache_key(index_id: str, video_id: str, start: float, end: float) -> str:
+    """Media cache key of a clip cut by `download_video`."""
+    return os.path.join(index_id, f"{video_id}_{start}_{end}.mp4")
+
+
+async def download_video(video_id: str, index_id: str, start: float, end: float) -> str:
     """Download a video for a given video in a given index and get the filepath.
     Should only be used when the user explicitly requests video editing functionalities."""
+    media_cache = get_media_cache()
+    video_key = clip_cache_key(index_id, video_id, start, end)
+
+    video_path = await media_cache.lookup(video_key)
+    if video_path is not None:
+        return video_path
+
     headers = {"x-api-key": os.environ["TWELVE_LABS_API_KEY"], "accept": "application/json", "Content-Type": "application/json"}
 
     video_url = f"{INDEX_URL}{index_id}/videos/{video_id}"
 
-    response = requests.get(video_url, headers=headers)
+    response = await asyncio.to_thread(requests.get, video_url, headers=headers)
 
     assert response.status_code == 200
 
     hls_uri = response.json()["hls"]["video_url"]
 
-    video_dir = os.path.join(os.environ["HOST_PUBLIC_DIR"], index_id)
+    async def cut_clip(output_path: str) -> None:
+        duration = end - start
+        buffer = 1  # Add a 1-second buffer on each side
+        buffered_start = max(0, start - buffer)
+        buffered_path = f"{os.path.splitext(output_path)[0]}_buffered.mp4"
+        try:
+            download_stream = ffmpeg.input(
+                filename=hls_uri, strict="experimental", loglevel="quiet", ss=buffered_start, t=duration + 2 * buffer
+            ).output(buffered_path, vcodec="libx264", acodec="aac", avoid_negative_ts="make_zero", fflags="+genpts")
+            await run_ffmpeg(download_stream, label=f"download {video_id}", duration=duration + 2 * buffer)
+
+            # Then trim the video more precisely, a plain stream copy would snap the start to the previous keyframe
+            await smart_cut(buffered_path, [(start - buffered_start, start - buffered_start + duration)], output_path)
+        finally:
+            get_probe_cache().forget(buffered_path)
+            if os.path.exists(buffered_path):
+                os.remove(buffered_path)
 
-    if os.path.isdir(video_dir) is False:
-        os.mkdir(video_dir)
+    try:
+        video_path = await media_cache.get_or_create(video_key, cut_clip)
+    except Exception as error:
+        error_response = {
+            "message": f"There was an error downloading the video with Video ID: {video_id} in Index ID: {index_id}. "
+            "Double check that the Video ID and Index ID are valid and correct.",
+            "error": str(error),
+        }
+        return error_response
 
-    video_filename = f"{video_id}_{start}_{end}.mp4"
-    video_path = os.path.join(video_dir, video_filename)
+    return video_path
 
-    if os.path.isfile(video_path) is False:
+
+def _search_results_from_event(event: StreamEvent) -> List[Dict]:
+    """Get the search results from the `on_tool_end` event of a video search, whatever shape the tool output has."""
+    output = event["data"].get("output")
+    output = getattr(output, "content", output)
+    if isinstance(output, str):
         try:
-            duration = end - start
-            buffer = 1  # Add a 1-second buffer on each side
-            ffmpeg.input(filename=hls_uri, strict="experimental", loglevel="quiet", ss=max(0, start - buffer), t=duration + 2 * buffer).output(
-                video_path, vcodec="libx264", acodec="aac", avoid_negative_ts="make_zero", fflags="+genpts"
-            ).run()
-
-            # Then trim the video more precisely
-            output_trimmed = f"{os.path.splitext(video_path)[0]}_trimmed.mp4"
-            ffmpeg.input(video_path, ss=buffer, t=duration).output(output_trimmed, vcodec="copy", acodec="copy").run()
-
-            # Replace the original file with the trimmed version
-            os.replace(output_trimmed, video_path)
-        except Exception as error:
-            error_response = {
-                "message": f"There was an error downloading the video with Video ID: {video_id} in Index ID: {index_id}. "
-                "Double check that the Video ID and Index ID are valid and correct.",
-                "error": str(error),
-            }
-            return error_response
+            output = json.loads(output)
+        except json.JSONDecodeError:
+            return []
+    if isinstance(output, dict):
+        output = output.get("results", [])
+    return output if isinstance(output, list) else []
 
-    return video_path
 
+async def download_m3u8_videos(
+    event: StreamEvent,
+    max_concurrent_downloads: int = SOURCE_DOWNLOAD_CONCURRENCY,
+    max_concurrent_trims: int = CLIP_TRIM_CONCURRENCY,
+    index_id: Union[str, None] = None,
+) -> List[Union[str, None]]:
+    """Materialize the clips of a video search as mp4 files in the media cache.
 
-def download_m3u8_videos(event):
-    """Download and trim M3U8 videos into mp4 files with caching and progress display.
+    Each source video is downloaded once no matter how many clips use it, with at most `max_concurrent_downloads`
+    downloads running at the same time. Clips are cut out of their source with `smart_cut` as soon as it is available, at
+    most `max_concurrent_trims` at a time, and cached under the same key as `download_video`, so an edit of the clips reuses
+    them. Clips that are already cached skip both steps.
 
-    mp4 files are sorted by start time, then trimmed by end time. they are put into filepath output/{session_id}
+    Args:
+        event (StreamEvent): The `on_tool_end` event of a video search.
+        index_id (str, optional): Index ID of clips that don't name their own, defaults to the index of the search.
+        max_concurrent_downloads (int): Maximum number of source videos downloaded at the same time.
+        max_concurrent_trims (int): Maximum number of clips trimmed at the same time.
+
+    Returns:
+        List[Union[str, None]]: The filepath of every clip in search result order, or None for clips that failed.
     """
-    # Create session directory if it doesn't exist
-    trimmed_filepath = "output/" + str(session_id)
-    source_filepath = "output/source"
-    os.makedirs(trimmed_filepath, exist_ok=True)
-    os.makedirs(source_filepath, exist_ok=True)
-    downloaded_videos = set()  # Cache of downloaded video URLs for this function call
-
-    for item in tqdm(json.loads(event["data"]["output"]), desc="Processing Videos"):
-        video_url = item.get("video_url")
-        video_id = item.get("video_id")
-
-        if (os.path.exists(os.path.join(source_filepath, f"{video_id}.mp4"))) or (video_id and video_id not in downloaded_videos):
-            start, end = item.get("start", 0), item.get("end")
-            source_file = os.path.join(source_filepath, f"{video_id}.mp4")
-
-            # Download video showing yt-dlp progress
-            subprocess.run(["yt-dlp", "-o", source_file, video_url, "--progress", "--quiet"])
-            downloaded_videos.add(video_id)
-
-        # Trim the video if end time is provided
-        if item.get("end") is not None:
-            start, end = item.get("start", 0), item.get("end")
-            output_file = os.path.join(source_filepath, f"{video_id}.mp4")
-            trimmed_file = os.path.join(trimmed_filepath, f"trimmed-{start}-{end}.mp4")
-            duration = end - start
-
-            # Run ffmpeg silently
-            subprocess.run([
-                "ffmpeg",
-                "-hide_banner",
-                "-loglevel",
-                "error",  # Only show errors
-                "-ss",
-                str(start),
-                "-i",
-                output_file,
-                "-t",
-                str(duration),
-                "-c",
-                "copy",
-                trimmed_file,
-            ])
+    items = [item for item in _search_results_from_event(event) if item.get("video_id") and item.get("video_url")]
+    search_index_id = index_id or (event["data"].get("input") or {}).get("index_id")
+    media_cache = get_media_cache()
+    download_semaphore = asyncio.Semaphore(max_concurrent_downloads)
+    trim_semaphore = asyncio.Semaphore(max_concurrent_trims)
+    source_downloads: Dict[str, asyncio.Task] = {}
+    progress_bar = tqdm.tqdm(total=len(items), desc="Processing Videos", unit="clip")
+
+    async def download_source(video_id: str, video_url: str) -> str:
+        async def fetch(output_path: str) -> None:
+            async with download_semaphore:
+                download_stream = ffmpeg.input(video_url, loglevel="error").output(output_path, c="copy", **{"bsf:a": "aac_adtstoasc"})
+                await run_ffmpeg(download_stream, label=f"download {video_id}")
+
+        return await media_cache.get_or_create(source_cache_key(video_id), fetch)
+
+    async def materialize(item: Dict) -> Union[str, None]:
+        video_id = item["video_id"]
+        start, end = item.get("start", 0), item.get("end")
+        clip_index_id = item.get("index_id") or search_index_id
+        if clip_index_id is not None:
+            # clips of an edit are Clip models with float times, so 5 and 5.0 must give the same key
+            clip_key = clip_cache_key(clip_index_id, video_id, float(start), float(end))
+        else:
+            # without an index the clip can't be shared with edits
+            clip_key = os.path.join("clips", f"{video_id}_{start}_{end}.mp4")
+        try:
+            if end is not None:
+                clip_path = await media_cache.lookup(clip_key)
+                if clip_path is not None:
+                    return clip_path
+
+            # dedupe source downloads per video_id, every clip of the video waits on the same task
+            if video_id not in source_downloads:
+                source_downloads[video_id] = asyncio.create_task(download_source(video_id, item["video_url"]))
+            source_path = await asyncio.shield(source_downloads[video_id])
+            if end is None:
+                return source_path
+
+            async def trim(output_path: str) -> None:
+                async with trim_semaphore:
+                    # cut exactly like download_video, a plain stream copy would snap the start to the previous keyframe
+                    await smart_cut(source_path, [(start, end)], output_path)
+
+            return await media_cache.get_or_create(clip_key, trim)
+        except Exception as error:
+            print(f"[ERROR] Failed to download clip {start}-{end} of Video ID {video_id}: {error}")
+            return None
+        finally:
+            progress_bar.update(1)
+
+    try:
+        return await asyncio.gather(*[materialize(item) for item in items])
+    finally:
+        for source_download in source_downloads.values():
+            source_download.cancel()
+        await asyncio.gather(*source_downloads.values(), return_exceptions=True)
+        progress_bar.close()